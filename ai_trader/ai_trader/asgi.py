@@ -13,4 +13,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ai_trader.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Django 应用加载完成后再导入 (realtime 依赖模型与配置)
+from market_scanner.realtime import websocket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """HTTP 交给 Django，WebSocket (/ws/events/) 交给实时推送端点"""
+    if scope['type'] == 'websocket':
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
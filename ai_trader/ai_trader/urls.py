@@ -33,9 +33,13 @@ urlpatterns = [
                   path('api/fetch-models/', views.fetch_external_models, name='fetch_models'),
                   path('api/save-settings/', views.save_settings, name='save_settings'),
                   path('api/save-strategy/', views.save_strategy_config, name='save_strategy'),
+                  path('api/history/', views.api_history, name='api_history'),
 
 
 path('trade/ticket/<int:record_id>/', views.trade_ticket_view, name='trade_ticket'),
 path('api/trade/execute/', views.execute_paper_order, name='execute_order'),
+path('metrics/', views.metrics_view, name='metrics'),
+path('ops/breakers/', views.ops_breakers, name='ops_breakers'),
+path('ops/scheduler/', views.ops_scheduler, name='ops_scheduler'),
 
               ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,260 @@
+# market_scanner/analysis_scheduler.py
+"""
+分析任务调度：走大模型的分析 (页面上传、自选股扫描) 共用本进程 ANALYSIS_SLOTS 个执行名额，按公平排队发放
+- 加权公平排队 (自计时 WFQ)：任务入队时打上虚拟完成时间 = max(当前虚拟时间, 该用户上一个任务的完成时间) + 代价 / 权重，
+  按完成时间从小到大发放。一次提交 500 张图的用户只是排在自己的任务后面，其他用户新来的任务照样插到前面
+- 每用户并发上限 (ANALYSIS_USER_CONCURRENCY)：轮到的任务其用户已占满时暂存在该用户名下，等他有任务结束再放回
+- 两个优先级：页面上的单张上传 (INTERACTIVE) 先于扫描等批量任务 (BATCH)；批量任务最多占用
+  ANALYSIS_SLOTS - ANALYSIS_INTERACTIVE_RESERVE 个名额，留出的名额让上传不必等批量任务跑完
+- 待发放任务放在堆里，入队与发放都是 O(log n)；排队时长按 用户 + 优先级 保留最近的样本，/ops/scheduler/ 查看分位数
+- 状态只在本进程内，多进程部署时各进程各自调度
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+from . import metrics
+
+INTERACTIVE, BATCH = 0, 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BATCH: 'batch'}
+
+QUEUED, GRANTED, RELEASED, CANCELLED = 'queued', 'granted', 'released', 'cancelled'
+
+
+class SchedulerTimeout(Exception):
+    """排队超时仍未拿到执行名额"""
+
+
+class Ticket:
+    """一次排队；发放后持有一个执行名额，用完必须 release"""
+    __slots__ = ('user', 'priority', 'finish', 'submitted', 'granted_at', 'state', 'notify')
+
+    def __init__(self, user, priority, finish, notify):
+        self.user = user
+        self.priority = priority
+        self.finish = finish          # 虚拟完成时间 (排序键)
+        self.submitted = time.monotonic()
+        self.granted_at = None
+        self.state = QUEUED
+        self.notify = notify
+
+    @property
+    def wait_seconds(self):
+        return (self.granted_at or time.monotonic()) - self.submitted
+
+
+class FairScheduler:
+    def __init__(self, slots, user_limit=None, weights=None, interactive_reserve=0, samples=1000):
+        self.slots = max(1, slots)
+        self.user_limit = max(1, user_limit or self.slots)
+        self.weights = dict(weights or {})
+        self.batch_slots = max(1, self.slots - interactive_reserve)
+
+        self._heap = []                          # (优先级, 虚拟完成时间, 序号, 票据)
+        self._seq = itertools.count()
+        self._virtual = {INTERACTIVE: 0.0, BATCH: 0.0}
+        self._last_finish = {}                   # (用户, 优先级) -> 该用户上一个任务的虚拟完成时间
+        self._parked = {}                        # 用户 -> 因并发上限暂存的堆条目 (小顶堆)
+        self._running = defaultdict(int)         # 用户 -> 执行中的任务数
+        self._running_total = 0
+        self._running_batch = 0
+        self._queued = 0
+        self._waits = defaultdict(lambda: deque(maxlen=samples))  # (用户, 优先级) -> 最近的排队秒数
+        self._lock = threading.Lock()
+
+    # === 调用方接口 ===
+    def submit(self, user, priority=BATCH, cost=1.0, notify=None):
+        """
+        入队 (不阻塞)，返回票据；轮到时调用 notify(ticket)
+        notify 在持锁时调用，只能做唤醒之类不阻塞的事
+        """
+        with self._lock:
+            key = (user, priority)
+            start = max(self._virtual[priority], self._last_finish.get(key, 0.0))
+            finish = self._last_finish[key] = start + cost / self.weights.get(user, 1)
+            ticket = Ticket(user, priority, finish, notify)
+            heapq.heappush(self._heap, (priority, finish, next(self._seq), ticket))
+            self._queued += 1
+            self._dispatch()
+        return ticket
+
+    def release(self, ticket):
+        """归还名额并发放给下一个任务；重复调用无副作用"""
+        with self._lock:
+            if ticket.state != GRANTED:
+                return
+            self._free(ticket)
+            self._dispatch()
+
+    def acquire(self, user, priority=BATCH, cost=1.0, timeout=None):
+        """阻塞直到拿到名额，返回票据；超时抛 SchedulerTimeout"""
+        granted = threading.Event()
+        ticket = self.submit(user, priority, cost, notify=lambda t: granted.set())
+        if not granted.wait(timeout) and self._cancel(ticket):
+            raise SchedulerTimeout(f"分析排队 {timeout} 秒仍未轮到，请稍后再试")
+        return ticket
+
+    async def aacquire(self, user, priority=INTERACTIVE, cost=1.0, timeout=None):
+        """acquire 的协程版本：排队期间不占用事件循环"""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+        ticket = self.submit(user, priority, cost, notify=lambda t: loop.call_soon_threadsafe(_resolve, granted))
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), timeout)
+        except asyncio.TimeoutError:
+            if self._cancel(ticket):
+                raise SchedulerTimeout(f"分析排队 {timeout} 秒仍未轮到，请稍后再试") from None
+        except asyncio.CancelledError:
+            if not self._cancel(ticket):
+                self.release(ticket)  # 已经发放但调用方不再需要
+            raise
+        return ticket
+
+    @contextmanager
+    def slot(self, user, priority=BATCH, cost=1.0, timeout=None):
+        ticket = self.acquire(user, priority, cost, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @asynccontextmanager
+    async def aslot(self, user, priority=INTERACTIVE, cost=1.0, timeout=None):
+        ticket = await self.aacquire(user, priority, cost, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    # === 内部 (调用时已持锁) ===
+    def _dispatch(self):
+        heap = self._heap
+        while heap and self._running_total < self.slots:
+            priority, _, _, ticket = heap[0]
+            if ticket.state == CANCELLED:
+                heapq.heappop(heap)
+                continue
+            if priority == BATCH and self._running_batch >= self.batch_slots:
+                break  # 堆顶已是批量任务，其后全是批量任务
+            entry = heapq.heappop(heap)
+            if self._running[ticket.user] >= self.user_limit:
+                heapq.heappush(self._parked.setdefault(ticket.user, []), entry)
+                continue
+            self._grant(ticket)
+
+    def _grant(self, ticket):
+        ticket.state = GRANTED
+        ticket.granted_at = time.monotonic()
+        self._queued -= 1
+        self._running[ticket.user] += 1
+        self._running_total += 1
+        if ticket.priority == BATCH:
+            self._running_batch += 1
+        self._virtual[ticket.priority] = max(self._virtual[ticket.priority], ticket.finish)
+        wait = ticket.granted_at - ticket.submitted
+        self._waits[(ticket.user, ticket.priority)].append(wait)
+        metrics.analysis_queue_wait.observe(wait, priority=PRIORITY_NAMES[ticket.priority])
+        if ticket.notify is not None:
+            try:
+                ticket.notify(ticket)
+            except RuntimeError:  # 等待方的事件循环已关闭，名额收回
+                self._free(ticket)
+
+    def _free(self, ticket):
+        ticket.state = RELEASED
+        user = ticket.user
+        self._running[user] -= 1
+        if not self._running[user]:
+            del self._running[user]
+        self._running_total -= 1
+        if ticket.priority == BATCH:
+            self._running_batch -= 1
+        # 该用户暂存的任务放回一个 (只有它可能因名额释放而变得可发放)
+        parked = self._parked.get(user)
+        while parked:
+            entry = heapq.heappop(parked)
+            if entry[3].state != CANCELLED:
+                heapq.heappush(self._heap, entry)
+                break
+        if parked is not None and not parked:
+            del self._parked[user]
+
+    def _cancel(self, ticket):
+        """放弃排队；返回 False 表示已经发放 (竞态：超时与发放同时发生)"""
+        with self._lock:
+            if ticket.state != QUEUED:
+                return False
+            ticket.state = CANCELLED
+            self._queued -= 1
+            return True
+
+    # === 观测 ===
+    def snapshot(self):
+        with self._lock:
+            waits = {key: sorted(samples) for key, samples in self._waits.items()}
+            state = {
+                'slots': self.slots,
+                'batch_slots': self.batch_slots,
+                'user_limit': self.user_limit,
+                'running': self._running_total,
+                'running_batch': self._running_batch,
+                'queued': self._queued,
+                'parked': sum(len(p) for p in self._parked.values()),
+                'running_by_user': {str(u): n for u, n in self._running.items()},
+            }
+        users = {}
+        for (user, priority), samples in waits.items():
+            users.setdefault(str(user), {})[PRIORITY_NAMES[priority]] = wait_summary(samples)
+        state['wait_seconds'] = users
+        return state
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def wait_summary(samples):
+    """排队秒数的分位数 (samples 已排序)"""
+    if not samples:
+        return {'samples': 0}
+    def pick(p):
+        return round(samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))], 4)
+    return {'samples': len(samples), 'p50': pick(50), 'p90': pick(90), 'p99': pick(99), 'max': round(samples[-1], 4)}
+
+
+# === 进程内共享实例 ===
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = FairScheduler(
+                    slots=getattr(settings, 'ANALYSIS_SLOTS', 8),
+                    user_limit=getattr(settings, 'ANALYSIS_USER_CONCURRENCY', 4),
+                    weights=getattr(settings, 'ANALYSIS_USER_WEIGHTS', {}),
+                    interactive_reserve=getattr(settings, 'ANALYSIS_INTERACTIVE_RESERVE', 2),
+                )
+    return _scheduler
+
+
+def reset():
+    """按当前配置重建共享实例 (已发放的票据仍归还给旧实例)"""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = None
+
+
+def user_key(user):
+    """调度与权重配置按用户名区分"""
+    return getattr(user, 'username', None) or str(user)
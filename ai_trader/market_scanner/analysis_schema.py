@@ -0,0 +1,266 @@
+# market_scanner/analysis_schema.py
+"""
+大模型分析输出的容错解码与结构校验
+- decode：先用快速解码器 (装了 orjson 就用 orjson) 直接解析；失败再去掉代码块标记、前后说明文字、
+  多余的尾逗号，并补全被截断的 JSON (未闭合的字符串 / 数组 / 对象，必要时退回到最后一个完整字段)
+- validate：按提示词模板 (prompts) 中的字段定义校验并纠正类型：枚举大小写与常见同义词、0-100 的分值、
+  价位数组 (字符串 / 单个数值 / 占位 0 值)；关键字段无法识别时列为缺失，由调用方只就这些字段补问模型
+"""
+import json
+import re
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，没有时用标准库
+    orjson = None
+
+# 缺失时需要补问模型的字段 (策略引擎判定依赖它们)；其余字段缺失时填默认值
+REQUIRED = ('signal', 'trend', 'score', 'confidence')
+
+ENUMS = {
+    'trend': ('Up', 'Down', 'Range'),
+    'trend_stage': ('Early', 'Middle', 'Accelerating', 'Exhaustion', 'Unknown'),
+    'ma_structure': ('Bullish', 'Bearish', 'Mixed', 'Tangled'),
+    'price_ma_deviation': ('Low', 'Medium', 'High'),
+    'volume_state': ('Expanding', 'Contracting', 'Neutral', 'Abnormal'),
+    'volatility_status': ('Low', 'Normal', 'High'),
+    'signal': ('BUY', 'SELL', 'WAIT'),
+    'signal_applicable_to': ('Holder', 'NonHolder', 'Both'),
+}
+
+# 模型常见的同义写法 (小写) -> 标准值
+SYNONYMS = {
+    'trend': {'uptrend': 'Up', 'bullish': 'Up', 'rising': 'Up', '上涨': 'Up', '上升': 'Up',
+              'downtrend': 'Down', 'bearish': 'Down', 'falling': 'Down', '下跌': 'Down', '下降': 'Down',
+              'sideways': 'Range', 'ranging': 'Range', 'consolidation': 'Range', '震荡': 'Range', '横盘': 'Range'},
+    'signal': {'hold': 'WAIT', 'neutral': 'WAIT', 'none': 'WAIT', '观望': 'WAIT', '持有': 'WAIT',
+               'long': 'BUY', '买入': 'BUY', 'short': 'SELL', '卖出': 'SELL'},
+    'signal_applicable_to': {'non-holder': 'NonHolder', 'non_holder': 'NonHolder', 'all': 'Both'},
+    'ma_structure': {'bullish alignment': 'Bullish', 'bearish alignment': 'Bearish', '多头': 'Bullish',
+                     '空头': 'Bearish', '缠绕': 'Tangled'},
+    'volatility_status': {'medium': 'Normal', 'moderate': 'Normal'},
+    'price_ma_deviation': {'moderate': 'Medium', 'normal': 'Medium'},
+}
+
+SCORES = ('score', 'confidence')          # 0-100 的整数
+LEVELS = ('support_levels', 'resistance_levels')
+KEY_LEVELS = ('short_term_hold', 'trend_invalid')
+
+DEFAULTS = {
+    'symbol': 'Unknown', 'trend_stage': 'Unknown', 'primary_pattern': 'None', 'ma_structure': 'Mixed',
+    'price_ma_deviation': 'Low', 'volume_state': 'Neutral', 'volatility_status': 'Normal',
+    'signal_applicable_to': 'Both', 'reason': '',
+}
+
+_FENCE = re.compile(r'```[a-zA-Z]*')
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+_NUMBER = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+# === 解码 ===
+def _loads(text):
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass  # orjson 不接受 NaN 等标准库容忍的写法，交给标准库再试一次
+    return json.loads(text)
+
+
+def decode(text):
+    """
+    容错解析模型输出
+    :return: (对象或 None, 是否经过修复)
+    """
+    if not isinstance(text, (str, bytes)):
+        return None, False
+    if isinstance(text, bytes):
+        text = text.decode('utf-8', errors='replace')
+    try:
+        return _loads(text), False
+    except ValueError:
+        pass
+
+    text = _FENCE.sub('', text).lstrip('\ufeff')
+    start = text.find('{')
+    if start < 0:
+        return None, True
+    data = _scan(text, start)
+    return data, True
+
+
+def _scan(text, start):
+    """
+    从第一个 '{' 起扫描：括号配平即截取到此处 (丢弃后缀说明)；到结尾仍未配平视为截断，
+    依次尝试 直接补全括号 与 退回到较近的几个字段边界再补全
+    """
+    stack, in_string, escape = [], False, False
+    cuts = []  # (位置, 当时未闭合的括号) 字段边界：逗号之前
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                in_string = False
+            continue
+        if c == '"':
+            in_string = True
+        elif c in '{[':
+            stack.append(c)
+        elif c in '}]':
+            if not stack:
+                break
+            stack.pop()
+            if not stack:
+                return _try(text[start:i + 1])
+        elif c == ',':
+            cuts.append((i, ''.join(stack)))
+
+    body = text[start:].rstrip()
+    if in_string:
+        body += '"'
+    complete = (body, ''.join(stack))
+    earlier = [(text[start:pos], opened) for pos, opened in reversed(cuts[-8:])]
+    # 截断在数字中间 (75 只剩 7) 时最后一个值不可信，优先丢掉它；字符串截断保留已有部分
+    candidates = earlier + [complete] if body[-1:].isdigit() or body[-1:] in '.-' else [complete] + earlier
+    for fragment, opened in candidates:
+        data = _try(fragment.rstrip().rstrip(',:') + _closers(opened))
+        if data is not None:
+            return data
+    return None
+
+
+def _closers(opened):
+    return ''.join('}' if c == '{' else ']' for c in reversed(opened))
+
+
+def _try(fragment):
+    for candidate in (fragment, _TRAILING_COMMA.sub(r'\1', fragment)):
+        try:
+            return _loads(candidate)
+        except ValueError:
+            continue
+    return None
+
+
+# === 校验与纠正 ===
+def _enum(field, value):
+    if not isinstance(value, str):
+        return None
+    allowed = ENUMS[field]
+    text = value.strip()
+    lowered = text.lower()
+    for option in allowed:
+        if lowered == option.lower():
+            return option
+    synonym = SYNONYMS.get(field, {}).get(lowered)
+    if synonym:
+        return synonym
+    # "BUY (轻仓)"、"Up/Range" 之类：取第一个出现的合法取值
+    hits = sorted((lowered.find(option.lower()), option) for option in allowed if option.lower() in lowered)
+    return hits[0][1] if hits else None
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        match = _NUMBER.search(value.replace(',', ''))
+        return float(match.group()) if match else None
+    return None
+
+
+def _score(value):
+    number = _number(value)
+    if number is None:
+        return None
+    if isinstance(value, float) and 0 < number < 1:
+        number *= 100  # 0.85 这类小数当作百分比
+    return int(round(min(max(number, 0), 100)))
+
+
+def _levels(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = _NUMBER.findall(value.replace(',', ' '))
+    elif not isinstance(value, (list, tuple)):
+        value = [value]
+    levels = []
+    for item in value:
+        number = _number(item)
+        if number is not None and number > 0 and round(number, 2) not in levels:  # 0.0 是提示词里的占位值
+            levels.append(round(number, 2))
+    return levels
+
+
+def validate(data):
+    """
+    :return: (纠正后的结果, 缺失的关键字段列表, 被纠正的字段列表)
+    结果保留原对象中未定义的字段；非关键字段缺失或非法时填默认值
+    """
+    result = dict(data)
+    missing, coerced = [], []
+
+    def settle(field, value, default=None):
+        raw = data.get(field)
+        if value is None:
+            if field in REQUIRED:
+                result.pop(field, None)
+                missing.append(field)
+                return
+            value = default
+        if field in data and value != raw:
+            coerced.append(field)
+        result[field] = value
+
+    for field in ENUMS:
+        settle(field, _enum(field, data.get(field)), DEFAULTS.get(field))
+    for field in SCORES:
+        settle(field, _score(data.get(field)))
+    levels = {field: _levels(data.get(field)) for field in LEVELS}
+    settle('support_levels', sorted(levels['support_levels'], reverse=True))   # 由近及远
+    settle('resistance_levels', sorted(levels['resistance_levels']))
+
+    key_levels = data.get('key_levels') if isinstance(data.get('key_levels'), dict) else {}
+    settle('key_levels', {name: round(max(_number(key_levels.get(name)) or 0.0, 0.0), 2) for name in KEY_LEVELS})
+
+    risks = data.get('risk_factors')
+    if isinstance(risks, str):
+        risks = [risks] if risks.strip() else []
+    settle('risk_factors', [str(r) for r in risks if r] if isinstance(risks, (list, tuple)) else [])
+
+    for field in ('symbol', 'primary_pattern', 'reason'):
+        value = data.get(field)
+        settle(field, str(value).strip() if value not in (None, '') and not isinstance(value, (dict, list)) else None,
+               DEFAULTS[field])
+    return result, missing, coerced
+
+
+def interpret(text):
+    """
+    解码 + 校验
+    :return: (结果, 缺失的关键字段, 是否经过修复或纠正)；完全无法解码时结果为 {}、关键字段全部缺失
+    """
+    data, repaired = decode(text)
+    if not isinstance(data, dict):
+        return {}, list(REQUIRED), True
+    result, missing, coerced = validate(data)
+    return result, missing, repaired or bool(coerced)
+
+
+def merge(result, missing, text):
+    """把补问得到的字段并入结果，返回仍然缺失的字段"""
+    data, _ = decode(text)
+    if not isinstance(data, dict):
+        return list(missing)
+    supplement, still_missing, _ = validate(data)
+    for field in missing:
+        if field not in still_missing:
+            result[field] = supplement[field]
+    return [field for field in missing if field in still_missing]
@@ -0,0 +1,68 @@
+# market_scanner/bench.py
+"""压测命令共用的小工具：临时数据库、分位数统计、结果落盘"""
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def temporary_database(keep=False):
+    """
+    在临时 SQLite 文件上建一套完整表结构，退出时销毁
+    用文件而不是内存库，以便多个线程各自持有连接并发读写
+    同时启用测试环境 (允许 django.test.Client 的 testserver 主机名等)
+    """
+    setup_test_environment()
+    fd, path = tempfile.mkstemp(prefix='ai_trader_bench_', suffix='.sqlite3')
+    os.close(fd)
+    os.remove(path)
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_name, old_test_name = connection.settings_dict['NAME'], test_settings.get('NAME')
+    test_settings['NAME'] = path
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield path
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keep)
+        test_settings['NAME'] = old_test_name
+        teardown_test_environment()
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """返回 {'p50': ..., 'p90': ..., 'p99': ..., 'max': ..., 'mean': ...} (单位与输入一致)"""
+    if not samples:
+        return {}
+    data = sorted(samples)
+    result = {f"p{p}": data[min(len(data) - 1, int(round(p / 100 * (len(data) - 1))))] for p in points}
+    result['max'] = data[-1]
+    result['mean'] = sum(data) / len(data)
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path, name, results):
+    """把结果连同环境信息写成 JSON，便于跨提交对比"""
+    payload = {
+        'benchmark': name,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'results': results,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+    return payload
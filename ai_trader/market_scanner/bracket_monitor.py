@@ -0,0 +1,135 @@
+# market_scanner/bracket_monitor.py
+import heapq
+import itertools
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.db.models import Q
+
+from . import fragment_cache
+from .models import PaperOrder
+
+
+@dataclass(slots=True)
+class Bracket:
+    """一笔已成交多头开仓单上挂着的止损/止盈"""
+    order_id: int
+    user_id: int
+    symbol: str
+    quantity: int
+    stop_loss: float = None
+    take_profit: float = None
+    fired: bool = False
+
+
+class SymbolBrackets:
+    """
+    单标的的触发价索引
+    - 止损：价格 <= 止损价 触发，按止损价建大顶堆，堆顶即最先被击穿的一档
+    - 止盈：价格 >= 止盈价 触发，按止盈价建小顶堆
+    每笔行情只需看两个堆顶，触发 k 笔的代价为 O(k log n)；
+    一侧触发后另一侧以 fired 标记惰性删除
+    """
+
+    __slots__ = ('stops', 'targets')
+
+    def __init__(self):
+        self.stops = []
+        self.targets = []
+
+    def add(self, bracket, seq):
+        if bracket.stop_loss:
+            heapq.heappush(self.stops, (-bracket.stop_loss, seq, bracket))
+        if bracket.take_profit:
+            heapq.heappush(self.targets, (bracket.take_profit, seq, bracket))
+
+    def triggered(self, price):
+        hits = []
+        stops, targets = self.stops, self.targets
+        while stops and -stops[0][0] >= price:
+            _, _, bracket = heapq.heappop(stops)
+            if not bracket.fired:
+                bracket.fired = True
+                hits.append((bracket, 'STOP_LOSS', bracket.stop_loss))
+        while targets and targets[0][0] <= price:
+            _, _, bracket = heapq.heappop(targets)
+            if not bracket.fired:
+                bracket.fired = True
+                hits.append((bracket, 'TAKE_PROFIT', bracket.take_profit))
+        return hits
+
+    def __len__(self):
+        return len(self.stops) + len(self.targets)
+
+
+class BracketMonitor:
+    """
+    止损/止盈监控：按标的维护触发价索引，每笔行情只做区间查找，不扫描全部订单
+    触发后生成平仓卖单 (止损为市价单，止盈为止盈价的限价单)，交给撮合引擎成交
+    """
+
+    def __init__(self):
+        self.books = {}
+        self.armed = {}
+        self._seq = itertools.count()
+
+    def arm(self, bracket):
+        if not (bracket.stop_loss or bracket.take_profit) or bracket.order_id in self.armed:
+            return
+        self.armed[bracket.order_id] = bracket
+        book = self.books.get(bracket.symbol)
+        if book is None:
+            book = self.books[bracket.symbol] = SymbolBrackets()
+        book.add(bracket, next(self._seq))
+
+    def disarm(self, order_id):
+        bracket = self.armed.pop(order_id, None)
+        if bracket:
+            bracket.fired = True
+
+    def load_armed(self):
+        """装载所有已成交、带止损/止盈且尚未生成平仓单的买入开仓单"""
+        rows = (PaperOrder.objects
+                .filter(direction='BUY', status='FILLED', exit_orders__isnull=True)
+                .filter(Q(stop_loss__gt=0) | Q(take_profit__gt=0))
+                .values_list('id', 'user_id', 'symbol', 'filled_quantity', 'stop_loss', 'take_profit'))
+        for order_id, user_id, symbol, qty, sl, tp in rows.iterator(chunk_size=5000):
+            self.arm(Bracket(order_id=order_id, user_id=user_id, symbol=symbol, quantity=qty,
+                             stop_loss=float(sl) if sl else None, take_profit=float(tp) if tp else None))
+        return len(self.armed)
+
+    def on_price(self, symbol, price):
+        """
+        :return: [(Bracket, 'STOP_LOSS'/'TAKE_PROFIT', 触发价), ...]
+        """
+        book = self.books.get(symbol)
+        if book is None:
+            return []
+        hits = book.triggered(price)
+        for bracket, _, _ in hits:
+            self.armed.pop(bracket.order_id, None)
+        if not len(book):
+            del self.books[symbol]
+        return hits
+
+    @staticmethod
+    def create_exit_orders(hits):
+        """把触发结果批量落成 PENDING 平仓卖单"""
+        orders = [
+            PaperOrder(
+                user_id=bracket.user_id,
+                symbol=bracket.symbol,
+                direction='SELL',
+                order_type='MARKET' if reason == 'STOP_LOSS' else 'LIMIT',
+                quantity=bracket.quantity,
+                price=Decimal(str(level)),
+                status='PENDING',
+                commission=0,
+                parent_order_id=bracket.order_id,
+                exit_reason=reason,
+            )
+            for bracket, reason, level in hits
+        ]
+        created = PaperOrder.objects.bulk_create(orders)
+        fragment_cache.bump([o.user_id for o in created])
+        return created
@@ -0,0 +1,335 @@
+# market_scanner/broker_gateway.py
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .gtja_api import get_client, account_key
+from .models import PaperOrder, OrderFill, VirtualAccount
+from .positions import apply_fills
+from . import fragment_cache
+from .realtime import order_event, publish_batch_on_commit
+
+logger = logging.getLogger(__name__)
+
+# 券商委托状态 -> PaperOrder.status
+BROKER_STATUS_MAP = {
+    "submitted": "PENDING",
+    "partial": "PARTIAL",
+    "filled": "FILLED",
+    "canceled": "CANCELED",
+    "rejected": "REJECTED",
+}
+FINAL_STATUSES = ("FILLED", "CANCELED", "REJECTED")
+PRICE_QUANT = Decimal('0.0001')
+
+
+@dataclass
+class _Submission:
+    symbol: str
+    price: Decimal
+    quantity: int
+    direction: str
+    future: Future
+    paper_order: object = None
+
+
+@dataclass
+class _LiveOrder:
+    paper_order_id: int
+    user_id: int
+    symbol: str
+    direction: str
+    filled: int = 0
+
+
+class BrokerGateway:
+    """
+    实盘委托网关
+    - 下单：同一账户在 batch_window 秒内到达的委托合并成一次批量下单请求
+    - 状态：所有在途委托由一个后台线程按 poll_interval 合并批量查询，
+      状态与增量成交批量写回 PaperOrder / OrderFill / 持仓
+    """
+
+    def __init__(self, batch_window=None, max_batch=None, poll_interval=None, client_factory=get_client):
+        self.batch_window = batch_window if batch_window is not None else getattr(settings, 'BROKER_BATCH_WINDOW', 0.02)
+        self.max_batch = max_batch or getattr(settings, 'BROKER_MAX_BATCH', 50)
+        self.poll_interval = poll_interval or getattr(settings, 'BROKER_POLL_INTERVAL', 1.0)
+        self.client_factory = client_factory
+        self._senders = ThreadPoolExecutor(getattr(settings, 'BROKER_DISPATCH_WORKERS', 8),
+                                           thread_name_prefix="broker-gateway-send")
+
+        self._cond = threading.Condition()
+        self._queues = defaultdict(list)   # 账户键 -> [_Submission]
+        self._accounts = {}                # 账户键 -> VirtualAccount
+        self._live = defaultdict(dict)     # 账户键 -> {券商合同号: _LiveOrder}
+        self._live_lock = threading.Lock()
+        self._threads = []
+        self._stopped = False
+        self.stats = defaultdict(int)
+
+    # === 生命周期 ===
+    def start(self):
+        if not self._threads:
+            for target in (self._dispatch_loop, self._poll_loop):
+                t = threading.Thread(target=target, daemon=True, name=f"broker-gateway-{target.__name__}")
+                t.start()
+                self._threads.append(t)
+        return self
+
+    def stop(self, timeout=None):
+        """停止后台线程；给出 timeout 时等待进行中的批量请求/轮询结束"""
+        self._stopped = True
+        with self._cond:
+            self._cond.notify_all()
+        self._senders.shutdown(wait=False)
+        if timeout:
+            for t in self._threads:
+                t.join(timeout)
+
+    # === 下单 ===
+    def submit(self, account, symbol, price, quantity, direction, paper_order=None):
+        """
+        排队等待批量下单，返回 Future，结果为券商对该笔委托的应答 (含 order_id)、
+        错误 dict，或 status=unknown (可能已送达但没有应答，不重试)
+        :param paper_order: 已落库的 PENDING 委托；应答到达时由网关回填合同号并开始跟踪，
+                            调用方放弃等待 (超时) 也不会丢下券商侧已成立的委托
+        """
+        future = Future()
+        key = account_key(account)
+        with self._cond:
+            self._accounts[key] = account
+            self._queues[key].append(_Submission(symbol, price, quantity, direction, future, paper_order))
+            self._cond.notify()
+        return future
+
+    def _dispatch_loop(self):
+        while not self._stopped:
+            with self._cond:
+                while not self._stopped and not any(self._queues.values()):
+                    self._cond.wait()
+            # 第一笔到达后再等一个窗口，让同时触发的信号凑成一批
+            time.sleep(self.batch_window)
+            with self._cond:
+                batches = {k: q for k, q in self._queues.items() if q}
+                self._queues = defaultdict(list)
+                accounts = dict(self._accounts)
+            # 不同账户的批次互不依赖，交给线程池并发发送，避免慢账户拖住整个窗口
+            for key, submissions in batches.items():
+                for start in range(0, len(submissions), self.max_batch):
+                    self._senders.submit(self._send_batch, accounts[key], submissions[start:start + self.max_batch])
+
+    def _send_batch(self, account, submissions):
+        client = self.client_factory(account)
+        try:
+            results = client.place_orders([
+                dict(symbol=s.symbol, price=s.price, quantity=s.quantity, direction=s.direction)
+                for s in submissions
+            ])
+        except Exception as e:
+            results = {"status": "error", "message": str(e)}
+
+        with self._cond:
+            self.stats['batches'] += 1
+            self.stats['orders'] += len(submissions)
+        if isinstance(results, dict):  # 整批失败
+            results = [results] * len(submissions)
+        try:
+            for s, result in zip(submissions, results):
+                if result.get("status") == "unknown":
+                    pass  # 结果未知原样交给调用方对账，不能当作拒单
+                elif result.get("status") in ("rejected", "error") or not result.get("order_id"):
+                    message = result.get("msg") or result.get("message") or "券商未返回合同号"
+                    result = {"status": "error", "message": message}
+                if s.paper_order is not None:
+                    self._record(account, s.paper_order, result)
+                s.future.set_result(result)
+        finally:
+            close_old_connections()
+
+    def _record(self, account, order, result):
+        """把券商应答写回预先落库的委托：回填合同号并跟踪 / 标记拒单 / 结果未知留待对账"""
+        try:
+            if result.get("order_id"):
+                order.broker_order_id = result["order_id"]
+                PaperOrder.objects.filter(pk=order.pk).update(broker_order_id=order.broker_order_id)
+                self.track(account, order)
+                return
+            if result.get("status") == "unknown":
+                logger.error(f"实盘委托 #{order.pk} 结果未知，需在券商端核对: {result.get('message')}")
+                return
+            PaperOrder.objects.filter(pk=order.pk, status='PENDING').update(status='REJECTED')
+            publish_batch_on_commit([(order.user_id, order_event(order.pk, order.symbol, order.direction,
+                                                                 'REJECTED', 0, None))])
+            fragment_cache.bump([order.user_id])
+        except Exception as e:
+            logger.error(f"实盘委托 #{order.pk} 回写券商应答失败: {e}")
+
+    # === 状态跟踪 ===
+    def track(self, account, paper_order):
+        """登记一笔在途实盘委托，由轮询线程跟进状态"""
+        with self._live_lock:
+            self._accounts.setdefault(account_key(account), account)
+            self._live[account_key(account)][paper_order.broker_order_id] = _LiveOrder(
+                paper_order_id=paper_order.id, user_id=paper_order.user_id, symbol=paper_order.symbol,
+                direction=paper_order.direction, filled=paper_order.filled_quantity,
+            )
+
+    def load_live(self):
+        """从数据库恢复在途实盘委托 (进程重启后调用)"""
+        rows = (PaperOrder.objects.filter(status__in=['PENDING', 'PARTIAL']).exclude(broker_order_id='')
+                .select_related('user__virtualaccount'))
+        count = 0
+        for order in rows.iterator(chunk_size=2000):
+            try:
+                account = order.user.virtualaccount
+            except VirtualAccount.DoesNotExist:
+                continue
+            self.track(account, order)
+            count += 1
+        return count
+
+    def live_count(self):
+        with self._live_lock:
+            return sum(len(v) for v in self._live.values())
+
+    def _poll_loop(self):
+        while not self._stopped:
+            time.sleep(self.poll_interval)
+            if self._stopped:
+                break
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.error(f"委托状态轮询失败: {e}")
+            finally:
+                close_old_connections()
+
+    def poll_once(self):
+        """对所有账户的在途委托做一轮合并查询，返回本轮更新的委托数"""
+        with self._live_lock:
+            snapshot = {k: dict(v) for k, v in self._live.items() if v}
+            accounts = dict(self._accounts)
+
+        updates = []
+        for key, live in snapshot.items():
+            client = self.client_factory(accounts[key])
+            if not client.batch_orders:
+                continue  # 没有可用的委托查询接口
+            ids = list(live)
+            for start in range(0, len(ids), self.max_batch):
+                rows = client.query_orders(ids[start:start + self.max_batch])
+                self.stats['polls'] += 1
+                if isinstance(rows, dict):
+                    logger.warning(f"批量查询委托失败: {rows.get('message')}")
+                    continue
+                for row in rows:
+                    tracked = live.get(row.get("order_id"))
+                    status = BROKER_STATUS_MAP.get(row.get("status"))
+                    if tracked is None or status is None:
+                        continue
+                    filled = int(row.get("filled_amount") or 0)
+                    if filled <= tracked.filled and status == 'PENDING':
+                        continue
+                    updates.append((key, row["order_id"], tracked, status, filled,
+                                    Decimal(str(row.get("avg_price") or 0))))
+
+        if updates:
+            self._persist(updates)
+        return len(updates)
+
+    @staticmethod
+    def _fill_price(prev_filled, prev_avg, filled, avg):
+        """券商返回累计成交与均价，反推本轮增量成交的均价"""
+        return ((avg * filled - prev_avg * prev_filled) / (filled - prev_filled)).quantize(PRICE_QUANT)
+
+    def _persist(self, updates):
+        """
+        增量成交以数据库里的 filled_quantity 为准 (在行锁内比较)，而不是本进程内存里的进度：
+        Web 进程与 poll_broker_orders 可能同时轮询同一笔委托，按内存进度计算会把同一笔成交重复入账
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            rows = PaperOrder.objects.select_for_update().in_bulk([u[2].paper_order_id for u in updates])
+            fills, synced, writes = [], [], []
+            for update in updates:
+                key, broker_id, tracked, status, filled, avg = update
+                row = rows.get(tracked.paper_order_id)
+                if row is None:
+                    continue
+                if row.status in FINAL_STATUSES or (row.status == status and row.filled_quantity >= filled):
+                    synced.append((update, row.status, row.filled_quantity))  # 其他进程已经写过
+                    continue
+                if filled > row.filled_quantity:
+                    price = self._fill_price(row.filled_quantity, row.avg_fill_price or Decimal('0'), filled, avg)
+                    fills.append((update, filled - row.filled_quantity, price))
+                else:
+                    writes.append(update)
+
+            outcomes = apply_fills([(u[2].user_id, u[2].symbol, u[2].direction, qty, price, 0)
+                                    for u, qty, price in fills])
+            applied = []
+            for (update, qty, price), error in zip(fills, outcomes):
+                if error is not None:
+                    # 不写状态、不推进进度，下一轮重新计算
+                    logger.warning(f"实盘委托 #{update[2].paper_order_id} 成交入账失败: {error}")
+                    continue
+                applied.append((update, qty, price))
+                writes.append(update)
+
+            OrderFill.objects.bulk_create([
+                OrderFill(order_id=u[2].paper_order_id, quantity=qty, price=price, commission=0, filled_at=now)
+                for u, qty, price in applied
+            ])
+            PaperOrder.objects.bulk_update([
+                PaperOrder(id=t.paper_order_id, status=status, filled_quantity=filled,
+                           avg_fill_price=avg.quantize(PRICE_QUANT) if filled else None)
+                for _, _, t, status, filled, avg in writes
+            ], ['status', 'filled_quantity', 'avg_fill_price'])
+            publish_batch_on_commit([
+                (t.user_id, order_event(t.paper_order_id, t.symbol, t.direction, status, filled,
+                                        avg.quantize(PRICE_QUANT) if filled else None))
+                for _, _, t, status, filled, avg in writes
+            ])
+            fragment_cache.bump([u[2].user_id for u in writes])
+
+        # 落库成功后再推进内存里的成交进度 (入账失败的委托不推进)
+        progress = [(u, u[3], u[4]) for u in writes] + synced
+        with self._live_lock:
+            for (key, broker_id, tracked, *_), status, filled in progress:
+                tracked.filled = filled
+                if status in FINAL_STATUSES:
+                    self._live[key].pop(broker_id, None)
+        self.stats['status_updates'] += len(writes)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """进程级共享网关 (首次使用时启动后台线程并恢复在途委托)"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                gateway = BrokerGateway().start()
+                gateway.load_live()
+                _gateway = gateway
+    return _gateway
+
+
+def reset_gateway():
+    """停止并丢弃共享网关 (压测或修改券商配置后使用)"""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is not None:
+            _gateway.stop(timeout=10)
+        _gateway = None
@@ -0,0 +1,247 @@
+# market_scanner/broker_sim.py
+"""
+本地 GTJA 券商替身：实现 GTJAClient 用到的开放平台接口，用于联调与压测，不会触达真实券商
+- 校验 sign_params 签名与时间戳
+- 可注入 固定/抖动延迟、业务拒单、超时 (挂起不应答)
+"""
+import itertools
+import json
+import random
+import secrets
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from .gtja_api import sign_params
+
+# 时间戳允许的最大偏差 (毫秒)
+MAX_CLOCK_SKEW_MS = 5 * 60 * 1000
+# 会被注入拒单/超时的交易类接口
+TRADE_ENDPOINTS = ("/api/trade/order/place", "/api/trade/order/batch_place")
+
+
+class BrokerState:
+    """替身内部状态：令牌、委托、资产 (线程安全)"""
+
+    def __init__(self, token_ttl=7200, cash=1000000.0, fill_delay=0.5, app_secrets=None,
+                 latency_ms=0, jitter_ms=0, reject_rate=0.0, timeout_rate=0.0, hang_seconds=15.0, seed=None,
+                 require_token=False):
+        """
+        :param app_secrets: {app_id: app_secret}；为 None 时不校验签名
+        :param require_token: 业务请求必须带有效令牌 (对应 GTJA_TOKEN_AUTH)；否则只校验带上来的令牌
+        :param latency_ms / jitter_ms: 每个请求的固定延迟与 [0, jitter] 均匀抖动
+        :param reject_rate: 交易接口按概率返回业务拒单
+        :param timeout_rate: 交易接口按概率挂起 hang_seconds 秒后才应答 (模拟超时)
+        """
+        self.lock = threading.Lock()
+        self.fill_delay = fill_delay
+        self.app_secrets = app_secrets
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.reject_rate = reject_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.require_token = require_token
+        self.random = random.Random(seed)
+        self.token_ttl = token_ttl
+        self.tokens = {}
+        self.orders = {}
+        self.cash = cash
+        self.order_ids = itertools.count(1)
+        self.fail_queue = []
+        self.requests = 0
+        self.placed = 0
+        self.calls = Counter()  # 按接口统计请求次数
+
+    def verify(self, params):
+        """校验签名与时间戳，通过返回 None，否则返回错误应答"""
+        if self.app_secrets is None:
+            return None
+        secret = self.app_secrets.get(params.get("app_id"))
+        if secret is None:
+            return {"code": "E0001", "msg": "invalid app_id"}
+        if params.get("sign") != sign_params(params, secret):
+            return {"code": "E0002", "msg": "invalid signature"}
+        try:
+            skew = abs(time.time() * 1000 - int(params.get("timestamp", 0)))
+        except ValueError:
+            skew = MAX_CLOCK_SKEW_MS + 1
+        if skew > MAX_CLOCK_SKEW_MS:
+            return {"code": "E0003", "msg": "timestamp expired"}
+        return None
+
+    def delay(self):
+        """按配置的延迟与抖动阻塞当前请求线程"""
+        if self.latency_ms or self.jitter_ms:
+            with self.lock:
+                jitter = self.random.uniform(0, self.jitter_ms)
+            time.sleep((self.latency_ms + jitter) / 1000)
+
+    def roll(self):
+        """交易接口的故障注入：返回 'timeout' / 'reject' / None"""
+        with self.lock:
+            r = self.random.random()
+        if r < self.timeout_rate:
+            return "timeout"
+        if r < self.timeout_rate + self.reject_rate:
+            return "reject"
+        return None
+
+    def issue_token(self):
+        token = secrets.token_hex(16)
+        with self.lock:
+            self.tokens[token] = time.time() + self.token_ttl
+        return {"access_token": token, "expires_in": self.token_ttl}
+
+    def token_valid(self, token):
+        with self.lock:
+            return self.tokens.get(token, 0) > time.time()
+
+    def expire_tokens(self):
+        with self.lock:
+            self.tokens.clear()
+
+    def fail_next(self, count=1, status=503):
+        """让接下来 count 个业务请求返回指定 HTTP 状态码 (用于验证重试)"""
+        with self.lock:
+            self.fail_queue.extend([status] * count)
+
+    def take_failure(self):
+        with self.lock:
+            self.requests += 1
+            return self.fail_queue.pop(0) if self.fail_queue else None
+
+    def place(self, params):
+        with self.lock:
+            order_id = f"SIM{next(self.order_ids):08d}"
+            order = {
+                "order_id": order_id,
+                "stock_code": params.get("stock_code"),
+                "price": params.get("price"),
+                "amount": params.get("amount"),
+                "trade_direction": params.get("trade_direction"),
+                "status": "submitted",
+                "filled_amount": 0,
+                "avg_price": 0.0,
+                "created": time.time(),
+            }
+            self.orders[order_id] = order
+            self.placed += 1
+            return order
+
+    def query(self, order_id):
+        """委托推进：fill_delay 的一半时成交一半，满 fill_delay 时全部按委托价成交"""
+        with self.lock:
+            order = self.orders.get(order_id)
+            if order is None:
+                return {"order_id": order_id, "status": "unknown"}
+            age = time.time() - order["created"]
+            amount = int(order["amount"])
+            if order["status"] in ("submitted", "partial") and self.fill_delay >= 0:
+                if age >= self.fill_delay:
+                    order.update(status="filled", filled_amount=amount, avg_price=float(order["price"]))
+                elif age >= self.fill_delay / 2:
+                    order.update(status="partial", filled_amount=amount // 2, avg_price=float(order["price"]))
+            return {k: order[k] for k in ("order_id", "status", "filled_amount", "avg_price")}
+
+    def assets(self):
+        with self.lock:
+            return {"cash": round(self.cash, 2), "order_count": len(self.orders)}
+
+
+class BrokerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive，连接池才有意义
+    state = None  # 由 make_server 注入
+
+    def log_message(self, format, *args):
+        pass
+
+    def _params(self):
+        parts = urlsplit(self.path)
+        params = dict(parse_qsl(parts.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            params.update(parse_qsl(self.rfile.read(length).decode("utf-8")))
+        return parts.path, params
+
+    def _reply(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self):
+        path, params = self._params()
+        state = self.state
+        with state.lock:
+            state.calls[path] += 1
+        state.delay()
+
+        error = state.verify(params)
+        if error:
+            return self._reply(error)
+
+        if path == "/api/auth/token":
+            return self._reply({"code": "0", "data": state.issue_token()})
+
+        failure = state.take_failure()
+        if failure:
+            return self._reply({"code": str(failure), "msg": "simulated failure"}, status=failure)
+
+        if (state.require_token or "access_token" in params) and not state.token_valid(params.get("access_token")):
+            return self._reply({"code": "401", "msg": "token expired"})
+
+        if path in TRADE_ENDPOINTS:
+            fault = state.roll()
+            if fault == "timeout":
+                with state.lock:
+                    state.calls["timeouts"] += 1
+                time.sleep(state.hang_seconds)
+            elif fault == "reject" and path == "/api/trade/order/place":
+                with state.lock:
+                    state.calls["rejects"] += 1
+                return self._reply({"code": "E2001", "msg": "simulated reject: 可用资金不足"})
+
+        if path == "/api/trade/order/place":
+            return self._reply({"code": "0", "data": state.place(params)})
+        if path == "/api/trade/order/batch_place":
+            results = []
+            for o in json.loads(params.get("orders") or "[]"):
+                # 批量接口逐笔拒单，不影响同批其他委托
+                if state.roll() == "reject":
+                    with state.lock:
+                        state.calls["rejects"] += 1
+                    results.append({"status": "rejected", "msg": "simulated reject: 可用资金不足"})
+                else:
+                    results.append(state.place(o))
+            return self._reply({"code": "0", "data": {"orders": results}})
+        if path == "/api/trade/order/batch_query":
+            ids = [i for i in (params.get("order_ids") or "").split(",") if i]
+            return self._reply({"code": "0", "data": {"orders": [state.query(i) for i in ids]}})
+        if path == "/api/trade/assets/query":
+            return self._reply({"code": "0", "data": state.assets()})
+        return self._reply({"code": "404", "msg": f"unknown endpoint {path}"}, status=404)
+
+    do_GET = _dispatch
+    do_POST = _dispatch
+
+
+def make_server(host="127.0.0.1", port=0, state=None):
+    """创建替身服务器 (port=0 自动分配端口)，返回 (server, state)"""
+    state = state or BrokerState()
+    handler = type("BoundBrokerHandler", (BrokerHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server, state
+
+
+def start_in_thread(**kwargs):
+    """在后台线程启动替身，返回 (server, state, base_url)"""
+    server, state = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, state, f"http://{host}:{port}"
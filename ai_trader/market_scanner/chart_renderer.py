@@ -0,0 +1,230 @@
+# market_scanner/chart_renderer.py
+"""
+由本地K线生成标准化K线图 (蜡烛 + 均线 + 成交量副图)，替代人工截图作为 AnalysisRecord.chart_image
+- 固定画幅与配色，保证视觉模型每次看到的版式一致
+- 结果按 (代码, 周期, 最后一根K线时间, 样式) 缓存，行情没更新时直接复用
+- 批量渲染走进程池，工作进程只依赖传入的目录，不需要 Django 环境
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+
+import numpy as np
+from django.conf import settings
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from . import metrics
+from .market_data import BarStore
+
+
+@dataclass(frozen=True)
+class ChartStyle:
+    # 默认模型 (Gemini) 按 768x768 切块计费，单块画幅即可放下 120 根K线
+    width: int = 768
+    height: int = 768
+    bars: int = 120                      # 显示最近多少根K线
+    ma_periods: tuple = (5, 10, 20, 60)
+    volume_ratio: float = 0.22           # 成交量副图占绘图区高度的比例
+    background: str = '#101418'
+    grid: str = '#262c33'
+    text: str = '#c8ccd0'
+    up: str = '#e5484d'                  # A 股习惯：红涨绿跌
+    down: str = '#30a46c'
+    ma_colors: tuple = ('#f5d90a', '#3e9bff', '#d864d8', '#ffffff')
+    version: int = 1                     # 绘制逻辑变化时递增，使旧缓存失效
+
+    def key(self):
+        return hashlib.sha1(json.dumps(asdict(self), sort_keys=True).encode()).hexdigest()[:10]
+
+
+@dataclass
+class RenderResult:
+    symbol: str
+    path: str = None
+    cached: bool = False
+    error: str = None
+
+
+def default_style():
+    return ChartStyle(**getattr(settings, 'CHART_STYLE', {}))
+
+
+def cache_path(cache_dir, symbol, timeframe, last_ts, style):
+    return os.path.join(cache_dir, timeframe, symbol, f"{last_ts}_{style.key()}.png")
+
+
+def _moving_average(values, period):
+    """前 period-1 根为 NaN 的简单移动平均"""
+    out = np.full(len(values), np.nan)
+    if len(values) >= period:
+        csum = np.cumsum(np.insert(values, 0, 0.0))
+        out[period - 1:] = (csum[period:] - csum[:-period]) / period
+    return out
+
+
+def draw_chart(bars, style, title=''):
+    """
+    把一段K线画成图片
+    :param bars: market_data.Bars (会额外读取 max(ma_periods) 根用于均线预热)
+    :return: PIL.Image
+    """
+    n = min(style.bars, len(bars))
+    warm = len(bars) - n
+    close = np.asarray(bars.close, dtype=np.float64)
+    o, h, l, c, v = (np.asarray(a[warm:], dtype=np.float64)
+                     for a in (bars.open, bars.high, bars.low, bars.close, bars.volume))
+    mas = [(_moving_average(close, p)[warm:], color) for p, color in zip(style.ma_periods, style.ma_colors)]
+
+    # 调色板模式：整张图只有十来种颜色，每像素 1 字节，PNG 编码比 RGB 快数倍、体积更小
+    colors = list(dict.fromkeys((style.background, style.grid, style.text, style.up, style.down) + style.ma_colors))
+    ink = {color: i for i, color in enumerate(colors)}
+    img = Image.new('P', (style.width, style.height), 0)
+    img.putpalette([channel for color in colors for channel in ImageColor.getrgb(color)])
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default()
+
+    # 版面：上方标题，右侧价格刻度，主图 + 成交量副图
+    left, right, top, bottom = 8, style.width - 70, 24, style.height - 8
+    vol_h = int((bottom - top) * style.volume_ratio)
+    price_bottom = bottom - vol_h - 6
+    vol_top = price_bottom + 6
+
+    lo = float(np.nanmin(np.concatenate([l] + [m[~np.isnan(m)] for m, _ in mas]))) if n else 0.0
+    hi = float(np.nanmax(np.concatenate([h] + [m[~np.isnan(m)] for m, _ in mas]))) if n else 1.0
+    pad = (hi - lo) * 0.05 or max(hi * 0.01, 0.01)
+    lo, hi = lo - pad, hi + pad
+
+    def y_price(p):
+        return price_bottom - (p - lo) / (hi - lo) * (price_bottom - top)
+
+    # 网格与价格刻度
+    for i in range(6):
+        price = lo + (hi - lo) * i / 5
+        y = y_price(price)
+        draw.line([(left, y), (right, y)], fill=ink[style.grid])
+        draw.text((right + 6, y - 6), f"{price:.2f}", fill=ink[style.text], font=font)
+    draw.line([(left, vol_top - 3), (right, vol_top - 3)], fill=ink[style.grid])
+
+    # 蜡烛与成交量 (坐标先向量化算好)
+    step = (right - left) / max(n, 1)
+    body_w = max(1.0, step * 0.7)
+    xs = left + step * (np.arange(n) + 0.5)
+    yo, yc, yh, yl = y_price(o), y_price(c), y_price(h), y_price(l)
+    vmax = float(v.max()) if n and v.max() > 0 else 1.0
+    yv = bottom - v / vmax * (bottom - vol_top)
+    rising = c >= o
+    up, down = ink[style.up], ink[style.down]
+    for i in range(n):
+        color = up if rising[i] else down
+        x = xs[i]
+        draw.line([(x, yh[i]), (x, yl[i])], fill=color)
+        y0, y1 = (yc[i], yo[i]) if rising[i] else (yo[i], yc[i])
+        draw.rectangle([x - body_w / 2, y0, x + body_w / 2, max(y1, y0 + 1)], fill=color)
+        draw.rectangle([x - body_w / 2, yv[i], x + body_w / 2, bottom], fill=color)
+
+    # 均线 (图例靠右排在标题行)
+    legend_x = right - 44 * len(mas)
+    for (values, color), period in zip(mas, style.ma_periods):
+        ok = ~np.isnan(values)
+        points = list(zip(xs[ok].tolist(), y_price(values[ok]).tolist()))
+        if len(points) >= 2:
+            draw.line(points, fill=ink[color], width=1)
+        draw.text((legend_x, 6), f"MA{period}", fill=ink[color], font=font)
+        legend_x += 44
+
+    if n:
+        last = f"{title}  C {c[-1]:.2f}  H {h.max():.2f}  L {l.min():.2f}"
+        draw.text((left, 6), last, fill=ink[style.text], font=font)
+    return img
+
+
+def render_symbol(root, cache_dir, symbol, timeframe, style, store=None):
+    """
+    渲染单个标的 (已缓存则直接返回缓存路径)
+    进程池的工作函数：只依赖参数，不访问 Django 配置
+    """
+    store = store or BarStore(root=root)
+    meta = store.info(symbol, timeframe)
+    if not meta or not meta['rows']:
+        return RenderResult(symbol, error='无本地行情')
+    path = cache_path(cache_dir, symbol, timeframe, meta['last_ts'], style)
+    if os.path.exists(path):
+        return RenderResult(symbol, path=path, cached=True)
+
+    bars = store.read(symbol, timeframe, last=style.bars + max(style.ma_periods, default=0))
+    img = draw_chart(bars, style, title=f"{symbol} {timeframe}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    img.save(tmp, format='PNG', compress_level=1)  # 压缩级别 1：体积略大但编码快数倍
+    os.replace(tmp, path)
+    return RenderResult(symbol, path=path)
+
+
+# 工作进程内复用同一个 BarStore (映射缓存)
+_worker_store = None
+
+
+def _render_chunk(root, cache_dir, symbols, timeframe, style):
+    global _worker_store
+    if _worker_store is None or _worker_store.root != root:
+        _worker_store = BarStore(root=root)
+    results = []
+    for symbol in symbols:
+        try:
+            results.append(render_symbol(root, cache_dir, symbol, timeframe, style, store=_worker_store))
+        except Exception as e:
+            results.append(RenderResult(symbol, error=str(e)))
+    return results
+
+
+def chart_cache_dir():
+    return getattr(settings, 'CHART_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'chart_cache'))
+
+
+def render_chart(symbol, timeframe='1d', style=None):
+    """在当前进程渲染单个标的，返回 RenderResult"""
+    result = render_symbol(settings.MARKET_DATA_ROOT, chart_cache_dir(), symbol, timeframe, style or default_style())
+    if not result.error:
+        metrics.cache_requests.inc(cache='chart_render', result='hit' if result.cached else 'miss')
+    return result
+
+
+def render_many(symbols, timeframe='1d', style=None, workers=None, chunk_size=16):
+    """
+    批量渲染：先在本进程过滤掉已有缓存的标的，剩余的按块分给进程池
+    :return: [RenderResult] (与 symbols 顺序一致)
+    """
+    style = style or default_style()
+    root, cache_dir = settings.MARKET_DATA_ROOT, chart_cache_dir()
+    store = BarStore(root=root)
+
+    results, todo = {}, []
+    for symbol in symbols:
+        meta = store.info(symbol, timeframe)
+        if not meta or not meta['rows']:
+            results[symbol] = RenderResult(symbol, error='无本地行情')
+            continue
+        path = cache_path(cache_dir, symbol, timeframe, meta['last_ts'], style)
+        if os.path.exists(path):
+            results[symbol] = RenderResult(symbol, path=path, cached=True)
+        else:
+            todo.append(symbol)
+
+    workers = workers or getattr(settings, 'CHART_RENDER_WORKERS', None) or os.cpu_count()
+    chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+    if len(chunks) <= 1 or workers <= 1:
+        for chunk in chunks:
+            for r in _render_chunk(root, cache_dir, chunk, timeframe, style):
+                results[r.symbol] = r
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            futures = [pool.submit(_render_chunk, root, cache_dir, chunk, timeframe, style) for chunk in chunks]
+            for future in futures:
+                for r in future.result():
+                    results[r.symbol] = r
+    hits = sum(1 for r in results.values() if r.cached)
+    metrics.cache_requests.inc(hits, cache='chart_render', result='hit')
+    metrics.cache_requests.inc(len(todo), cache='chart_render', result='miss')
+    return [results[s] for s in symbols]
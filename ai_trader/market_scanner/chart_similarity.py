@@ -0,0 +1,224 @@
+# market_scanner/chart_similarity.py
+"""
+相似图表查重：同一用户短时间内再次上传同一标的的K线图 (晚一两分钟的截图、多了一根K线、裁剪略有不同) 时复用上次的分析
+- 感知哈希用 dHash：灰度缩到 9x8 后比较左右相邻像素的明暗，得到 64 位指纹。内容相近的图汉明距离小，
+  重新截图、重新编码、轻微裁剪都不会像逐字节哈希那样完全改变
+- 每个用户一份多索引哈希 (MultiIndexHash)，按汉明距离查找只核对少量候选。64 位指纹、半径 10 时
+  BK 树仍要访问一半左右的节点，纯 Python 实现比逐条比对还慢，因此没有采用
+- 索引在进程内按需从数据库载入最近 CHART_DEDUP_WINDOW 秒的记录，之后每次查找前只增量读取新记录 (id 递增)，
+  其他进程写入的记录同样查得到；超出窗口的条目查找时跳过，索引每过一个窗口重建一次
+- 只索引真正调用过模型的记录 (复用得来的记录不再被复用，避免结果随着一串相似截图越传越旧)；
+  候选回数据库确认：记录还在、分析已完成、不是出错或兜底结果、股票代码不冲突
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import timedelta
+from functools import lru_cache
+from itertools import combinations
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import AnalysisRecord
+
+HASH_SIZE = 8  # 8x8 = 64 位
+MAX_INDEXED_USERS = 1024
+# 强制重新分析时与上次结果比对的字段
+DIFF_FIELDS = ('signal', 'trend', 'trend_stage', 'ma_structure', 'volume_state', 'volatility_status',
+               'score', 'confidence', 'support_levels', 'resistance_levels')
+
+
+# === 感知哈希 ===
+def dhash(source):
+    """
+    64 位 dHash (十六进制字符串)
+    :param source: 文件路径或文件对象 (上传的文件读完后把读取位置复位)
+    """
+    from PIL import Image  # 用到时才导入
+
+    position = source.tell() if hasattr(source, 'tell') else None
+    try:
+        with Image.open(source) as img:
+            gray = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    finally:
+        if position is not None:
+            source.seek(position)
+    pixels = gray.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = value << 1 | (pixels[offset + col + 1] > pixels[offset + col])
+    return f"{value:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+
+def distance(a, b):
+    """两个整数指纹的汉明距离"""
+    return (a ^ b).bit_count()
+
+
+class MultiIndexHash:
+    """
+    多索引哈希：64 位指纹切成 4 段 16 位，每段一张 {段值: [指纹]} 表。距离 ≤ r 的两个指纹至少有一段
+    相差不超过 r // 4 位 (抽屉原理)，查找时在每张表里只枚举这些相近的段值，再逐个核对候选的全长距离
+    条目很少或查找半径很大时直接逐条比对更快
+    """
+    CHUNKS = 4
+    WIDTH = 16
+    SCAN_BELOW = 128       # 不同指纹少于这个数时逐条比对
+    MAX_CHUNK_RADIUS = 3   # 每段要枚举的段值数随半径组合增长 (半径 3 为 697 个)，再大就逐条比对
+
+    def __init__(self):
+        self.entries = {}  # 指纹 -> [条目]
+        self.tables = [defaultdict(list) for _ in range(self.CHUNKS)]
+        self.size = 0
+        self.checked = 0   # 最近一次查找核对的候选指纹数
+
+    def add(self, value, item):
+        items = self.entries.get(value)
+        if items is None:
+            items = self.entries[value] = []
+            for i, table in enumerate(self.tables):
+                table[value >> (i * self.WIDTH) & 0xFFFF].append(value)
+        items.append(item)
+        self.size += 1
+
+    def search(self, value, max_distance):
+        """距离 ≤ max_distance 的全部条目 [(距离, 条目)]，按距离升序"""
+        radius = max_distance // self.CHUNKS
+        if len(self.entries) < self.SCAN_BELOW or radius > self.MAX_CHUNK_RADIUS:
+            candidates = self.entries
+        else:
+            candidates = set()
+            for i, table in enumerate(self.tables):
+                key = value >> (i * self.WIDTH) & 0xFFFF
+                for mask in _flip_masks(self.WIDTH, radius):
+                    bucket = table.get(key ^ mask)
+                    if bucket:
+                        candidates.update(bucket)
+        self.checked = len(candidates)
+        found = []
+        for candidate in candidates:
+            d = distance(value, candidate)
+            if d <= max_distance:
+                found.extend((d, item) for item in self.entries[candidate])
+        found.sort(key=lambda hit: hit[0])
+        return found
+
+
+@lru_cache(maxsize=None)
+def _flip_masks(width, radius):
+    """width 位内不超过 radius 个 1 的全部掩码"""
+    return tuple(sum(1 << bit for bit in bits) for r in range(radius + 1) for bits in combinations(range(width), r))
+
+
+class UserIndex:
+    """一个用户窗口期内分析记录的指纹索引；条目为 (记录 id, 创建时间戳)"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.index = MultiIndexHash()
+        self.last_id = 0
+        self.built_at = time.time()
+        self.lock = threading.Lock()
+
+    def refresh(self, window):
+        """增量载入新记录；距上次重建超过一个窗口时丢弃旧树重新载入"""
+        if time.time() - self.built_at > window:
+            self.index, self.last_id, self.built_at = MultiIndexHash(), 0, time.time()
+        rows = (AnalysisRecord.objects
+                .filter(user_id=self.user_id, id__gt=self.last_id,
+                        created_at__gte=timezone.now() - timedelta(seconds=window),
+                        reused_from__isnull=True)
+                .exclude(image_hash='')
+                .order_by('id')
+                .values_list('id', 'image_hash', 'created_at'))
+        for record_id, image_hash, created_at in rows:
+            self.index.add(int(image_hash, 16), (record_id, created_at.timestamp()))
+            self.last_id = record_id
+
+    def search(self, image_hash, max_distance, window):
+        """窗口期内的相近记录 [(距离, 记录 id)]，同距离时新的在前"""
+        cutoff = time.time() - window
+        hits = [(d, record_id, ts) for d, (record_id, ts) in self.index.search(int(image_hash, 16), max_distance)
+                if ts >= cutoff]
+        hits.sort(key=lambda hit: (hit[0], -hit[2]))
+        return [(d, record_id) for d, record_id, _ in hits]
+
+
+# === 进程内索引 (按用户，LRU) ===
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _index_for(user_id):
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is None:
+            index = _indexes[user_id] = UserIndex(user_id)
+            while len(_indexes) > MAX_INDEXED_USERS:
+                _indexes.popitem(last=False)
+        else:
+            _indexes.move_to_end(user_id)
+        return index
+
+
+def reset():
+    with _indexes_lock:
+        _indexes.clear()
+
+
+# === 查重与复用 ===
+def find_reusable(user, image_hash, symbol=None, exclude_id=None):
+    """
+    同一用户窗口期内与 image_hash 最相近、可以复用的分析记录
+    :return: (记录, 汉明距离)；没有时 (None, None)
+    """
+    window = getattr(settings, 'CHART_DEDUP_WINDOW', 900)
+    if not window or not image_hash:
+        return None, None
+    max_distance = getattr(settings, 'CHART_DEDUP_MAX_DISTANCE', 10)
+    index = _index_for(user.id)
+    with index.lock:
+        index.refresh(window)
+        hits = [(d, record_id) for d, record_id in index.search(image_hash, max_distance, window)
+                if record_id != exclude_id][:10]
+    if not hits:
+        return None, None
+    records = AnalysisRecord.objects.filter(user=user).in_bulk([record_id for _, record_id in hits])
+    for d, record_id in hits:
+        record = records.get(record_id)
+        if record is not None and _reusable(record.ai_result, symbol):
+            return record, d
+    return None, None
+
+
+def _reusable(result, symbol):
+    if not isinstance(result, dict) or not result.get('signal') or result['signal'] == 'ERROR':
+        return False
+    if result.get('error') or result.get('fallback') or result.get('analyzer'):
+        return False  # 出错、兜底或本地引擎的结果不代表模型的判断
+    if result.get('reused_from'):
+        return False  # 复用得来的记录 (入索引时可能还没标上 reused_from 外键)
+    previous = str(result.get('symbol') or '').strip().upper()
+    if symbol and previous not in ('', 'UNKNOWN') and previous != symbol.strip().upper():
+        return False
+    return True
+
+
+def reused_result(record, d):
+    """由历史记录生成本次的分析结果 (策略判定由调用方重新做)"""
+    result = {k: v for k, v in record.ai_result.items()
+              if k not in ('final_signal', 'raw_signal', 'strategy_reason', 'changes', 'compared_with')}
+    result['reused_from'] = {'record_id': record.pk, 'distance': d,
+                             'analyzed_at': timezone.localtime(record.created_at).strftime('%Y-%m-%d %H:%M')}
+    return result
+
+
+def annotate_changes(result, record):
+    """强制重新分析时标出与相似图表上次结果的差异 {字段: [上次, 本次]}"""
+    previous = record.ai_result if isinstance(record.ai_result, dict) else {}
+    result['compared_with'] = record.pk
+    result['changes'] = {f: [previous.get(f), result.get(f)] for f in DIFF_FIELDS if previous.get(f) != result.get(f)}
+    return result
@@ -0,0 +1,174 @@
+# market_scanner/circuit_breaker.py
+"""
+大模型服务商熔断器：每个 (base_url, model) 一个，进程内共享
+- 关闭 (closed)：正常放行，滚动时间窗内记录每次调用的成败与耗时；
+  样本数够 AI_BREAKER_MIN_CALLS 且 错误率 或 慢调用率 超过阈值时打开
+- 打开 (open)：直接拒绝 (微秒级返回)，调用方转向回退链上的下一个服务商；冷却期过后转为半开
+- 半开 (half_open)：只放行一个探测请求，成功则关闭并清空时间窗，失败则再次打开且冷却期加倍 (有上限)
+- 只有服务商自身的故障 (超时、连接失败、5xx、429) 计为失败；400 之类请求被拒说明服务商是好的
+- 状态只在本进程内，多进程部署时各进程各自熔断；运维接口 /ops/breakers/ 查看与手动复位
+"""
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from . import metrics
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class CircuitBreaker:
+    def __init__(self, base_url, model):
+        self.base_url = base_url
+        self.model = model
+        self.provider = metrics.provider_of(base_url)
+        self.window_seconds = _setting('AI_BREAKER_WINDOW', 60)
+        self.min_calls = _setting('AI_BREAKER_MIN_CALLS', 5)
+        self.error_ratio = _setting('AI_BREAKER_ERROR_RATIO', 0.5)
+        self.slow_seconds = _setting('AI_BREAKER_SLOW_SECONDS', 30)
+        self.slow_ratio = _setting('AI_BREAKER_SLOW_RATIO', 0.8)
+        self.base_cooldown = _setting('AI_BREAKER_COOLDOWN', 30)
+        self.max_cooldown = _setting('AI_BREAKER_MAX_COOLDOWN', 600)
+
+        self.state = CLOSED
+        self.cooldown = self.base_cooldown
+        self.opened_at = None
+        self.probing = False
+        self.calls = deque()        # (时间戳, 是否成功, 耗时秒)
+        self.short_circuited = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    # === 调用方接口 ===
+    def allow(self):
+        """是否放行本次调用；半开时只放行一个探测请求"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self._transition(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            self.short_circuited += 1
+        metrics.llm_short_circuits.inc(provider=self.provider, model=self.model)
+        return False
+
+    def record(self, ok, seconds, error=None):
+        """登记一次已放行调用的结果 (ok=False 只用于服务商自身的故障)"""
+        now = time.monotonic()
+        with self._lock:
+            if not ok:
+                self.last_error = str(error)[:200] if error else None
+            if self.state == HALF_OPEN:
+                self.probing = False
+                if ok and seconds < self.slow_seconds:
+                    self.calls.clear()
+                    self.cooldown = self.base_cooldown
+                    self._transition(CLOSED)
+                else:
+                    self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                    self._open(now)
+                return
+            self.calls.append((now, ok, seconds))
+            self._trim(now)
+            if self.state == CLOSED and self._tripped():
+                self._open(now)
+
+    # === 内部 ===
+    def _trim(self, now):
+        while self.calls and now - self.calls[0][0] > self.window_seconds:
+            self.calls.popleft()
+
+    def _rates(self):
+        n = len(self.calls)
+        if not n:
+            return 0.0, 0.0
+        errors = sum(1 for _, ok, _ in self.calls if not ok)
+        slow = sum(1 for _, _, seconds in self.calls if seconds >= self.slow_seconds)
+        return errors / n, slow / n
+
+    def _tripped(self):
+        if len(self.calls) < self.min_calls:
+            return False
+        error_rate, slow_rate = self._rates()
+        return error_rate >= self.error_ratio or slow_rate >= self.slow_ratio
+
+    def _open(self, now):
+        self.opened_at = now
+        self._transition(OPEN)
+
+    def _transition(self, state):
+        self.state = state
+        metrics.llm_circuit_transitions.inc(provider=self.provider, model=self.model, state=state)
+
+    def reset(self):
+        """运维手动复位为关闭"""
+        with self._lock:
+            self.calls.clear()
+            self.cooldown = self.base_cooldown
+            self.probing = False
+            self._transition(CLOSED)
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            error_rate, slow_rate = self._rates()
+            latencies = sorted(seconds for _, _, seconds in self.calls)
+            return {
+                'base_url': self.base_url,
+                'model': self.model,
+                'state': self.state,
+                'window_calls': len(self.calls),
+                'error_rate': round(error_rate, 3),
+                'slow_rate': round(slow_rate, 3),
+                'p50_seconds': round(latencies[len(latencies) // 2], 3) if latencies else None,
+                'retry_in_seconds': round(max(self.cooldown - (now - self.opened_at), 0), 1)
+                if self.state == OPEN else None,
+                'cooldown_seconds': self.cooldown,
+                'short_circuited': self.short_circuited,
+                'last_error': self.last_error,
+            }
+
+
+# === 进程内注册表 ===
+_breakers = {}
+_registry_lock = threading.Lock()
+
+
+def get(base_url, model):
+    key = (base_url, model)
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _registry_lock:
+            breaker = _breakers.setdefault(key, CircuitBreaker(base_url, model))
+    return breaker
+
+
+def snapshot():
+    return [breaker.snapshot() for breaker in list(_breakers.values())]
+
+
+def reset(base_url=None, model=None):
+    """复位匹配的熔断器 (不给条件则全部)，返回复位的个数"""
+    matched = [b for b in list(_breakers.values())
+               if (base_url is None or b.base_url == base_url) and (model is None or b.model == model)]
+    for breaker in matched:
+        breaker.reset()
+    return len(matched)
+
+
+def is_provider_fault(error):
+    """异常是否说明服务商不可用 (超时、连接失败、限流、5xx)，而不是这次请求本身有问题"""
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status == 429 or status >= 500
+    # openai.APITimeoutError / APIConnectionError 及底层 httpx 异常都没有状态码
+    return True
@@ -2,6 +2,12 @@ from django import forms
 from .models import AnalysisRecord
 
 class ImageUploadForm(forms.ModelForm):
+    # 可选：股票代码，本地分析引擎据此读取本地行情
+    symbol = forms.CharField(required=False, max_length=20,
+                             widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': '股票代码 (可选)'}))
+    # 可选：不复用相似图表的近期结果，强制调用模型重新分析
+    force_refresh = forms.BooleanField(required=False)
+
     class Meta:
         model = AnalysisRecord
         fields = ['chart_image']
@@ -0,0 +1,66 @@
+# market_scanner/fragment_cache.py
+"""
+控制台片段缓存的版本号
+- 每个用户一个版本计数器 (存在 Django 缓存里)，分析记录 / 委托 / 账户变动时在事务提交后递增；
+  模板里的 {% cache %} 片段与历史接口的 ETag 都以版本号为键，版本一变旧缓存自然失效，无需逐个删除
+- 另有一个全局纪元：全量盯市这类一次改动所有账户的批处理只递增纪元，不必逐个用户递增
+- 计数器放在 DASHBOARD_CACHE_ALIAS 指定的缓存里，该后端必须在各进程间共享 (文件 / Redis / Memcached)，
+  否则管理命令 (盯市、撮合、委托轮询) 里的递增到不了 Web 进程；片段本身可以留在进程内缓存
+- 并发递增可能丢一次 (文件缓存的 incr 是先读后写)，但递增都发生在事务提交之后，
+  任何读到新版本号的请求都能看到已提交的数据，丢失的那次不会留下过期片段
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+EPOCH_KEY = 'dash:epoch'
+
+
+def _cache():
+    return caches[getattr(settings, 'DASHBOARD_CACHE_ALIAS', 'default')]
+
+
+def _user_key(user_id):
+    return f'dash:v:{user_id}'
+
+
+def _initial():
+    # 缓存被清空或淘汰后从当前时间重新起算，不会与淘汰前发出的版本号 (ETag) 撞上
+    return time.time_ns() // 1000
+
+
+def version(user_id):
+    """用户当前的版本号 (字符串，作为片段缓存键与 ETag 的一部分)"""
+    cache = _cache()
+    values = cache.get_many([EPOCH_KEY, _user_key(user_id)])
+    epoch = values.get(EPOCH_KEY)
+    if epoch is None:
+        cache.add(EPOCH_KEY, _initial(), timeout=None)
+        epoch = cache.get(EPOCH_KEY)
+    current = values.get(_user_key(user_id))
+    if current is None:
+        cache.add(_user_key(user_id), _initial(), timeout=None)
+        current = cache.get(_user_key(user_id))
+    return f"{epoch}.{current}"
+
+
+def _incr(key):
+    cache = _cache()
+    try:
+        cache.incr(key)
+    except ValueError:  # 键不存在 (尚未读取过或已被淘汰)
+        cache.add(key, _initial(), timeout=None)
+
+
+def bump(user_ids):
+    """在当前事务提交后递增这些用户的版本号 (提交前递增会让并发请求把旧数据缓存到新版本下)"""
+    user_ids = {u for u in user_ids if u is not None}
+    if user_ids:
+        transaction.on_commit(lambda: [_incr(_user_key(u)) for u in user_ids])
+
+
+def bump_all():
+    """事务提交后递增全局纪元，使所有用户的片段失效"""
+    transaction.on_commit(lambda: _incr(EPOCH_KEY))
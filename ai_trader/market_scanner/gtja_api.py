@@ -1,46 +1,93 @@
+import asyncio
 import time
 import json
 import hashlib
-import requests
+import random
+import threading
 import logging
+from django.conf import settings
+
+from . import loop_clients, metrics
+from .profiling import timed
 
 logger = logging.getLogger(__name__)
 
+# 业务成功码 (假设 0 或 '000000' 为成功)
+SUCCESS_CODES = ("0", "000000", "success")
+# 令牌失效码：刷新令牌后重试一次
+TOKEN_EXPIRED_CODES = ("401", "token_expired")
+# 可安全重试的 HTTP 状态码
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
 
-class GTJAClient:
+def sign_params(params, app_secret):
     """
-    国泰君安开放平台 API 客户端封装
-    文档参考: https://open.gtja.com/door/v-index.html#/fileCenter
+    生成签名 (SIGNATURE)
+    注意：请根据 GTJA 官方文档的【签名算法】修改此函数
+    通常涉及将参数排序、拼接 app_secret、然后做 MD5 或 SHA256
     """
+    # 示例通用签名逻辑（请替换为官方逻辑）：
+    sorted_params = sorted(params.items())
+    sign_str = f"{app_secret}"
+    for k, v in sorted_params:
+        if k != "sign" and v:
+            sign_str += f"{k}{v}"
+    sign_str += f"{app_secret}"
+
+    # 假设是 MD5
+    return hashlib.md5(sign_str.encode('utf-8')).hexdigest().upper()
+
+
+def _observe(endpoint, start, outcome):
+    metrics.broker_request_seconds.observe(time.perf_counter() - start, endpoint=endpoint, outcome=outcome)
+
+
+class BrokerAPIError(Exception):
+    """券商返回的业务错误 (不重试)"""
+
+
+class _RetryableError(Exception):
+    """网络层/网关层错误，是否重试取决于请求是否幂等"""
 
-    def __init__(self, app_id, app_secret, customer_id, api_base_url="https://open-api.gtja.com"):
+    def __init__(self, message, sent):
+        super().__init__(message)
+        self.sent = sent  # 请求是否可能已到达券商
+
+
+class _OutcomeUnknown(Exception):
+    """非幂等请求 (下单) 可能已送达券商但没有拿到应答：不能重试，只能事后对账"""
+
+
+class _GTJABase:
+    """同步/异步客户端共用的签名、参数与退避逻辑"""
+
+    def __init__(self, app_id, app_secret, customer_id, api_base_url=None, timeout=None,
+                 max_retries=None, backoff_base=None, backoff_cap=None, token_refresh_margin=None):
         self.app_id = app_id
         self.app_secret = app_secret
         self.customer_id = customer_id
-        self.base_url = api_base_url
-        self.session = requests.Session()
+        self.base_url = api_base_url or _setting('GTJA_API_BASE_URL', "https://open-api.gtja.com")
+        self.timeout = timeout or _setting('GTJA_TIMEOUT', (3.05, 10))  # (连接, 读取)
+        self.max_retries = max_retries if max_retries is not None else _setting('GTJA_MAX_RETRIES', 3)
+        self.backoff_base = backoff_base if backoff_base is not None else _setting('GTJA_BACKOFF_BASE', 0.2)
+        self.backoff_cap = backoff_cap if backoff_cap is not None else _setting('GTJA_BACKOFF_CAP', 3.0)
+        self.token_refresh_margin = (token_refresh_margin if token_refresh_margin is not None
+                                     else _setting('GTJA_TOKEN_REFRESH_MARGIN', 60))
+        self.retry_budget = _setting('GTJA_RETRY_BUDGET', 20)
+        # 以下接口未经官方文档核实，默认关闭
+        self.token_auth = _setting('GTJA_TOKEN_AUTH', False)
+        self.batch_orders = _setting('GTJA_BATCH_ORDERS', False)
         self.token = None
+        self.token_expires_at = 0.0
 
     def _sign(self, params):
-        """
-        生成签名 (SIGNATURE)
-        注意：请根据 GTJA 官方文档的【签名算法】修改此函数
-        通常涉及将参数排序、拼接 app_secret、然后做 MD5 或 SHA256
-        """
-        # 示例通用签名逻辑（请替换为官方逻辑）：
-        sorted_params = sorted(params.items())
-        sign_str = f"{self.app_secret}"
-        for k, v in sorted_params:
-            if k != "sign" and v:
-                sign_str += f"{k}{v}"
-        sign_str += f"{self.app_secret}"
-
-        # 假设是 MD5
-        return hashlib.md5(sign_str.encode('utf-8')).hexdigest().upper()
-
-    def _request(self, method, endpoint, data=None):
-        url = f"{self.base_url}{endpoint}"
+        return sign_params(params, self.app_secret)
 
+    def _signed_params(self, data=None, with_token=True):
         # 构造公共参数
         params = {
             "app_id": self.app_id,
@@ -49,53 +96,345 @@ class GTJAClient:
             "format": "json",
             "customer_id": self.customer_id,  # 可能需要
         }
-
+        if with_token and self.token:
+            params["access_token"] = self.token
         if data:
             params.update(data)
 
         # 计算签名
         params["sign"] = self._sign(params)
+        return params
+
+    def _token_fresh(self):
+        return self.token and time.time() < self.token_expires_at - self.token_refresh_margin
+
+    def _store_token(self, data):
+        self.token = data.get("access_token")
+        self.token_expires_at = time.time() + float(data.get("expires_in", 7200))
+
+    def _backoff(self, attempt):
+        """全抖动指数退避：在 [0, min(上限, 基数 x 2^n)] 内均匀取值，避免多实例同时重试"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    def _retry_delay(self, error, attempt, idempotent, elapsed):
+        """
+        下次重试前的等待秒数；不该重试时抛出
+        - 非幂等请求 (下单) 可能已送达时不重试：券商不保证按任何字段去重，重发可能重复下单
+        - 总耗时 (已用 + 退避 + 一次请求的最长超时) 不超过 retry_budget，使调用方 (下单视图等待
+          BROKER_SUBMIT_TIMEOUT 秒) 总能在放弃等待之前拿到结果
+        """
+        if error.sent and not idempotent:
+            raise _OutcomeUnknown(f"{error}，委托可能已送达券商，未重试")
+        if attempt >= self.max_retries:
+            raise error
+        delay = self._backoff(attempt)
+        per_request = sum(self.timeout) if isinstance(self.timeout, tuple) else self.timeout
+        if elapsed + delay + per_request > self.retry_budget:
+            raise error
+        return delay
+
+    @staticmethod
+    def _failure(error):
+        if isinstance(error, _OutcomeUnknown):
+            return {"status": "unknown", "message": str(error)}
+        return {"status": "error", "message": str(error)}
+
+    def _check_result(self, result):
+        code = str(result.get("code"))
+        if code in TOKEN_EXPIRED_CODES and self.token_auth:
+            return "token_expired"
+        if code not in SUCCESS_CODES:
+            raise BrokerAPIError(f"GTJA API Error: {result.get('msg', 'Unknown Error')}")
+        return None
+
+    @staticmethod
+    def _order_payload(symbol, price, quantity, direction):
+        # 转换方向代码 (假设 1=买, 2=卖)
+        trade_side = "1" if direction.upper() == "BUY" else "2"
+        return {
+            "stock_code": symbol,
+            "price": str(price),
+            "amount": str(quantity),
+            "trade_direction": trade_side,
+            "market": "SH" if symbol.startswith("6") else "SZ",  # 简单推断市场
+            "order_type": "0",  # 限价委托
+        }
+
+
+class GTJAClient(_GTJABase):
+    """
+    国泰君安开放平台 API 客户端封装
+    文档参考: https://open.gtja.com/door/v-index.html#/fileCenter
+    - 复用带连接池的 Session (请通过 get_client 按账户获取，不要每次新建)
+    - 令牌缓存，在过期前 token_refresh_margin 秒主动刷新 (GTJA_TOKEN_AUTH 开启时)
+    - 幂等请求 (查询) 遇到网络错误/5xx 时按全抖动指数退避重试，总耗时不超过 retry_budget；
+      下单只在确定没有送达 (连接失败) 时重试，可能已送达时返回 status=unknown，由调用方对账
+    """
+
+    def __init__(self, app_id, app_secret, customer_id, api_base_url=None, session=None, pool_size=None, **kwargs):
+        super().__init__(app_id, app_secret, customer_id, api_base_url, **kwargs)
+        self.session = session or self._build_session(pool_size or _setting('GTJA_POOL_SIZE', 10))
+        self._token_lock = threading.Lock()
+
+    @staticmethod
+    def _build_session(pool_size):
+        # requests / httpx 在真正连券商时才导入，不拖慢 Web 进程与管理命令的启动
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        # 重试由 _request 自己控制 (需要区分是否幂等)，适配器层不重试
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0, pool_block=False)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _ensure_token(self, force=False):
+        if not self.token_auth or (not force and self._token_fresh()):
+            return self.token
+        with self._token_lock:
+            if not force and self._token_fresh():
+                return self.token
+            result = self._send("POST", f"{self.base_url}/api/auth/token", self._signed_params(with_token=False))
+            self._check_result(result)
+            self._store_token(result.get("data", result))
+            return self.token
+
+    @timed('broker')
+    def _send(self, method, url, params):
+        import requests
 
         try:
             if method.upper() == "GET":
-                response = self.session.get(url, params=params, timeout=5)
+                response = self.session.get(url, params=params, timeout=self.timeout)
             else:
                 # POST 请求通常传 JSON 或 Form Data，具体看文档 Content-Type 要求
-                response = self.session.post(url, data=params, timeout=5)
+                response = self.session.post(url, data=params, timeout=self.timeout)
+        except requests.exceptions.ConnectTimeout as e:
+            raise _RetryableError(str(e), sent=False)
+        except requests.exceptions.ConnectionError as e:
+            raise _RetryableError(str(e), sent=True)
+        except requests.exceptions.Timeout as e:
+            raise _RetryableError(str(e), sent=True)
 
-            response.raise_for_status()
-            result = response.json()
+        if response.status_code in RETRYABLE_STATUS:
+            raise _RetryableError(f"HTTP {response.status_code}", sent=True)
+        response.raise_for_status()
+        return response.json()
 
-            # 检查业务状态码 (假设 0 或 '000000' 为成功)
-            if str(result.get("code")) not in ["0", "000000", "success"]:
-                raise Exception(f"GTJA API Error: {result.get('msg', 'Unknown Error')}")
+    def _request(self, method, endpoint, data=None, idempotent=None):
+        """
+        :param idempotent: 是否可在请求可能已送达后重试；默认 GET 为幂等
+        """
+        url = f"{self.base_url}{endpoint}"
+        idempotent = method.upper() == "GET" if idempotent is None else idempotent
+        token_refreshed = False
+        attempt = 0
+        start = time.perf_counter()
 
-            return result.get("data", result)
+        try:
+            while True:
+                try:
+                    # 令牌获取同样走重试 (获取令牌是幂等的)
+                    self._ensure_token()
+                    result = self._send(method, url, self._signed_params(data))
+                    if self._check_result(result) == "token_expired":
+                        if token_refreshed:
+                            raise BrokerAPIError("GTJA API Error: 令牌刷新后仍然失效")
+                        token_refreshed = True
+                        self._ensure_token(force=True)
+                        continue
+                    _observe(endpoint, start, 'ok')
+                    return result.get("data", result)
+                except _RetryableError as e:
+                    delay = self._retry_delay(e, attempt, idempotent, time.perf_counter() - start)
+                    attempt += 1
+                    metrics.broker_retries.inc(endpoint=endpoint)
+                    logger.warning(f"GTJA {endpoint} 第 {attempt} 次重试 ({e})，{delay:.2f}s 后")
+                    time.sleep(delay)
 
         except Exception as e:
+            _observe(endpoint, start, 'error')
             logger.error(f"Request failed: {e}")
-            return {"status": "error", "message": str(e)}
+            return self._failure(e)
 
     def place_order(self, symbol, price, quantity, direction):
         """
         下单接口
         :param direction: 'BUY' or 'SELL'
+        :return: 券商应答；可能已送达但没有应答时为 {"status": "unknown", ...}
         """
-        # 转换方向代码 (假设 1=买, 2=卖)
-        trade_side = "1" if direction.upper() == "BUY" else "2"
-
-        payload = {
-            "stock_code": symbol,
-            "price": str(price),
-            "amount": str(quantity),
-            "trade_direction": trade_side,
-            "market": "SH" if symbol.startswith("6") else "SZ",  # 简单推断市场
-            "order_type": "0"  # 限价委托
-        }
-
-        # 调用官方下单端点 (Endpoint 请查阅文档)
-        return self._request("POST", "/api/trade/order/place", payload)
+        payload = self._order_payload(symbol, price, quantity, direction)
+        # 调用官方下单端点 (Endpoint 请查阅文档)；非幂等，送达后不重试
+        return self._request("POST", "/api/trade/order/place", payload, idempotent=False)
 
     def get_assets(self):
         """查询资产"""
-        return self._request("GET", "/api/trade/assets/query")
\ No newline at end of file
+        return self._request("GET", "/api/trade/assets/query")
+
+    def place_orders(self, orders):
+        """
+        批量下单：GTJA_BATCH_ORDERS 开启时一次往返提交多笔，否则逐笔调用下单接口
+        :param orders: [dict(symbol, price, quantity, direction), ...]
+        :return: 与 orders 对齐的结果列表；整体失败时返回 {"status": "error" / "unknown", ...}
+        """
+        if not self.batch_orders:
+            return [self.place_order(o['symbol'], o['price'], o['quantity'], o['direction']) for o in orders]
+        payloads = [self._order_payload(o['symbol'], o['price'], o['quantity'], o['direction']) for o in orders]
+        result = self._request("POST", "/api/trade/order/batch_place",
+                               {"orders": json.dumps(payloads, ensure_ascii=False)}, idempotent=False)
+        return result.get("orders", result) if isinstance(result, dict) else result
+
+    def query_orders(self, order_ids):
+        """
+        批量查询委托状态 (需开启 GTJA_BATCH_ORDERS)
+        :return: [{order_id, status, filled_amount, avg_price}, ...]
+        """
+        if not self.batch_orders:
+            return {"status": "error", "message": "未开启 GTJA_BATCH_ORDERS，无法查询委托状态"}
+        result = self._request("GET", "/api/trade/order/batch_query", {"order_ids": ",".join(order_ids)})
+        return result.get("orders", result) if isinstance(result, dict) else result
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncGTJAClient(_GTJABase):
+    """
+    asyncio 版本客户端，接口与 GTJAClient 相同 (place_order / get_assets 为协程)
+    基于 httpx.AsyncClient 连接池；同一实例只能在创建它的事件循环中使用
+    """
+
+    def __init__(self, app_id, app_secret, customer_id, api_base_url=None, client=None, pool_size=None, **kwargs):
+        import httpx
+
+        super().__init__(app_id, app_secret, customer_id, api_base_url, **kwargs)
+        pool_size = pool_size or _setting('GTJA_POOL_SIZE', 10)
+        connect, read = self.timeout if isinstance(self.timeout, tuple) else (self.timeout, self.timeout)
+        self.client = client or httpx.AsyncClient(
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        self._token_lock = asyncio.Lock()
+
+    async def _ensure_token(self, force=False):
+        if not self.token_auth or (not force and self._token_fresh()):
+            return self.token
+        async with self._token_lock:
+            if not force and self._token_fresh():
+                return self.token
+            result = await self._send("POST", f"{self.base_url}/api/auth/token",
+                                      self._signed_params(with_token=False))
+            self._check_result(result)
+            self._store_token(result.get("data", result))
+            return self.token
+
+    @timed('broker')
+    async def _send(self, method, url, params):
+        import httpx
+
+        try:
+            if method.upper() == "GET":
+                response = await self.client.get(url, params=params)
+            else:
+                response = await self.client.post(url, data=params)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            raise _RetryableError(str(e) or type(e).__name__, sent=False)
+        except httpx.TransportError as e:
+            raise _RetryableError(str(e) or type(e).__name__, sent=True)
+
+        if response.status_code in RETRYABLE_STATUS:
+            raise _RetryableError(f"HTTP {response.status_code}", sent=True)
+        response.raise_for_status()
+        return response.json()
+
+    async def _request(self, method, endpoint, data=None, idempotent=None):
+        url = f"{self.base_url}{endpoint}"
+        idempotent = method.upper() == "GET" if idempotent is None else idempotent
+        token_refreshed = False
+        attempt = 0
+        start = time.perf_counter()
+
+        try:
+            while True:
+                try:
+                    await self._ensure_token()
+                    result = await self._send(method, url, self._signed_params(data))
+                    if self._check_result(result) == "token_expired":
+                        if token_refreshed:
+                            raise BrokerAPIError("GTJA API Error: 令牌刷新后仍然失效")
+                        token_refreshed = True
+                        await self._ensure_token(force=True)
+                        continue
+                    _observe(endpoint, start, 'ok')
+                    return result.get("data", result)
+                except _RetryableError as e:
+                    delay = self._retry_delay(e, attempt, idempotent, time.perf_counter() - start)
+                    attempt += 1
+                    metrics.broker_retries.inc(endpoint=endpoint)
+                    logger.warning(f"GTJA {endpoint} 第 {attempt} 次重试 ({e})，{delay:.2f}s 后")
+                    await asyncio.sleep(delay)
+
+        except Exception as e:
+            _observe(endpoint, start, 'error')
+            logger.error(f"Request failed: {e}")
+            return self._failure(e)
+
+    async def place_order(self, symbol, price, quantity, direction):
+        payload = self._order_payload(symbol, price, quantity, direction)
+        return await self._request("POST", "/api/trade/order/place", payload, idempotent=False)
+
+    async def get_assets(self):
+        return await self._request("GET", "/api/trade/assets/query")
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+# === 按账户复用的客户端注册表 ===
+_clients = {}
+_async_generation = 0  # reset_clients 时递增，使各事件循环里已有的异步客户端不再被取用
+_registry_lock = threading.Lock()
+
+
+def account_key(account):
+    # 密钥变更后需要重新建客户端，所以把密钥摘要也纳入键
+    secret_digest = hashlib.sha256((account.broker_app_secret or "").encode('utf-8')).hexdigest()
+    return account.broker_app_id, account.broker_customer_id, secret_digest
+
+
+def get_client(account):
+    """获取该账户的共享 GTJAClient (线程安全，连接池与令牌在请求之间复用)"""
+    key = account_key(account)
+    client = _clients.get(key)
+    if client is None:
+        with _registry_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = GTJAClient(
+                    app_id=account.broker_app_id,
+                    app_secret=account.broker_app_secret,
+                    customer_id=account.broker_customer_id,
+                )
+    return client
+
+
+async def get_async_client(account):
+    """获取该账户在当前事件循环中的共享 AsyncGTJAClient (循环结束时关闭)"""
+    return await loop_clients.get_or_create(
+        ('gtja', _async_generation) + account_key(account),
+        lambda: AsyncGTJAClient(
+            app_id=account.broker_app_id,
+            app_secret=account.broker_app_secret,
+            customer_id=account.broker_customer_id,
+        ))
+
+
+def reset_clients():
+    """关闭并清空注册表 (测试或修改券商地址后使用)"""
+    global _async_generation
+    with _registry_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        _async_generation += 1
@@ -0,0 +1,267 @@
+# market_scanner/idempotency.py
+import asyncio
+import functools
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+
+class _ResponseCache:
+    """
+    进程内已完成响应的 LRU 表 (带过期)，命中时连数据库都不用查
+    跨进程的权威记录在 IdempotencyKey 表里
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[1:]
+
+    def put(self, key, expires_at, request_hash, status, body):
+        with self._lock:
+            self._data[key] = (expires_at, request_hash, status, body)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_cache = _ResponseCache()
+# 本进程内正在处理的键 -> Event，同进程的并发重复请求直接等 Event，不用轮询数据库
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _ttl():
+    return getattr(settings, 'IDEMPOTENCY_TTL', 24 * 3600)
+
+
+def _extract_key(request):
+    key = request.headers.get(HEADER)
+    if not key and request.content_type == 'application/json' and request.body:
+        try:
+            key = json.loads(request.body).get('idempotency_key')
+        except (ValueError, AttributeError):
+            key = None
+    return (key or '').strip()[:64] or None
+
+
+def _replay(request_hash, stored_hash, status, body):
+    if stored_hash != request_hash:
+        return JsonResponse({'status': 'error', 'message': '幂等键已被另一笔不同的请求使用'}, status=422)
+    response = HttpResponse(body, status=status, content_type='application/json')
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(user, key, request_hash):
+    """
+    尝试占用幂等键
+    :return: (True, None) 占用成功；(False, IdempotencyKey) 已被占用
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=getattr(settings, 'IDEMPOTENCY_INFLIGHT_TIMEOUT', 120))
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(user=user, key=key, request_hash=request_hash,
+                                              expires_at=now + timedelta(seconds=_ttl()))
+            return True, None
+        except IntegrityError:
+            existing = IdempotencyKey.objects.filter(user=user, key=key).first()
+            if existing is None:
+                continue
+            # 已过期，或处理进程崩溃导致长期 IN_FLIGHT：清掉后重新占用
+            if existing.expires_at < now or (existing.status == 'IN_FLIGHT' and existing.created_at < stale_before):
+                IdempotencyKey.objects.filter(pk=existing.pk).delete()
+                continue
+            return False, existing
+    return False, IdempotencyKey.objects.filter(user=user, key=key).first()
+
+
+def _wait_for_result(user, key, event):
+    """等待首个请求处理完毕；同进程等 Event，跨进程退避轮询数据库"""
+    deadline = time.time() + getattr(settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 30)
+    delay = 0.02
+    while time.time() < deadline:
+        if event is not None:
+            event.wait(timeout=max(0.0, deadline - time.time()))
+            event = None
+        record = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if record is None or record.status == 'DONE':
+            return record
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+    return None
+
+
+async def _await_result(user, key, event):
+    """_wait_for_result 的协程版本：等待期间不占用线程"""
+    deadline = time.time() + getattr(settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 30)
+    delay = 0.02
+    while time.time() < deadline:
+        if event is not None and not event.is_set():
+            await asyncio.sleep(0.01)
+            continue
+        event = None
+        record = await IdempotencyKey.objects.filter(user=user, key=key).afirst()
+        if record is None or record.status == 'DONE':
+            return record
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.5)
+    return None
+
+
+def _replay_record(cache_key, request_hash, record):
+    """把其他请求已完成的结果放进进程缓存并重放"""
+    if record is None or record.status != 'DONE':
+        return JsonResponse({'status': 'error', 'message': '相同请求仍在处理中，请稍后查询结果'}, status=409)
+    _cache.put(cache_key, record.expires_at.timestamp(), record.request_hash,
+               record.response_status, record.response_body)
+    return _replay(request_hash, record.request_hash, record.response_status, record.response_body)
+
+
+def _store_response(user, key, cache_key, request_hash, response):
+    body = response.content.decode('utf-8')
+    expires_at = timezone.now() + timedelta(seconds=_ttl())
+    IdempotencyKey.objects.filter(user=user, key=key).update(
+        status='DONE', response_status=response.status_code, response_body=body, expires_at=expires_at)
+    _cache.put(cache_key, expires_at.timestamp(), request_hash, response.status_code, body)
+
+
+def _begin(cache_key):
+    event = threading.Event()
+    with _inflight_lock:
+        _inflight[cache_key] = event
+    return event
+
+
+def _end(cache_key, event):
+    with _inflight_lock:
+        _inflight.pop(cache_key, None)
+    event.set()
+
+
+def _inflight_event(cache_key):
+    with _inflight_lock:
+        return _inflight.get(cache_key)
+
+
+def idempotent(view_func):
+    """
+    下单类接口的幂等装饰器
+    - 客户端通过 Idempotency-Key 请求头 (或 JSON 字段 idempotency_key) 标识一次逻辑请求
+    - 重放的请求直接返回首次响应，不会再动账户或券商
+    - 并发的重复请求等待首个请求的结果，而不是各自执行
+    未携带幂等键的请求按原样处理
+    同时支持同步视图与 async 视图
+    """
+    if asyncio.iscoroutinefunction(view_func):
+        return _idempotent_async(view_func)
+
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        key = _extract_key(request)
+        if key is None or not request.user.is_authenticated:
+            return view_func(request, *args, **kwargs)
+
+        cache_key = (request.user.pk, key)
+        request_hash = hashlib.sha256(request.body or b'').hexdigest()
+
+        cached = _cache.get(cache_key)
+        if cached is not None:
+            return _replay(request_hash, *cached)
+
+        claimed, record = _claim(request.user, key, request_hash)
+        if not claimed:
+            if record is not None and record.status == 'IN_FLIGHT':
+                record = _wait_for_result(request.user, key, _inflight_event(cache_key))
+            return _replay_record(cache_key, request_hash, record)
+
+        event = _begin(cache_key)
+        try:
+            try:
+                response = view_func(request, *args, **kwargs)
+            except Exception:
+                # 处理失败不占用幂等键，允许客户端用同一个键重试
+                IdempotencyKey.objects.filter(user=request.user, key=key).delete()
+                raise
+
+            _store_response(request.user, key, cache_key, request_hash, response)
+            return response
+        finally:
+            _end(cache_key, event)
+
+    return wrapper
+
+
+def _idempotent_async(view_func):
+    """idempotent 的 async 视图版本，流程与同步版一致，数据库操作走 async ORM / sync_to_async"""
+
+    @functools.wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        key = _extract_key(request)
+        if key is None or not user.is_authenticated:
+            return await view_func(request, *args, **kwargs)
+
+        cache_key = (user.pk, key)
+        request_hash = hashlib.sha256(request.body or b'').hexdigest()
+
+        cached = _cache.get(cache_key)
+        if cached is not None:
+            return _replay(request_hash, *cached)
+
+        claimed, record = await sync_to_async(_claim)(user, key, request_hash)
+        if not claimed:
+            if record is not None and record.status == 'IN_FLIGHT':
+                record = await _await_result(user, key, _inflight_event(cache_key))
+            return _replay_record(cache_key, request_hash, record)
+
+        event = _begin(cache_key)
+        try:
+            try:
+                response = await view_func(request, *args, **kwargs)
+            except Exception:
+                await IdempotencyKey.objects.filter(user=user, key=key).adelete()
+                raise
+
+            await sync_to_async(_store_response)(user, key, cache_key, request_hash, response)
+            return response
+        finally:
+            _end(cache_key, event)
+
+    return wrapper
+
+
+def purge_expired():
+    """删除过期的幂等记录，返回删除条数"""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lt=timezone.now()).delete()
+    return deleted
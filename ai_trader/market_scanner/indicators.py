@@ -0,0 +1,204 @@
+# market_scanner/indicators.py
+"""
+向量化技术指标 + 本地预筛
+- 所有指标都按最后一维计算：输入 (标的数, K线数) 的二维数组，一次算完一批标的；一维数组视为单个标的
+- 长短不一的标的左侧补 NaN 对齐，窗口内有 NaN 的位置结果为 NaN
+- basic_prescreen 剔除K线不足、停牌、价格异常的标的，不依赖任何指标
+- StrategyPrescreen 先过 basic_prescreen，再对照用户的 StrategyConfig 关卡 (均线多头 / 禁止震荡 / 禁止高波动)，
+  本地指标已经明确过不了关的标的就不必再花一次大模型调用
+"""
+from collections import Counter
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+
+DEFAULT_THRESHOLDS = {
+    'min_ma_alignment': 0.67,   # 相邻均线多头排列的比例下限 (4 条均线 3 对，至少 2 对)
+    'range_slope': 0.001,       # 对数收盘价回归斜率 (每根K线) 绝对值低于此值视为震荡
+    'high_vol_ratio': 1.8,      # 当前 ATR% 超过近期中位数多少倍视为高波动
+    'atr_period': 14,
+    'trend_period': 20,
+    'volume_period': 20,
+    'vol_lookback': 120,
+}
+
+
+def _as_2d(values):
+    arr = np.asarray(values, dtype=np.float64)
+    return arr[np.newaxis, :] if arr.ndim == 1 else arr
+
+
+def stack(columns, length=None):
+    """
+    把多个标的的同一列 (长度可不同) 堆成 (标的数, length) 的二维数组，取最后 length 根，不足的左侧补 NaN
+    """
+    length = length or max((len(c) for c in columns), default=0)
+    out = np.full((len(columns), length), np.nan)
+    for i, col in enumerate(columns):
+        tail = np.asarray(col[-length:], dtype=np.float64)
+        if len(tail):
+            out[i, length - len(tail):] = tail
+    return out
+
+
+def sma(values, period):
+    """简单移动平均；窗口未满或窗口内有 NaN 的位置为 NaN"""
+    x = _as_2d(values)
+    out = np.full(x.shape, np.nan)
+    if x.shape[1] < period:
+        return out
+    valid = ~np.isnan(x)
+    csum = np.cumsum(np.where(valid, x, 0.0), axis=1)
+    ccount = np.cumsum(valid, axis=1)
+    pad = np.zeros((x.shape[0], 1))
+    csum = np.hstack([pad, csum])
+    ccount = np.hstack([pad, ccount])
+    window_sum = csum[:, period:] - csum[:, :-period]
+    window_count = ccount[:, period:] - ccount[:, :-period]
+    out[:, period - 1:] = np.where(window_count == period, window_sum / period, np.nan)
+    return out
+
+
+def ma_alignment(close, periods):
+    """
+    最后一根K线上均线的多头排列程度：相邻两条 (短 > 长) 成立的比例，0~1
+    均线未形成 (K线不足) 的标的为 NaN
+    """
+    periods = sorted(periods)
+    last = np.column_stack([sma(close, p)[:, -1] for p in periods])
+    ordered = (last[:, :-1] > last[:, 1:]).mean(axis=1)
+    return np.where(np.isnan(last).any(axis=1), np.nan, ordered)
+
+
+def atr(high, low, close, period=14):
+    """平均真实波幅 (简单平均)"""
+    h, l, c = _as_2d(high), _as_2d(low), _as_2d(close)
+    prev = np.hstack([np.full((c.shape[0], 1), np.nan), c[:, :-1]])
+    with np.errstate(invalid='ignore'):
+        tr = np.fmax(h - l, np.fmax(np.abs(h - prev), np.abs(l - prev)))
+    return sma(tr, period)
+
+
+def volatility_ratio(high, low, close, period=14, lookback=120):
+    """当前 ATR% (ATR / 收盘价) 相对近 lookback 根中位数的倍数"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        atr_pct = atr(high, low, close, period) / _as_2d(close)
+        recent = atr_pct[:, -lookback:]
+        median = np.full(recent.shape[0], np.nan)
+        has = ~np.isnan(recent).all(axis=1)
+        median[has] = np.nanmedian(recent[has], axis=1)
+        return atr_pct[:, -1] / median
+
+
+def volume_expansion(volume, period=20):
+    """最后一根成交量相对此前 period 根均量的倍数"""
+    v = _as_2d(volume)
+    if v.shape[1] < 2:  # 只有一根K线，没有此前的均量可比
+        return np.full(v.shape[0], np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return v[:, -1] / sma(v[:, :-1], period)[:, -1]
+
+
+def trend_slope(close, period=20):
+    """最近 period 根对数收盘价的最小二乘斜率 (每根K线的对数涨幅)"""
+    c = _as_2d(close)
+    if c.shape[1] < period:
+        return np.full(c.shape[0], np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        y = np.log(c[:, -period:])
+    x = np.arange(period) - (period - 1) / 2
+    return (y * x).sum(axis=1) / (x * x).sum()
+
+
+@dataclass
+class IndicatorSnapshot:
+    """一批标的在最后一根K线上的指标 (均为长度 = 标的数的一维数组)"""
+    ma_alignment: np.ndarray
+    volatility_ratio: np.ndarray
+    volume_expansion: np.ndarray
+    trend_slope: np.ndarray
+
+    def row(self, i):
+        return {name: (None if np.isnan(v[i]) else round(float(v[i]), 4))
+                for name, v in vars(self).items()}
+
+
+def compute(opens, highs, lows, closes, volumes, ma_periods=(5, 10, 20, 60), thresholds=None):
+    """一次计算一批标的的全部预筛指标 (输入为二维数组或单个标的的一维数组)"""
+    t = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    return IndicatorSnapshot(
+        ma_alignment=ma_alignment(closes, ma_periods),
+        volatility_ratio=volatility_ratio(highs, lows, closes, t['atr_period'], t['vol_lookback']),
+        volume_expansion=volume_expansion(volumes, t['volume_period']),
+        trend_slope=trend_slope(closes, t['trend_period']),
+    )
+
+
+def compute_bars(bars_list, ma_periods=(5, 10, 20, 60), thresholds=None):
+    """market_data.Bars 列表 -> IndicatorSnapshot (按列表顺序)"""
+    columns = [stack([getattr(b, name) for b in bars_list]) for name in ('open', 'high', 'low', 'close', 'volume')]
+    return compute(*columns, ma_periods=ma_periods, thresholds=thresholds)
+
+
+def basic_prescreen(item, min_bars=30):
+    """最基础的预筛：K线太少、最近停牌 (零成交) 或价格异常的标的不值得分析"""
+    bars = item.bars
+    if len(bars) < min_bars:
+        return f"K线不足 {min_bars} 根"
+    if bars.volume[-1] <= 0:
+        return "最近一根K线无成交 (停牌)"
+    if bars.close[-1] <= 0:
+        return "价格异常"
+    return None
+
+
+class StrategyPrescreen:
+    """
+    对照用户策略关卡的本地预筛，可直接作为 ScanJob 的 prescreen
+    只在指标明确不达标时拒绝；指标算不出来 (K线不足) 的关卡一律放行，交给大模型判断
+    """
+
+    def __init__(self, config, ma_periods=(5, 10, 20, 60), thresholds=None):
+        self.config = config
+        self.ma_periods = ma_periods
+        self.thresholds = {**DEFAULT_THRESHOLDS, **getattr(settings, 'PRESCREEN_THRESHOLDS', {}), **(thresholds or {})}
+        self.rejected = Counter()   # 关卡 -> 拒绝次数
+
+    def reasons(self, snap):
+        """按关卡向量化判定，返回每个标的的拒绝理由 (None 表示放行)"""
+        t, cfg = self.thresholds, self.config
+        n = len(snap.ma_alignment)
+        out = [None] * n
+        with np.errstate(invalid='ignore'):
+            gates = []
+            if cfg.require_bullish_ma:
+                gates.append(('ma', snap.ma_alignment < t['min_ma_alignment'],
+                              lambda i: f"均线未呈多头排列 (对齐度 {snap.ma_alignment[i]:.2f})"))
+            if not cfg.allow_sideways:
+                gates.append(('range', np.abs(snap.trend_slope) < t['range_slope'],
+                              lambda i: f"走势震荡 (斜率 {snap.trend_slope[i]:+.4f}/根)"))
+            if not cfg.allow_high_volatility:
+                gates.append(('volatility', snap.volatility_ratio > t['high_vol_ratio'],
+                              lambda i: f"高波动 (ATR 为近期中位数的 {snap.volatility_ratio[i]:.1f} 倍)"))
+        for gate, mask, describe in gates:
+            for i in np.flatnonzero(mask):
+                if out[i] is None:
+                    out[i] = describe(i)
+                    self.rejected[gate] += 1
+        return out
+
+    def screen(self, bars_list):
+        """批量预筛：[Bars] -> ([理由或 None], IndicatorSnapshot)"""
+        snap = compute_bars(bars_list, self.ma_periods, self.thresholds)
+        return self.reasons(snap), snap
+
+    def __call__(self, item):
+        """ScanJob 的单标的预筛接口 (一行的批量计算)，顺带把指标挂到 item 上"""
+        reason = basic_prescreen(item)
+        if reason:
+            self.rejected['basic'] += 1
+            return reason
+        [reason], snap = self.screen([item.bars])
+        item.indicators = snap.row(0)
+        return reason
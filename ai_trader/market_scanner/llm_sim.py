@@ -0,0 +1,232 @@
+# market_scanner/llm_sim.py
+"""
+本地大模型替身：实现 AIService / fetch_external_models 用到的 OpenAI 兼容接口，用于联调与压测，不会产生调用费用
+- POST {base}/chat/completions：按请求内容哈希给出确定的、符合分析 JSON 结构的应答
+- GET  {base}/models：返回几款视觉/非视觉模型
+- 可注入 固定/抖动延迟 与 HTTP 错误；统计请求数与同时在途的峰值
+- 可按比例给出不规范的应答 (代码块包裹、前后说明文字、截断、缺字段、类型松散)，用于验证容错解析与补问
+- 只回答提示词里定义了的字段 (按 "字段名" 出现与否判断)，用于对比不同提示词模板的字段完整率
+- usage 按文本估算 token (图片按固定数计)，并模拟服务商的自动前缀缓存：与之前某个请求相同的最长前缀
+  达到 cache_min_tokens 时计入 prompt_tokens_details.cached_tokens (128 token 粒度)
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+MODELS = ["sim-vl-max", "sim-vision-lite", "sim-text-turbo"]
+MALFORMATIONS = ("fence", "prose", "truncated", "missing", "loose_types")
+IMAGE_TOKENS = 765        # 一张图按固定 token 数计 (不随分辨率变化的近似)
+CACHE_BLOCK_TOKENS = 128  # 前缀缓存的命中粒度
+
+
+class LLMState:
+    """替身内部状态与统计 (线程安全)"""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, malformed_rate=0.0, seed=None,
+                 cache_min_tokens=1024):
+        """
+        :param latency_ms / jitter_ms: 每个请求的固定延迟与 [0, jitter] 均匀抖动
+        :param error_rate: 按概率返回 HTTP 500
+        :param malformed_rate: 按概率给出不规范的分析应答 (种类见 MALFORMATIONS)
+        :param cache_min_tokens: 前缀缓存的最短长度 (OpenAI、Gemini、Qwen 为 1024；DeepSeek 等更短)
+        """
+        self.lock = threading.Lock()
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.malformed = Counter()  # 种类 -> 次数
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.cache_min_tokens = cache_min_tokens
+        self._prefixes = set()  # 见过的前缀摘要 (每个消息片段边界一个)
+
+    def enter(self, path):
+        with self.lock:
+            self.calls[path] += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            jitter = self.random.uniform(0, self.jitter_ms)
+            failed = self.random.random() < self.error_rate
+        return (self.latency_ms + jitter) / 1000, failed
+
+    def malformation(self):
+        """本次应答要做的变形 (None 表示规范应答)"""
+        with self.lock:
+            if not self.malformed_rate or self.random.random() >= self.malformed_rate:
+                return None
+            kind = self.random.choice(MALFORMATIONS)
+            self.malformed[kind] += 1
+        return kind
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def usage(self, request, content):
+        """估算本次请求的 usage，并登记它的各级前缀供之后的请求命中缓存"""
+        digest, total, boundaries = hashlib.sha1(), 0, []
+        for part, tokens, _ in _parts(request):
+            digest.update(part.encode("utf-8"))
+            total += tokens
+            boundaries.append((digest.copy().hexdigest(), total))
+        cached = 0
+        with self.lock:
+            for key, tokens in boundaries:
+                if key in self._prefixes and tokens >= self.cache_min_tokens:
+                    cached = tokens // CACHE_BLOCK_TOKENS * CACHE_BLOCK_TOKENS
+            if len(self._prefixes) > 100_000:
+                self._prefixes.clear()
+            self._prefixes.update(key for key, _ in boundaries)
+        completion = estimate_tokens(content)
+        return {"prompt_tokens": total, "completion_tokens": completion, "total_tokens": total + completion,
+                "prompt_tokens_details": {"cached_tokens": cached}}
+
+
+def estimate_tokens(text):
+    """粗略的 token 数：中文等全角字符每字约 1 个，其余约 4 个字符 1 个"""
+    wide = sum(1 for c in text if c >= "\u2e80")
+    return wide + (len(text) - wide + 3) // 4
+
+
+def _parts(request):
+    """按顺序展开请求消息：[(片段原文, token 数, 文本或 None)]，图片按 IMAGE_TOKENS 计"""
+    for message in request.get("messages") or []:
+        content = message.get("content")
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        for item in content or []:
+            if item.get("type") == "image_url":
+                yield json.dumps(item, sort_keys=True), IMAGE_TOKENS, None
+            else:
+                text = item.get("text") or ""
+                yield f"{message.get('role')}:{text}", estimate_tokens(text), text
+
+
+def prompt_text(request):
+    """请求中的全部文本 (不含图片)"""
+    return "\n".join(text for _, _, text in _parts(request) if text is not None)
+
+
+def requested_fields(payload, text):
+    """提示词定义了的字段 (一个都没提到时视为全部，兼容不带结构定义的请求)"""
+    fields = [k for k in payload if f'"{k}"' in text]
+    return {k: payload[k] for k in fields} if fields else payload
+
+
+def analysis_for(digest):
+    """由请求摘要确定性地生成一份分析结果 (字段与 AIService 的 Prompt 定义一致)"""
+    h = int(digest[:8], 16)
+    trend = ("Up", "Down", "Range")[h % 3]
+    base = 5 + h % 5000 / 100
+    return {
+        "symbol": "Unknown",
+        "trend": trend,
+        "trend_stage": ("Early", "Middle", "Accelerating", "Exhaustion")[h // 3 % 4],
+        "primary_pattern": "None",
+        "ma_structure": {"Up": "Bullish", "Down": "Bearish"}.get(trend, "Mixed"),
+        "price_ma_deviation": "Low",
+        "volume_state": "Neutral",
+        "volatility_status": ("Low", "Normal", "Normal", "High")[h // 12 % 4],
+        "support_levels": [round(base * 0.95, 2), round(base * 0.9, 2)],
+        "resistance_levels": [round(base * 1.05, 2), round(base * 1.1, 2)],
+        "risk_factors": [],
+        "signal": {"Up": "BUY", "Down": "SELL"}.get(trend, "WAIT"),
+        "signal_applicable_to": "Both",
+        "score": 40 + h // 48 % 60,
+        "confidence": 50 + h // 2880 % 50,
+        "key_levels": {"short_term_hold": round(base * 0.97, 2), "trend_invalid": round(base * 0.9, 2)},
+        "reason": "替身应答：按请求内容确定生成",
+    }
+
+
+def malform(payload, kind):
+    """按种类把规范的分析结果变成模型常见的不规范输出"""
+    text = json.dumps(payload, ensure_ascii=False)
+    if kind == "fence":
+        return f"```json\n{text}\n```"
+    if kind == "prose":
+        return f"好的，以下是对该K线图的分析结果：\n{text}\n以上分析仅供参考。"
+    if kind == "truncated":
+        return text[:int(len(text) * 0.6)]
+    if kind == "missing":
+        return json.dumps({k: v for k, v in payload.items() if k not in ("signal", "confidence")}, ensure_ascii=False)
+    loose = dict(payload, signal=payload["signal"].lower(), score=f"{payload['score']}分",
+                 confidence=payload["confidence"] / 100,
+                 support_levels=", ".join(str(x) for x in payload["support_levels"]))
+    return json.dumps(loose, ensure_ascii=False)
+
+
+class LLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None  # 由 make_server 注入
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self):
+        path = urlsplit(self.path).path
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        state = self.state
+        delay, failed = state.enter(path)
+        try:
+            time.sleep(delay)
+            if failed:
+                return self._reply({"error": {"message": "simulated failure", "type": "server_error"}}, status=500)
+            if path.endswith("/models"):
+                return self._reply({"object": "list", "data": [
+                    {"id": m, "object": "model", "created": 0, "owned_by": "sim"} for m in MODELS]})
+            if path.endswith("/chat/completions"):
+                request = json.loads(raw or b"{}")
+                analysis = requested_fields(analysis_for(hashlib.sha1(raw).hexdigest()), prompt_text(request))
+                kind = state.malformation()
+                content = malform(analysis, kind) if kind else json.dumps(analysis, ensure_ascii=False)
+                return self._reply({
+                    "id": f"chatcmpl-sim-{state.calls[path]}", "object": "chat.completion", "created": int(time.time()),
+                    "model": request.get("model", MODELS[0]),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": state.usage(request, content),
+                })
+            return self._reply({"error": {"message": f"unknown endpoint {path}"}}, status=404)
+        finally:
+            state.leave()
+
+    do_GET = _dispatch
+    do_POST = _dispatch
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # 压测时同时建连数以百计，默认 backlog 5 会导致连接被拒
+
+
+def make_server(host="127.0.0.1", port=0, state=None):
+    """创建替身服务器 (port=0 自动分配端口)，返回 (server, state)"""
+    state = state or LLMState()
+    handler = type("BoundLLMHandler", (LLMHandler,), {"state": state})
+    return _Server((host, port), handler), state
+
+
+def start_in_thread(**kwargs):
+    """在后台线程启动替身，返回 (server, state, base_url)；base_url 可直接作为 OpenAI 的 base_url"""
+    server, state = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, state, f"http://{host}:{port}/v1"
@@ -0,0 +1,145 @@
+# market_scanner/local_analyzer.py
+"""
+本地分析引擎：不看图、不调用大模型，直接由本地K线按确定的规则算出与大模型相同结构的分析 JSON
+- 同样的K线永远得到同样的结果，毫秒级返回
+- 用户可在设置里选为分析引擎 (UserProfile.analyzer_backend = 'local')
+- 大模型不可用 (无 Key / 图片被拒) 时作为兜底，取代原先的随机模拟数据
+- 指标计算复用 indicators 的向量化实现，analyze_many 一次处理一批标的
+"""
+import numpy as np
+from django.conf import settings
+
+from . import indicators
+from .market_data import get_store
+
+MA_PERIODS = (5, 10, 20, 60)
+HISTORY_BARS = 250          # 分析所需的K线数 (覆盖 MA60 与波动率回看窗口)
+
+
+def _pick(conditions, choices, default):
+    return np.select(conditions, choices, default=default).tolist()
+
+
+def analyze_many(bars_list, thresholds=None):
+    """
+    批量分析
+    :param bars_list: [market_data.Bars] (每个至少 1 根K线)
+    :return: [dict] 与 AIService 的 JSON 结构一致，额外带 analyzer='local'
+    """
+    if not bars_list:
+        return []
+    t = {**indicators.DEFAULT_THRESHOLDS, **getattr(settings, 'PRESCREEN_THRESHOLDS', {}), **(thresholds or {})}
+    o, h, l, c, v = (indicators.stack([getattr(b, name) for b in bars_list])
+                     for name in ('open', 'high', 'low', 'close', 'volume'))
+    close = c[:, -1]
+    mas = {p: indicators.sma(c, p)[:, -1] for p in MA_PERIODS}
+    snap = indicators.compute(o, h, l, c, v, MA_PERIODS, t)
+    slope_fast = indicators.trend_slope(c, 5)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ma_stack = np.column_stack(list(mas.values()))
+        spread = (ma_stack.max(axis=1) - ma_stack.min(axis=1)) / close
+        dev20 = close / mas[20] - 1
+        dev60 = close / mas[60] - 1
+        up = snap.trend_slope > t['range_slope']
+        down = snap.trend_slope < -t['range_slope']
+        # 最近 10 根内收盘曾在 MA20 另一侧：趋势刚形成
+        recent_gap = c[:, -10:] - indicators.sma(c, 20)[:, -10:]
+        fresh_up = (recent_gap < 0).any(axis=1)
+        fresh_down = (recent_gap > 0).any(axis=1)
+        accelerating = np.abs(slope_fast) > 1.5 * np.abs(snap.trend_slope)
+
+        ma_structure = _pick([np.isnan(snap.ma_alignment), snap.ma_alignment == 1, snap.ma_alignment == 0,
+                              spread < 0.01], ['Mixed', 'Bullish', 'Bearish', 'Tangled'], 'Mixed')
+        trend = _pick([up, down], ['Up', 'Down'], 'Range')
+        stage = _pick([~(up | down), np.abs(dev60) > 0.25, accelerating, (up & fresh_up) | (down & fresh_down)],
+                      ['Unknown', 'Exhaustion', 'Accelerating', 'Early'], 'Middle')
+        deviation = _pick([np.isnan(dev20) | (np.abs(dev20) < 0.03), np.abs(dev20) < 0.08], ['Low', 'Medium'], 'High')
+        volume_state = _pick([snap.volume_expansion > 3, snap.volume_expansion > 1.5, snap.volume_expansion < 0.7],
+                             ['Abnormal', 'Expanding', 'Contracting'], 'Neutral')
+        volatility = _pick([snap.volatility_ratio > t['high_vol_ratio'], snap.volatility_ratio < 0.7],
+                           ['High', 'Low'], 'Normal')
+        low20, low60 = np.nanmin(l[:, -20:], axis=1), np.nanmin(l[:, -60:], axis=1)
+        high20, high60 = np.nanmax(h[:, -20:], axis=1), np.nanmax(h[:, -60:], axis=1)
+        # 指标完整度决定置信度：MA60、波动率、量比任一缺失都会降低
+        available = np.column_stack([~np.isnan(mas[60]), ~np.isnan(snap.volatility_ratio),
+                                     ~np.isnan(snap.volume_expansion), ~np.isnan(snap.trend_slope)]).mean(axis=1)
+
+    results = []
+    for i, bars in enumerate(bars_list):
+        price = float(close[i])
+        levels = [low20[i], low60[i], mas[20][i], mas[60][i], high20[i], high60[i]]
+        levels = sorted({round(float(x), 2) for x in levels if not np.isnan(x)})
+        supports = [x for x in reversed(levels) if x < price][:2]
+        resistances = [x for x in levels if x > price][:2]
+
+        risks = []
+        if dev60[i] > 0.15:
+            risks.append("Overextended from long-term MA")
+        if trend[i] == 'Up' and snap.volume_expansion[i] < 0.7:
+            risks.append("Volume decreasing on rally")
+        if resistances and resistances[0] < price * 1.02:
+            risks.append("Approaching major resistance")
+        if volatility[i] == 'High':
+            risks.append("High volatility")
+
+        if trend[i] == 'Up' and ma_structure[i] == 'Bullish' and volatility[i] != 'High' and deviation[i] != 'High':
+            signal = 'BUY'
+        elif trend[i] == 'Down' and ma_structure[i] == 'Bearish':
+            signal = 'SELL'
+        else:
+            signal = 'WAIT'
+        align = 0.5 if np.isnan(snap.ma_alignment[i]) else float(snap.ma_alignment[i])
+        slope = 0.0 if np.isnan(snap.trend_slope[i]) else float(snap.trend_slope[i])
+        score = 50 + 40 * (align - 0.5) + 20 * max(-1.0, min(1.0, slope / 0.01)) - 8 * len(risks)
+
+        ma10 = mas[10][i]
+        volume_ratio = '-' if np.isnan(snap.volume_expansion[i]) else f"{snap.volume_expansion[i]:.1f}"
+        results.append({
+            "symbol": bars.symbol,
+            "trend": trend[i],
+            "trend_stage": stage[i],
+            "primary_pattern": "None",
+            "ma_structure": ma_structure[i],
+            "price_ma_deviation": deviation[i],
+            "volume_state": volume_state[i],
+            "volatility_status": volatility[i],
+            "support_levels": supports,
+            "resistance_levels": resistances,
+            "risk_factors": risks,
+            "signal": signal,
+            "signal_applicable_to": "Both",
+            "score": int(max(0, min(100, round(score)))),
+            "confidence": int(round(85 * available[i])),
+            "key_levels": {
+                "short_term_hold": round(float(ma10), 2) if not np.isnan(ma10) else (supports[0] if supports else 0.0),
+                "trend_invalid": supports[-1] if supports else round(float(low20[i]), 2),
+            },
+            "reason": f"本地指标：均线{ma_structure[i]}，20根斜率{slope * 100:+.2f}%/根，"
+                      f"量比{volume_ratio}，波动{volatility[i]}"[:50],
+            "indicators": snap.row(i),
+            "analyzer": "local",
+        })
+    return results
+
+
+def unavailable(symbol, reason):
+    """没有可用行情时的确定性结果：观望、置信度 0，策略引擎必然不会放行"""
+    return {
+        "symbol": symbol or "Unknown", "trend": "Range", "trend_stage": "Unknown", "primary_pattern": "None",
+        "ma_structure": "Mixed", "price_ma_deviation": "Low", "volume_state": "Neutral",
+        "volatility_status": "Normal", "support_levels": [], "resistance_levels": [], "risk_factors": [],
+        "signal": "WAIT", "signal_applicable_to": "Both", "score": 0, "confidence": 0,
+        "key_levels": {"short_term_hold": 0.0, "trend_invalid": 0.0},
+        "reason": reason, "analyzer": "local",
+    }
+
+
+def analyze_symbol(symbol, timeframe='1d', store=None):
+    """按代码从本地行情库读取K线并分析"""
+    if not symbol or symbol == 'Unknown':
+        return unavailable(symbol, "未提供股票代码，本地引擎无法分析")
+    bars = (store or get_store()).read(symbol, timeframe, last=HISTORY_BARS)
+    if bars is None or not len(bars):
+        return unavailable(symbol, f"本地无 {symbol} 的行情，无法分析")
+    return analyze_many([bars])[0]
@@ -0,0 +1,47 @@
+# market_scanner/loop_clients.py
+"""
+按事件循环共享的异步客户端 (AsyncOpenAI / AsyncGTJAClient 等基于 httpx.AsyncClient 的对象)
+- 异步连接池只能在创建它的事件循环里使用，所以每个循环一份
+- WSGI 部署下 async 视图由 async_to_sync 为每个请求新建一个循环 (asyncio.run)，循环结束时不会关闭其上的连接池，
+  keep-alive 套接字要等垃圾回收才释放，压测中表现为文件句柄持续增长
+- asyncio.run 收尾时会对仍挂起的异步生成器调用 aclose()：每个循环挂一个这样的生成器，由它关闭该循环的全部客户端
+  并把该循环从登记表里删掉 (生成器经 ag_finalizer 强引用着循环，不删的话弱键字典永远释放不了已结束的循环)；
+  ASGI 下循环常驻，客户端在服务器退出时关闭
+"""
+import asyncio
+import logging
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# 事件循环 -> ({键: 客户端}, 收尾生成器)
+_loops = weakref.WeakKeyDictionary()
+
+
+async def _close_with_loop(loop, clients):
+    try:
+        yield
+    finally:
+        for client in list(clients.values()):
+            try:
+                await (client.aclose() if hasattr(client, 'aclose') else client.close())
+            except Exception as e:
+                logger.warning(f"关闭异步客户端失败: {e}")
+        clients.clear()
+        _loops.pop(loop, None)
+
+
+async def get_or_create(key, factory):
+    """当前事件循环中键为 key 的共享客户端，不存在时用 factory() 创建；循环结束时自动关闭"""
+    loop = asyncio.get_running_loop()
+    entry = _loops.get(loop)
+    if entry is None:
+        clients = {}
+        closer = _close_with_loop(loop, clients)
+        await closer.asend(None)  # 启动生成器，循环由此登记它 (登记是弱引用，强引用留在 _loops 里)
+        entry = _loops[loop] = (clients, closer)
+    clients = entry[0]
+    client = clients.get(key)
+    if client is None:
+        client = clients[key] = factory()
+    return client
@@ -0,0 +1,199 @@
+import asyncio
+import io
+import json
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from PIL import Image
+
+from market_scanner import broker_gateway, gtja_api, llm_sim
+from market_scanner.bench import temporary_database, percentiles, save_results
+from market_scanner.broker_sim import BrokerState, start_in_thread as start_broker
+
+
+class Command(BaseCommand):
+    help = ("同步 (WSGI 线程池) 与异步 (ASGI 单事件循环) 部署的并发承载对比："
+            "经完整 Django 视图打到本地大模型/券商替身，统计吞吐、延迟与替身侧同时在途峰值")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=['analyze', 'models', 'order'], default='analyze',
+                            help="analyze=上传图表分析 (dashboard)，models=获取模型列表，order=实盘下单")
+        parser.add_argument('--requests', type=int, default=600)
+        parser.add_argument('--concurrency', type=int, default=200, help="同时在途的客户端请求数")
+        parser.add_argument('--wsgi-workers', type=int, default=8, help="同步部署的工作线程数 (对应 WSGI worker 数)")
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--latency-ms', type=float, default=800, help="替身应答延迟")
+        parser.add_argument('--jitter-ms', type=float, default=400)
+        parser.add_argument('--mode', choices=['both', 'sync', 'async'], default='both')
+        parser.add_argument('--output', help="结果 JSON 路径")
+
+    def handle(self, *args, **options):
+        llm_server, llm_state, llm_url = llm_sim.start_in_thread(
+            state=llm_sim.LLMState(latency_ms=options['latency_ms'], jitter_ms=options['jitter_ms'], seed=1))
+        broker_state = BrokerState(app_secrets={}, fill_delay=0.2, latency_ms=options['latency_ms'],
+                                   jitter_ms=options['jitter_ms'], seed=1)
+        broker_server, _, broker_url = start_broker(state=broker_state)
+        media = tempfile.mkdtemp(prefix='ai_trader_media_')
+
+        results = {'endpoint': options['endpoint'], 'requests': options['requests'],
+                   'concurrency': options['concurrency'], 'stand_in_latency_ms': options['latency_ms'],
+                   'stand_in_jitter_ms': options['jitter_ms']}
+        overrides = dict(GTJA_API_BASE_URL=broker_url, MEDIA_ROOT=media, BROKER_SUBMIT_TIMEOUT=60,
+                         GTJA_BATCH_ORDERS=True)
+        try:
+            with temporary_database(), override_settings(**overrides):
+                gtja_api.reset_clients()
+                broker_gateway.reset_gateway()
+                users = self._create_users(options, llm_url, broker_state)
+                for mode in (['sync', 'async'] if options['mode'] == 'both' else [options['mode']]):
+                    llm_state.peak_in_flight = 0
+                    before = sum(llm_state.calls.values()) + broker_state.calls['/api/trade/order/batch_place']
+                    runner = self._run_sync if mode == 'sync' else self._run_async
+                    r = runner(options, users, llm_url)
+                    r['stand_in_calls'] = (sum(llm_state.calls.values())
+                                           + broker_state.calls['/api/trade/order/batch_place'] - before)
+                    # 下单经网关合并成批次，券商侧在途数没有可比性，只统计大模型替身
+                    r['stand_in_peak_in_flight'] = llm_state.peak_in_flight if options['endpoint'] != 'order' else None
+                    results[mode] = r
+                    self._report(mode, r)
+                # 网关的后台轮询线程要在测试库和替身地址失效之前停掉
+                broker_gateway.reset_gateway()
+                gtja_api.reset_clients()
+        finally:
+            llm_server.shutdown()
+            broker_server.shutdown()
+            shutil.rmtree(media, ignore_errors=True)
+
+        if 'sync' in results and 'async' in results:
+            results['throughput_ratio'] = round(results['async']['throughput_rps'] / results['sync']['throughput_rps'], 2)
+            self.stdout.write(self.style.SUCCESS(f"异步 / 同步 吞吐比: {results['throughput_ratio']}x"))
+        if options['output']:
+            save_results(options['output'], 'async_views', results)
+            self.stdout.write(f"结果已写入 {options['output']}")
+
+    def _create_users(self, options, llm_url, broker_state):
+        users = []
+        for i in range(options['users']):
+            user = User.objects.create(username=f"async_bench{i}")
+            profile = user.userprofile
+            profile.api_key, profile.api_base_url, profile.selected_model = 'sk-sim', llm_url, llm_sim.MODELS[0]
+            profile.save()
+            account = user.virtualaccount
+            account.is_simulation = False
+            account.broker_app_id, account.broker_app_secret = f"app{i}", f"secret{i}"
+            account.broker_customer_id = f"C{i:06d}"
+            account.save()
+            broker_state.app_secrets[account.broker_app_id] = account.broker_app_secret
+            users.append(user)
+        return users
+
+    # === 请求构造 (同步与异步客户端共用) ===
+    def _request(self, options, i, llm_url):
+        endpoint = options['endpoint']
+        if endpoint == 'analyze':
+            buf = io.BytesIO()
+            Image.new('RGB', (64, 64), (i % 256, 40, 90)).save(buf, format='PNG')
+            upload = SimpleUploadedFile(f"chart{i}.png", buf.getvalue(), content_type='image/png')
+            return '/', {'chart_image': upload}, {}
+        if endpoint == 'models':
+            body = json.dumps({'api_key': 'sk-sim', 'base_url': llm_url})
+            return '/api/fetch-models/', body, {'content_type': 'application/json'}
+        body = json.dumps({'symbol': f"{600000 + i % 300:06d}", 'price': '10.00', 'quantity': 100})
+        return '/api/trade/execute/', body, {'content_type': 'application/json'}
+
+    @staticmethod
+    def _ok(response):
+        if response.status_code != 200:
+            return False
+        if response['Content-Type'].startswith('application/json'):
+            return response.json().get('status') == 'success'
+        # 页面请求：分析成功才会出现交易票据链接 (并发时 response.context 会混入其他请求的渲染，不能用)
+        return b'/trade/ticket/' in response.content
+
+    def _summary(self, outcomes, wall, **extra):
+        latencies = [t * 1000 for t, _ in outcomes]
+        return {
+            **extra,
+            'success': sum(ok for _, ok in outcomes),
+            'errors': sum(not ok for _, ok in outcomes),
+            'wall_seconds': round(wall, 3),
+            'throughput_rps': round(len(outcomes) / wall, 2),
+            'latency_ms': {k: round(v, 1) for k, v in percentiles(latencies).items()},
+        }
+
+    # === 同步部署：固定数量的工作线程，每个请求占住一个线程直到替身应答 ===
+    def _run_sync(self, options, users, llm_url):
+        local = threading.local()
+        submitted = {}
+
+        def one(i):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client()
+                client.force_login(users[threading.get_ident() % len(users)])
+            path, data, extra = self._request(options, i, llm_url)
+            response = client.post(path, data, **extra)
+            return time.perf_counter() - submitted[i], self._ok(response)
+
+        async def drive():
+            # 客户端侧保持 concurrency 个在途请求，超出工作线程数的请求在队列里排队 (计入延迟)
+            loop = asyncio.get_running_loop()
+            gate = asyncio.Semaphore(options['concurrency'])
+
+            async def submit(i):
+                async with gate:
+                    submitted[i] = time.perf_counter()
+                    return await loop.run_in_executor(pool, one, i)
+
+            return await asyncio.gather(*(submit(i) for i in range(options['requests'])))
+
+        with ThreadPoolExecutor(options['wsgi_workers'], thread_name_prefix='wsgi') as pool:
+            started = time.perf_counter()
+            outcomes = asyncio.run(drive())
+            wall = time.perf_counter() - started
+            pool.submit(connections.close_all).result()
+        return self._summary(outcomes, wall, workers=options['wsgi_workers'])
+
+    # === 异步部署：单个事件循环，等待替身应答时让出循环 ===
+    def _run_async(self, options, users, llm_url):
+        async def drive():
+            clients = []
+            for user in users:
+                client = AsyncClient()
+                await sync_to_async(client.force_login)(user)
+                clients.append(client)
+            gate = asyncio.Semaphore(options['concurrency'])
+
+            async def one(i):
+                async with gate:
+                    path, data, extra = self._request(options, i, llm_url)
+                    started = time.perf_counter()
+                    response = await clients[i % len(clients)].post(path, data, **extra)
+                    return time.perf_counter() - started, self._ok(response)
+
+            started = time.perf_counter()
+            outcomes = await asyncio.gather(*(one(i) for i in range(options['requests'])))
+            return outcomes, time.perf_counter() - started
+
+        outcomes, wall = asyncio.run(drive())
+        connections.close_all()
+        return self._summary(outcomes, wall, workers=1)
+
+    def _report(self, mode, r):
+        lat = r['latency_ms']
+        label = f"同步 WSGI x{r['workers']} 线程" if mode == 'sync' else "异步 ASGI 单事件循环"
+        self.stdout.write(
+            f"[{label}] 成功 {r['success']}，失败 {r['errors']}，耗时 {r['wall_seconds']}s，"
+            f"吞吐 {r['throughput_rps']} req/s，替身同时在途峰值 {r['stand_in_peak_in_flight'] or '-'}\n"
+            f"  延迟 p50 {lat['p50']} ms | p90 {lat['p90']} ms | p99 {lat['p99']} ms | max {lat['max']} ms"
+        )
@@ -0,0 +1,139 @@
+import io
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from market_scanner.bench import percentiles, save_results
+from market_scanner.chart_renderer import default_style, draw_chart
+from market_scanner.chart_similarity import MultiIndexHash, dhash, distance
+from market_scanner.market_data import Bars
+
+
+class Command(BaseCommand):
+    help = ("相似图表查重压测：渲染图在 多一根K线 / 轻微裁剪 / JPEG 重新编码 / 不同走势 下的 dHash 汉明距离分布 "
+            "(用于确定 CHART_DEDUP_MAX_DISTANCE)，以及多索引哈希与逐条比对在不同索引规模下的查找耗时")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--charts', type=int, default=40, help="用于距离分布的随机走势数")
+        parser.add_argument('--max-distance', type=int, default=10, help="查找半径")
+        parser.add_argument('--sizes', type=int, nargs='*', default=[100, 1000, 10000], help="索引规模")
+        parser.add_argument('--output', help="结果 JSON 路径")
+
+    def handle(self, *args, **options):
+        distances, hashes = self._distances(options['charts'])
+        results = {
+            'distances': {kind: _summary(values) for kind, values in distances.items()},
+            'lookup': self._lookup(hashes, options['sizes'], options['max_distance']),
+            'max_distance': options['max_distance'],
+        }
+        self._report(results)
+        if options['output']:
+            save_results(options['output'], 'chart_dedup', results)
+            self.stdout.write(f"结果已写入 {options['output']}")
+
+    @staticmethod
+    def _distances(n):
+        """每条随机走势画 原图 / 多一根K线 / 四周裁掉 2%~3% / JPEG 重新编码，与原图比较；不同走势两两比较"""
+        style = default_style()
+        distances = {'new_bar': [], 'crop': [], 'jpeg': [], 'different': []}
+        hashes = []
+        for seed in range(n):
+            bars = _random_walk(seed)
+            image = draw_chart(_head(bars, len(bars) - 1), style)
+            base = int(_hash(image), 16)
+            hashes.append(base)
+            w, h = image.size
+            variants = {
+                'new_bar': draw_chart(bars, style),
+                'crop': image.crop((int(w * 0.03), int(h * 0.02), w - int(w * 0.02), h - int(h * 0.03))),
+                'jpeg': _reencode(image),
+            }
+            for kind, variant in variants.items():
+                distances[kind].append(distance(base, int(_hash(variant), 16)))
+        distances['different'] = [distance(a, b) for i, a in enumerate(hashes) for b in hashes[i + 1:]]
+        return distances, hashes
+
+    @staticmethod
+    def _lookup(chart_hashes, sizes, max_distance):
+        """
+        索引里放 n 个指纹 (以渲染图的指纹为中心加随机扰动，模拟同一用户反复截相近的图)，
+        每次用索引里某个指纹再扰动几位作为查询，对比多索引哈希与逐条比对的耗时，以及多索引哈希核对的候选比例
+        """
+        rng = random.Random(1)
+
+        def jitter(value, bits):
+            for _ in range(bits):
+                value ^= 1 << rng.randrange(64)
+            return value
+
+        results = {}
+        for n in sizes:
+            values = [jitter(rng.choice(chart_hashes), rng.randrange(0, 16)) for _ in range(n)]
+            index = MultiIndexHash()
+            for i, value in enumerate(values):
+                index.add(value, i)
+            queries = [jitter(rng.choice(values), rng.randrange(0, 6)) for _ in range(200)]
+
+            index_us, checked = [], []
+            for q in queries:
+                started = time.perf_counter()
+                index.search(q, max_distance)
+                index_us.append((time.perf_counter() - started) * 1e6)
+                checked.append(index.checked / len(index.entries))
+            scan_us = []
+            for q in queries:
+                started = time.perf_counter()
+                [i for i, value in enumerate(values) if distance(q, value) <= max_distance]
+                scan_us.append((time.perf_counter() - started) * 1e6)
+            results[n] = {
+                'multi_index_us': round(percentiles(index_us)['p50'], 1),
+                'linear_us': round(percentiles(scan_us)['p50'], 1),
+                'checked_ratio': round(sum(checked) / len(checked), 3),
+            }
+        return results
+
+    def _report(self, r):
+        self.stdout.write("dHash 汉明距离 (64 位):")
+        labels = {'new_bar': '多一根K线', 'crop': '轻微裁剪', 'jpeg': 'JPEG 重新编码', 'different': '不同走势'}
+        for kind, d in r['distances'].items():
+            self.stdout.write(f"  {labels[kind]:<10} min {d['min']} | p50 {d['p50']} | p90 {d['p90']} | max {d['max']}")
+        self.stdout.write(f"查找半径 {r['max_distance']}，每次查找 p50:")
+        for n, v in r['lookup'].items():
+            self.stdout.write(f"  索引 {n:>6} 条: 多索引哈希 {v['multi_index_us']} us (核对 {v['checked_ratio']:.0%} 的指纹) | "
+                              f"逐条比对 {v['linear_us']} us")
+
+
+def _summary(values):
+    p = percentiles(values)
+    return {'min': min(values), 'p50': p['p50'], 'p90': p['p90'], 'max': max(values)}
+
+
+def _random_walk(seed, n=200):
+    rng = np.random.default_rng(seed)
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.01, n))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.01, n))
+    return Bars('BENCH', '1d', np.arange(n, dtype=np.int64), open_, high, low, close, rng.uniform(1e5, 1e6, n))
+
+
+def _head(bars, n):
+    return Bars(bars.symbol, bars.timeframe, *(a[:n] for a in (bars.ts, bars.open, bars.high, bars.low, bars.close,
+                                                               bars.volume)))
+
+
+def _hash(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    buffer.seek(0)
+    return dhash(buffer)
+
+
+def _reencode(image):
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, format='JPEG', quality=70)
+    buffer.seek(0)
+    return Image.open(buffer)
@@ -0,0 +1,108 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from market_scanner.bench import temporary_database, percentiles, save_results
+from market_scanner.models import AnalysisRecord, PaperOrder, Position
+
+# 版本计数器用进程内缓存即可 (压测只有一个进程)，且不污染 settings 里的共享缓存
+VERSIONS = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench-dashboard-versions'}
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}, 'dashboard_versions': VERSIONS}
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench-dashboard'},
+               'dashboard_versions': VERSIONS}
+
+
+class Command(BaseCommand):
+    help = "控制台渲染压测：对比片段缓存关闭/开启时 GET / 的耗时与 SQL 次数，以及历史接口条件请求 (304)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--records', type=int, default=500, help="用户的历史分析记录数")
+        parser.add_argument('--orders', type=int, default=200)
+        parser.add_argument('--output', help="结果 JSON 路径")
+
+    def handle(self, *args, **options):
+        results = {'requests': options['requests'], 'records': options['records'], 'orders': options['orders']}
+        with temporary_database():
+            user = self._create_user(options)
+            with override_settings(CACHES=NO_CACHE):
+                results['dashboard_uncached'] = self._measure(user, '/', options['requests'])
+            with override_settings(CACHES=LOCAL_CACHE):
+                results['dashboard_cached'] = self._measure(user, '/', options['requests'])
+                results['invalidation_ok'] = self._check_invalidation(user)
+                results['history_full'] = self._measure(user, '/api/history/', options['requests'])
+                results['history_304'] = self._measure(user, '/api/history/', options['requests'], conditional=True)
+
+        self._report(results)
+        if options['output']:
+            save_results(options['output'], 'dashboard', results)
+            self.stdout.write(f"结果已写入 {options['output']}")
+
+    def _create_user(self, options):
+        user = User.objects.create_user(username="dash_bench", password="bench12345")
+        AnalysisRecord.objects.bulk_create([
+            AnalysisRecord(user=user, chart_image=f"charts/bench_{i}.png", ai_result={'signal': 'BUY'},
+                           raw_signal='BUY', final_signal=('BUY', 'SELL', 'WAIT')[i % 3], strategy_reason="压测")
+            for i in range(options['records'])
+        ])
+        PaperOrder.objects.bulk_create([
+            PaperOrder(user=user, symbol=f"{600000 + i % 50:06d}", direction='BUY', quantity=100, price=10,
+                       status=('PENDING', 'FILLED')[i % 2], commission=0)
+            for i in range(options['orders'])
+        ])
+        Position.objects.bulk_create([
+            Position(user=user, symbol=f"{600000 + i:06d}", quantity=100, avg_cost=10) for i in range(50)
+        ])
+        return user
+
+    def _measure(self, user, path, n, conditional=False):
+        client = Client()
+        client.force_login(user)
+        headers = {}
+        if conditional:
+            headers['If-None-Match'] = client.get(path)['ETag']
+        client.get(path, headers=headers)  # 预热 (模板编译、片段缓存填充)
+        timings, queries, statuses = [], [], set()
+        for _ in range(n):
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                response = client.get(path, headers=headers)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(ctx.captured_queries))
+            statuses.add(response.status_code)
+        return {
+            'status': sorted(statuses),
+            'latency_ms': {k: round(v, 2) for k, v in percentiles(timings).items()},
+            'queries_per_request': round(sum(queries) / len(queries), 2),
+        }
+
+    def _check_invalidation(self, user):
+        """新增一条记录后，缓存的历史列表与 ETag 必须立即更新"""
+        client = Client()
+        client.force_login(user)
+        etag = client.get('/api/history/')['ETag']
+        client.get('/')
+        record = AnalysisRecord.objects.create(user=user, chart_image="charts/fresh.png", ai_result={},
+                                               raw_signal='BUY', final_signal='BUY', strategy_reason="新记录")
+        fresh_page = f"?view_id={record.pk}".encode() in client.get('/').content
+        fresh_etag = client.get('/api/history/', headers={'If-None-Match': etag}).status_code == 200
+        return fresh_page and fresh_etag
+
+    def _report(self, r):
+        def line(label, m):
+            lat = m['latency_ms']
+            return (f"  {label:<14} 状态 {m['status']}  SQL {m['queries_per_request']:>5} 次/请求  "
+                    f"p50 {lat['p50']} ms | p90 {lat['p90']} ms | p99 {lat['p99']} ms")
+
+        self.stdout.write(f"控制台 GET / ({r['records']} 条记录, {r['orders']} 笔委托, {r['requests']} 次请求):")
+        self.stdout.write(line("无片段缓存", r['dashboard_uncached']))
+        self.stdout.write(line("片段缓存", r['dashboard_cached']))
+        self.stdout.write("历史接口 GET /api/history/:")
+        self.stdout.write(line("完整响应", r['history_full']))
+        self.stdout.write(line("条件请求", r['history_304']))
+        style = self.style.SUCCESS if r['invalidation_ok'] else self.style.ERROR
+        self.stdout.write(style(f"新增记录后缓存失效: {'正确' if r['invalidation_ok'] else '错误'}"))
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from PIL import Image
+
+from market_scanner import circuit_breaker, llm_sim
+from market_scanner.bench import percentiles, save_results
+from market_scanner.services import AIService
+
+
+class Command(BaseCommand):
+    help = ("大模型熔断与回退链演练：主服务商替身故障 (超时或 500)，备用替身正常，"
+            "统计熔断打开前后每次分析的耗时、半开探测与恢复过程")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failure', choices=['timeout', 'error'], default='timeout',
+                            help="主服务商的故障方式：timeout=应答慢于超时，error=HTTP 500")
+        parser.add_argument('--analyses', type=int, default=40, help="故障期间的分析次数")
+        parser.add_argument('--timeout', type=float, default=1.0, help="单次调用超时 (秒)")
+        parser.add_argument('--cooldown', type=float, default=2.0, help="熔断冷却秒数")
+        parser.add_argument('--output', help="结果 JSON 路径")
+
+    def handle(self, *args, **options):
+        slow = options['failure'] == 'timeout'
+        primary_state = llm_sim.LLMState(latency_ms=options['timeout'] * 3000 if slow else 0,
+                                         error_rate=0.0 if slow else 1.0, seed=1)
+        primary, _, primary_url = llm_sim.start_in_thread(state=primary_state)
+        backup, backup_state, backup_url = llm_sim.start_in_thread(state=llm_sim.LLMState(latency_ms=50, seed=2))
+        fd, image = tempfile.mkstemp(suffix='.png')
+        os.close(fd)
+        Image.new('RGB', (64, 48), (30, 60, 90)).save(image)
+
+        overrides = dict(
+            AI_API_KEY='sk-sim', AI_BASE_URL=primary_url, AI_REQUEST_TIMEOUT=options['timeout'], AI_MAX_RETRIES=0,
+            AI_FALLBACK_CHAIN=[{'base_url': backup_url, 'api_key': 'sk-backup', 'model': llm_sim.MODELS[1]}],
+            AI_BREAKER_MIN_CALLS=5, AI_BREAKER_WINDOW=60, AI_BREAKER_COOLDOWN=options['cooldown'],
+            AI_BREAKER_SLOW_SECONDS=options['timeout'],
+        )
+        results = {'failure': options['failure'], 'timeout_seconds': options['timeout']}
+        try:
+            with override_settings(**overrides):
+                circuit_breaker.reset()
+                service = AIService()
+                service.model = llm_sim.MODELS[0]
+                results['degraded'] = self._phase(service, image, options['analyses'])
+                results['breakers_while_degraded'] = circuit_breaker.snapshot()
+
+                # 主服务商恢复：冷却期过后第一次分析作为探测请求，成功则熔断关闭
+                # (故障期间失败的探测会让冷却期加倍，按熔断器给出的剩余秒数等待)
+                primary_state.latency_ms, primary_state.error_rate = 0, 0.0
+                retry_in = circuit_breaker.get(primary_url, llm_sim.MODELS[0]).snapshot()['retry_in_seconds']
+                time.sleep((retry_in or 0) + 0.1)
+                results['recovered'] = self._phase(service, image, 5)
+                results['breakers_after_recovery'] = circuit_breaker.snapshot()
+        finally:
+            primary.shutdown()
+            backup.shutdown()
+            os.remove(image)
+            with override_settings(**overrides):
+                circuit_breaker.reset()
+        results['calls'] = {'primary': sum(primary_state.calls.values()), 'backup': sum(backup_state.calls.values())}
+        self._report(results)
+        if options['output']:
+            save_results(options['output'], 'failover', results)
+            self.stdout.write(f"结果已写入 {options['output']}")
+
+    @staticmethod
+    def _phase(service, image, n):
+        """连续分析 n 次，记录每次的耗时与实际给出结果的模型"""
+        timings, served_by = [], []
+        for _ in range(n):
+            started = time.perf_counter()
+            result = service.analyze_chart_image(image)
+            timings.append((time.perf_counter() - started) * 1000)
+            served_by.append(result.get('model') or result.get('analyzer') or 'error')
+        return {
+            'first_5_ms': [round(t, 1) for t in timings[:5]],
+            'latency_ms': {k: round(v, 1) for k, v in percentiles(timings).items()},
+            'after_open_ms': {k: round(v, 1) for k, v in percentiles(timings[5:]).items()} if n > 5 else None,
+            'served_by': {m: served_by.count(m) for m in dict.fromkeys(served_by)},
+        }
+
+    def _report(self, r):
+        d = r['degraded']
+        self.stdout.write(f"主服务商故障 ({r['failure']}，超时 {r['timeout_seconds']}s)：")
+        self.stdout.write(f"  前 5 次 (熔断打开前) 耗时 {d['first_5_ms']} ms")
+        if d['after_open_ms']:
+            lat = d['after_open_ms']
+            self.stdout.write(f"  熔断打开后 p50 {lat['p50']} ms | p90 {lat['p90']} ms | max {lat['max']} ms")
+        self.stdout.write(f"  结果来源 {d['served_by']}")
+        for b in r['breakers_while_degraded']:
+            self.stdout.write(f"  熔断器 {b['model']}: {b['state']}，错误率 {b['error_rate']}，慢调用率 {b['slow_rate']}，"
+                              f"直接拒绝 {b['short_circuited']} 次")
+        rec = r['recovered']
+        states = {b['model']: b['state'] for b in r['breakers_after_recovery']}
+        self.stdout.write(f"主服务商恢复后：结果来源 {rec['served_by']}，熔断器状态 {states}")
+        self.stdout.write(f"替身调用次数 {r['calls']}")
@@ -0,0 +1,92 @@
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from market_scanner.bench import percentiles, save_results
+from market_scanner.market_data import BarStore
+
+
+class Command(BaseCommand):
+    help = "本地行情库压测：合成数千个标的的日线，统计写入吞吐与随机区间读取延迟 (冷/热)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--symbols', type=int, default=3000)
+        parser.add_argument('--bars', type=int, default=2500, help="每个标的的K线数 (日线约 10 年)")
+        parser.add_argument('--reads', type=int, default=20000)
+        parser.add_argument('--max-range', type=int, default=250, help="随机读取区间的最大K线数")
+        parser.add_argument('--output', help="结果 JSON 路径")
+
+    def handle(self, *args, **options):
+        root = tempfile.mkdtemp(prefix='ai_trader_bars_')
+        try:
+            results = self._run(root, options)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+        self.stdout.write(f"写入: {results['ingest_rows_per_sec']:.0f} 行/秒 "
+                          f"({results['symbols']} 标的 x {results['bars']} 根)")
+        self.stdout.write(f"增量追加: 每标的 1 根，{results['append_per_sec']:.0f} 标的/秒")
+        self.stdout.write(f"映射缓存: 最多 {results['cached_symbols']} 个标的 (受文件描述符预算限制)")
+        for phase in ('cold', 'warm'):
+            r = results[phase]
+            self.stdout.write(f"随机区间读取 ({phase}): {r['reads_per_sec']:.0f} 次/秒，延迟(us) {r['latency_us']}")
+        if options['output']:
+            save_results(options['output'], 'market_data', results)
+            self.stdout.write(f"结果已写入 {options['output']}")
+
+    def _run(self, root, options):
+        rng = np.random.default_rng(7)
+        n_sym, n_bars = options['symbols'], options['bars']
+        symbols = [f"{600000 + i:06d}" for i in range(n_sym)]
+        ts = 1_262_304_000 + np.arange(n_bars, dtype=np.int64) * 86400
+
+        store = BarStore(root=root)
+        started = time.perf_counter()
+        for chunk in range(0, n_sym, 500):
+            series = {}
+            for symbol in symbols[chunk:chunk + 500]:
+                close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, n_bars)))
+                opens = close * (1 + rng.normal(0, 0.005, n_bars))
+                series[symbol] = (ts, opens, np.maximum(opens, close) * 1.01, np.minimum(opens, close) * 0.99,
+                                  close, rng.integers(100_000, 10_000_000, n_bars))
+            store.append_many(series, '1d')
+        ingest_seconds = time.perf_counter() - started
+
+        # 增量追加：每个标的补一根新K线 (每次都更新索引，对应盘后逐个补数据的最坏情况)
+        started = time.perf_counter()
+        for symbol in symbols[:200]:
+            store.append(symbol, '1d', [ts[-1] + 86400], [10.0], [10.5], [9.5], [10.2], [1e6])
+        append_seconds = time.perf_counter() - started
+
+        results = {
+            'symbols': n_sym, 'bars': n_bars,
+            'ingest_rows_per_sec': n_sym * n_bars / ingest_seconds,
+            'append_per_sec': 200 / append_seconds,
+        }
+        # 冷：新实例，列文件尚未映射；热：同一实例第二轮 (映射缓存装不下全部标的时，热读取仍会有一部分重新映射)
+        reader = BarStore(root=root)
+        results['cached_symbols'] = reader.cache_size
+        for phase in ('cold', 'warm'):
+            picker = random.Random(11)
+            latencies = []
+            checksum = 0.0
+            started = time.perf_counter()
+            for _ in range(options['reads']):
+                symbol = picker.choice(symbols)
+                lo = picker.randrange(0, n_bars - 1)
+                hi = min(n_bars - 1, lo + picker.randrange(1, options['max_range']))
+                t0 = time.perf_counter()
+                bars = reader.read(symbol, '1d', start=int(ts[lo]), end=int(ts[hi]))
+                checksum += float(bars.close.mean())  # 真正触达数据页
+                latencies.append((time.perf_counter() - t0) * 1e6)
+            elapsed = time.perf_counter() - started
+            results[phase] = {
+                'reads_per_sec': options['reads'] / elapsed,
+                'latency_us': {k: round(v, 1) for k, v in percentiles(latencies).items()},
+                'checksum': checksum,
+            }
+        return results
@@ -0,0 +1,124 @@
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from PIL import Image
+
+from market_scanner import analysis_schema, llm_sim, metrics
+from market_scanner.bench import percentiles, save_results
+from market_scanner.services import AIService
+
+
+class Command(BaseCommand):
+    help = ("大模型输出解析压测：标准库 json 与容错解码器的解析耗时、各类不规范输出的修复率，"
+            "以及经本地大模型替身跑完整分析时的 修复 / 补问 / 兜底 比例与每次分析的调用次数")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payloads', type=int, default=2000, help="离线解析的样本数")
+        parser.add_argument('--analyses', type=int, default=200, help="经替身执行的完整分析次数")
+        parser.add_argument('--malformed-rate', type=float, default=0.3, help="替身给出不规范应答的比例")
+        parser.add_argument('--output', help="结果 JSON 路径")
+
+    def handle(self, *args, **options):
+        payloads = [llm_sim.analysis_for(f"{i:08x}") for i in range(options['payloads'])]
+        results = {
+            'payloads': len(payloads),
+            'decoder': 'orjson' if analysis_schema.orjson is not None else 'json',
+            'decode_us': self._decode_speed(payloads),
+            'repair': self._repair_rates(payloads),
+        }
+        if options['analyses']:
+            results['end_to_end'] = self._end_to_end(options)
+
+        self._report(results)
+        if options['output']:
+            save_results(options['output'], 'output_parsing', results)
+            self.stdout.write(f"结果已写入 {options['output']}")
+
+    @staticmethod
+    def _decode_speed(payloads):
+        """规范输出上每次解析的耗时 (微秒)：原先的 json.loads 与 analysis_schema.interpret (解码 + 校验)"""
+        texts = [json.dumps(p, ensure_ascii=False) for p in payloads]
+        timings = {}
+        for label, func in (('json.loads', json.loads), ('decode', analysis_schema.decode),
+                            ('interpret', analysis_schema.interpret)):
+            samples = []
+            for text in texts:
+                started = time.perf_counter()
+                func(text)
+                samples.append((time.perf_counter() - started) * 1e6)
+            timings[label] = {k: round(v, 1) for k, v in percentiles(samples).items()}
+        return timings
+
+    @staticmethod
+    def _repair_rates(payloads):
+        """各类不规范输出：不补问即可用的比例、需要补问的比例"""
+        rates = {}
+        for kind in llm_sim.MALFORMATIONS:
+            usable = 0
+            needs_reask = 0
+            for payload in payloads:
+                result, missing, _ = analysis_schema.interpret(llm_sim.malform(payload, kind))
+                if missing:
+                    needs_reask += 1
+                elif result['signal'] == payload['signal']:
+                    usable += 1
+            rates[kind] = {'usable': round(usable / len(payloads), 3),
+                           'needs_reask': round(needs_reask / len(payloads), 3)}
+        return rates
+
+    def _end_to_end(self, options):
+        """经替身跑完整的 analyze_chart_image，按指标增量统计解析结果"""
+        server, state, url = llm_sim.start_in_thread(
+            state=llm_sim.LLMState(malformed_rate=options['malformed_rate'], seed=1))
+        fd, image = tempfile.mkstemp(suffix='.png')
+        os.close(fd)
+        before = self._parse_outcomes()
+        try:
+            with override_settings(AI_API_KEY='sk-sim', AI_BASE_URL=url):
+                service = AIService()
+                service.model = llm_sim.MODELS[0]
+                for i in range(options['analyses']):
+                    Image.new('RGB', (64, 48), (i % 256, i // 256 % 256, 90)).save(image)  # 每次内容不同，应答不同
+                    service.analyze_chart_image(image)
+        finally:
+            server.shutdown()
+            os.remove(image)
+        outcomes = self._parse_outcomes() - before
+        n = options['analyses']
+        return {
+            'analyses': n,
+            'malformed_rate': options['malformed_rate'],
+            'malformed': dict(state.malformed),
+            'outcomes': dict(outcomes),
+            'repair_rate': round(outcomes['repaired'] / n, 3),
+            'reask_rate': round(outcomes['reasked'] / n, 3),
+            'failure_rate': round(outcomes['failed'] / n, 3),
+            'calls_per_analysis': round(state.calls['/v1/chat/completions'] / n, 3),
+        }
+
+    @staticmethod
+    def _parse_outcomes():
+        counts = Counter()
+        for (name, labels), value in metrics.REGISTRY.snapshot().items():
+            if name == metrics.analysis_parse.name:
+                counts[labels[0]] += value
+        return counts
+
+    def _report(self, r):
+        self.stdout.write(f"解析 {r['payloads']} 份规范输出 (解码器 {r['decoder']})，每次耗时:")
+        for label, lat in r['decode_us'].items():
+            self.stdout.write(f"  {label:<12} p50 {lat['p50']} us | p90 {lat['p90']} us | p99 {lat['p99']} us")
+        self.stdout.write("不规范输出的修复情况:")
+        for kind, rate in r['repair'].items():
+            self.stdout.write(f"  {kind:<12} 直接可用 {rate['usable']:.1%}  需补问 {rate['needs_reask']:.1%}")
+        e2e = r.get('end_to_end')
+        if e2e:
+            self.stdout.write(
+                f"经替身完整分析 {e2e['analyses']} 次 (不规范比例 {e2e['malformed_rate']:.0%}): "
+                f"结果 {e2e['outcomes']}，修复率 {e2e['repair_rate']:.1%}，补问率 {e2e['reask_rate']:.1%}，"
+                f"兜底率 {e2e['failure_rate']:.1%}，每次分析调用模型 {e2e['calls_per_analysis']} 次")
@@ -0,0 +1,103 @@
+import base64
+import io
+
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from market_scanner import analysis_schema, llm_sim, prompts
+from market_scanner.bench import save_results
+from market_scanner.services import get_openai
+
+# 分析结果的全部字段 (与 analysis_schema 的校验范围一致)
+FIELDS = tuple(analysis_schema.ENUMS) + analysis_schema.SCORES + analysis_schema.LEVELS + (
+    'key_levels', 'risk_factors', 'symbol', 'primary_pattern', 'reason')
+
+
+class Command(BaseCommand):
+    help = ("提示词模板离线对比：经本地大模型替身按各版本模板发送分析请求，统计每次调用的 prompt token、"
+            "命中前缀缓存的 token、输出字段完整率，以及补问请求的缓存命中")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=50, help="每个版本的分析请求数 (每次图片不同)")
+        parser.add_argument('--reasks', type=int, default=10, help="每个版本的补问请求数")
+        parser.add_argument('--cache-min-tokens', type=int, default=1024,
+                            help="替身前缀缓存的最短长度 (OpenAI / Gemini / Qwen 为 1024)")
+        parser.add_argument('--versions', nargs='*', default=list(prompts.TEMPLATES), help="参与对比的模板版本")
+        parser.add_argument('--output', help="结果 JSON 路径")
+
+    def handle(self, *args, **options):
+        results = {'cache_min_tokens': options['cache_min_tokens'], 'image_tokens': llm_sim.IMAGE_TOKENS,
+                   'versions': {}}
+        for version in options['versions']:
+            results['versions'][version] = self._measure(prompts.get(version), options)
+        self._report(results)
+        if options['output']:
+            save_results(options['output'], 'prompts', results)
+            self.stdout.write(f"结果已写入 {options['output']}")
+
+    @staticmethod
+    def _measure(template, options):
+        server, _, url = llm_sim.start_in_thread(
+            state=llm_sim.LLMState(seed=1, cache_min_tokens=options['cache_min_tokens']))
+        client = get_openai('sk-sim', url)
+        prompt, cached, completion, completeness, incomplete = [], [], [], [], 0
+        reask_prompt, reask_cached = [], []
+        try:
+            for i in range(options['calls']):
+                messages = template.messages(_image_url(i))
+                response = client.chat.completions.create(model=llm_sim.MODELS[0], messages=messages,
+                                                          response_format={"type": "json_object"})
+                usage = response.usage
+                prompt.append(usage.prompt_tokens)
+                cached.append(usage.prompt_tokens_details.cached_tokens)
+                completion.append(usage.completion_tokens)
+                content = response.choices[0].message.content
+                data, _ = analysis_schema.decode(content)
+                data = data if isinstance(data, dict) else {}
+                completeness.append(sum(1 for f in FIELDS if f in data) / len(FIELDS))
+                incomplete += any(f not in data for f in analysis_schema.REQUIRED)
+
+                # 补问沿用原请求 (含图片) 作为前缀，应当整段命中缓存
+                if i < options['reasks']:
+                    response = client.chat.completions.create(
+                        model=llm_sim.MODELS[0], messages=template.reask_messages(messages, content, ['signal']),
+                        response_format={"type": "json_object"})
+                    reask_prompt.append(response.usage.prompt_tokens)
+                    reask_cached.append(response.usage.prompt_tokens_details.cached_tokens)
+        finally:
+            server.shutdown()
+
+        def mean(values):
+            return round(sum(values) / len(values), 1) if values else None
+
+        return {
+            'system_chars': len(template.system),
+            'prefix_tokens': llm_sim.estimate_tokens(template.system) + llm_sim.estimate_tokens(template.instruction),
+            'prompt_tokens': mean(prompt),
+            'cached_tokens': mean(cached),
+            'uncached_tokens': mean([p - c for p, c in zip(prompt, cached)]),
+            'completion_tokens': mean(completion),
+            'field_completeness': round(sum(completeness) / len(completeness), 3) if completeness else None,
+            'missing_required_rate': round(incomplete / len(completeness), 3) if completeness else None,
+            'reask_cached_ratio': round(sum(reask_cached) / sum(reask_prompt), 3) if reask_prompt else None,
+        }
+
+    def _report(self, r):
+        self.stdout.write(f"替身：图片按 {r['image_tokens']} token 计，前缀达到 {r['cache_min_tokens']} token 才缓存")
+        for version, v in r['versions'].items():
+            self.stdout.write(
+                f"{version:<12} system {v['system_chars']} 字符，图片前固定前缀约 {v['prefix_tokens']} token | "
+                f"每次 prompt {v['prompt_tokens']} (缓存 {v['cached_tokens']}，未缓存 {v['uncached_tokens']}) | "
+                f"输出 {v['completion_tokens']} | 字段完整率 {_percent(v['field_completeness'])}，"
+                f"缺关键字段 {_percent(v['missing_required_rate'])} | 补问请求缓存命中 {_percent(v['reask_cached_ratio'])}")
+
+
+def _percent(value):
+    return '-' if value is None else f"{value:.1%}"
+
+
+def _image_url(i):
+    """每次一张内容不同的小图 (替身按请求内容生成应答，图片不同则应答不同)"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (i % 256, i // 256 % 256, 90)).save(buffer, format='PNG')
+    return f"data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode()}"
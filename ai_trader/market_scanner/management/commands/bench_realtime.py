@@ -0,0 +1,156 @@
+import asyncio
+import json
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from market_scanner import realtime
+from market_scanner.bench import temporary_database, percentiles, save_results
+
+
+class _Connection:
+    """内存中的 WebSocket 客户端：直接驱动 ASGI 应用，不经过网络"""
+
+    def __init__(self, cookie, slow_delay=0.0):
+        self.cookie = cookie
+        self.slow_delay = slow_delay
+        self.inbox = asyncio.Queue()
+        self.accepted = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.close_code = None
+        self.received = 0
+        self.latencies = []
+
+    async def receive(self):
+        return await self.inbox.get()
+
+    async def send(self, message):
+        kind = message['type']
+        if kind == 'websocket.accept':
+            self.accepted.set()
+        elif kind == 'websocket.close':
+            self.close_code = message.get('code')
+            self.closed.set()
+            self.accepted.set()
+        elif kind == 'websocket.send':
+            self.received += 1
+            if self.received % 10 == 1:  # 抽样计算端到端延迟，避免客户端解析拖慢同一事件循环
+                self.latencies.append((time.time() - json.loads(message['text'])['ts']) * 1000)
+            if self.slow_delay:
+                await asyncio.sleep(self.slow_delay)
+
+    def run(self, app):
+        scope = {'type': 'websocket', 'path': realtime.WS_PATH, 'headers': [
+            (b'host', b'testserver'), (b'cookie', f'sessionid={self.cookie}'.encode())]}
+        self.inbox.put_nowait({'type': 'websocket.connect'})
+        return asyncio.ensure_future(app(scope, self.receive, self.send))
+
+    def disconnect(self):
+        self.inbox.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+
+
+class Command(BaseCommand):
+    help = "实时推送压测：单进程单事件循环上的并发连接数、事件吞吐与端到端延迟，含慢客户端背压"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--events', type=int, default=100000, help="发布的事件总数 (轮流发给各用户)")
+        parser.add_argument('--slow', type=float, default=0.05, help="慢客户端占比")
+        parser.add_argument('--slow-delay', type=float, default=0.2, help="慢客户端每条消息的处理耗时 (秒)")
+        parser.add_argument('--queue-size', type=int, help="每连接队列长度，默认取 REALTIME_QUEUE_SIZE")
+        parser.add_argument('--output', help="结果 JSON 路径")
+
+    def handle(self, *args, **options):
+        with temporary_database():
+            cookies = []
+            for i in range(options['users']):
+                client = Client()
+                client.force_login(User.objects.create(username=f'rt_{i}'))
+                cookies.append((client.session['_auth_user_id'], client.cookies['sessionid'].value))
+            results = asyncio.run(self._run(options, cookies))
+
+        self._report(results)
+        if options['output']:
+            save_results(options['output'], 'realtime', results)
+            self.stdout.write(f"结果已写入 {options['output']}")
+
+    async def _run(self, options, cookies):
+        from ai_trader.asgi import application
+
+        hub = realtime.hub
+        hub.stats.clear()
+        if options['queue_size']:
+            hub.max_queue = options['queue_size']
+        slow_every = int(1 / options['slow']) if options['slow'] else 0
+        conns = []
+        for i in range(options['connections']):
+            user_id, cookie = cookies[i % len(cookies)]
+            slow = bool(slow_every) and i % slow_every == slow_every - 1
+            conn = _Connection(cookie, options['slow_delay'] if slow else 0.0)
+            conn.user_id = int(user_id)
+            conns.append(conn)
+
+        started = time.perf_counter()
+        tasks = [c.run(application) for c in conns]
+        await asyncio.gather(*(c.accepted.wait() for c in conns))
+        connect_seconds = time.perf_counter() - started
+        accepted = sum(1 for c in conns if c.close_code is None)
+
+        # 每个用户在线的快客户端数 -> 期望投递量
+        fast = [c for c in conns if not c.slow_delay]
+        per_user = {}
+        for c in fast:
+            per_user[c.user_id] = per_user.get(c.user_id, 0) + 1
+        user_ids = [int(u) for u, _ in cookies]
+        expected = sum(per_user.get(user_ids[i % len(user_ids)], 0) for i in range(options['events']))
+
+        # 发布端模拟视图/撮合线程：在独立线程里调用 hub.publish
+        payload = realtime.order_event(1, '600519', 'BUY', 'FILLED', 100, '1688.0000')
+
+        def publisher():
+            for i in range(options['events']):
+                hub.publish(user_ids[i % len(user_ids)], 'order.status', payload)
+
+        started = time.perf_counter()
+        thread = threading.Thread(target=publisher)
+        thread.start()
+        await asyncio.to_thread(thread.join)
+        publish_seconds = time.perf_counter() - started
+
+        deadline = time.time() + 30
+        while sum(c.received for c in fast) < expected and time.time() < deadline:
+            await asyncio.sleep(0.01)
+        deliver_seconds = time.perf_counter() - started
+
+        for c in conns:
+            c.disconnect()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        delivered = sum(c.received for c in fast)
+        latencies = [x for c in fast for x in c.latencies]
+        slow = [c for c in conns if c.slow_delay]
+        return {
+            'connections': len(conns),
+            'accepted': accepted,
+            'connect_seconds': round(connect_seconds, 3),
+            'events_published': options['events'],
+            'publish_per_sec': round(options['events'] / publish_seconds, 1),
+            'deliveries_expected': expected,
+            'deliveries': delivered,
+            'deliveries_per_sec': round(delivered / deliver_seconds, 1),
+            'latency_ms': {k: round(v, 2) for k, v in percentiles(latencies).items()},
+            'slow_clients': len(slow),
+            'slow_disconnected': sum(1 for c in slow if c.close_code == realtime.CLOSE_SLOW_CONSUMER),
+            'dropped_events': hub.stats['dropped'],
+        }
+
+    def _report(self, r):
+        self.stdout.write(f"连接: {r['accepted']}/{r['connections']} 建立耗时 {r['connect_seconds']}s")
+        self.stdout.write(f"发布: {r['events_published']} 条, {r['publish_per_sec']} 条/秒")
+        self.stdout.write(f"投递 (快客户端): {r['deliveries']}/{r['deliveries_expected']}, {r['deliveries_per_sec']} 条/秒")
+        self.stdout.write(f"端到端延迟 (ms): {r['latency_ms']}")
+        self.stdout.write(f"慢客户端: {r['slow_clients']} 个, 被断开 {r['slow_disconnected']} 个, 丢弃事件 {r['dropped_events']} 条")
@@ -0,0 +1,125 @@
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from market_scanner.analysis_scheduler import BATCH, INTERACTIVE, FairScheduler
+from market_scanner.bench import percentiles, save_results
+
+
+class Command(BaseCommand):
+    help = ("分析调度压测：一个重度用户一次提交大批任务、另一用户跑扫描，其余用户陆续单张上传，"
+            "对比 先来先服务 与 公平调度 下各用户的排队时长；并测量排队数千到十万任务时每次发放的耗时")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--slots', type=int, default=8, help="执行名额")
+        parser.add_argument('--user-limit', type=int, default=4, help="每用户并发上限")
+        parser.add_argument('--reserve', type=int, default=2, help="留给页面上传的名额")
+        parser.add_argument('--heavy-jobs', type=int, default=500, help="重度用户一次提交的任务数")
+        parser.add_argument('--scan-jobs', type=int, default=100, help="扫描用户的任务数")
+        parser.add_argument('--uploaders', type=int, default=5, help="单张上传的用户数")
+        parser.add_argument('--uploads', type=int, default=10, help="每个上传用户的上传次数")
+        parser.add_argument('--service-ms', type=float, default=20, help="每个任务的执行耗时 (毫秒，模拟模型应答)")
+        parser.add_argument('--output', help="结果 JSON 路径")
+
+    def handle(self, *args, **options):
+        results = {
+            'config': {k: options[k] for k in ('slots', 'user_limit', 'reserve', 'heavy_jobs', 'scan_jobs',
+                                               'uploaders', 'uploads', 'service_ms')},
+            'fifo': self._simulate(options, fair=False),
+            'fair': self._simulate(options, fair=True),
+            'dispatch_us': self._dispatch_cost(),
+        }
+        self._report(results)
+        if options['output']:
+            save_results(options['output'], 'scheduler', results)
+            self.stdout.write(f"结果已写入 {options['output']}")
+
+    @staticmethod
+    def _simulate(options, fair):
+        """
+        按场景提交任务，执行线程池只负责 sleep 模拟模型应答后归还名额
+        先来先服务：所有任务记在同一个调度键下 (虚拟时间单调，即按到达顺序)，不区分优先级、不设上限与保留名额
+        """
+        slots, service = options['slots'], options['service_ms'] / 1000
+        if fair:
+            scheduler = FairScheduler(slots, user_limit=options['user_limit'], interactive_reserve=options['reserve'])
+        else:
+            scheduler = FairScheduler(slots)
+        waits = defaultdict(list)
+        pending = threading.Semaphore(0)
+        total = options['heavy_jobs'] + options['scan_jobs'] + options['uploaders'] * options['uploads']
+        pool = ThreadPoolExecutor(max_workers=slots)
+
+        def run(ticket):
+            time.sleep(service)
+            scheduler.release(ticket)
+            pending.release()
+
+        def submit(user, priority):
+            ticket = scheduler.submit(user if fair else 'all', priority if fair else BATCH,
+                                      notify=lambda t: pool.submit(run, t))
+            tickets.append((user, ticket))
+
+        tickets = []
+        started = time.perf_counter()
+        for _ in range(options['heavy_jobs']):
+            submit('heavy', BATCH)
+        for _ in range(options['scan_jobs']):
+            submit('scanner', BATCH)
+
+        # 上传用户在重度任务排队期间陆续上传，间隔随机
+        rng = random.Random(1)
+        uploads = sorted((rng.uniform(0, total * service / slots * 0.8), f"user{u}")
+                         for u in range(options['uploaders']) for _ in range(options['uploads']))
+        for at, user in uploads:
+            delay = at - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+            submit(user, INTERACTIVE)
+
+        for _ in range(total):
+            pending.acquire()
+        wall = time.perf_counter() - started
+        pool.shutdown()
+
+        for user, ticket in tickets:
+            waits['uploads' if user.startswith('user') else user].append(ticket.wait_seconds * 1000)
+        return {
+            'wall_seconds': round(wall, 2),
+            'wait_ms': {user: {k: round(v, 1) for k, v in percentiles(samples).items()}
+                        for user, samples in waits.items()},
+        }
+
+    @staticmethod
+    def _dispatch_cost():
+        """排队 n 个任务 (1000 个用户、两种优先级) 后逐个 归还 + 发放 的平均耗时 (微秒)"""
+        costs = {}
+        for n in (1_000, 10_000, 100_000):
+            scheduler = FairScheduler(4, user_limit=1, interactive_reserve=1)
+            granted = []
+            rng = random.Random(n)
+            for _ in range(n):
+                scheduler.submit(rng.randrange(1000), INTERACTIVE if rng.random() < 0.1 else BATCH,
+                                 notify=granted.append)
+            started = time.perf_counter()
+            for ticket in granted:  # 每次归还都会发放下一个，新票据追加到 granted 尾部
+                scheduler.release(ticket)
+            costs[n] = round((time.perf_counter() - started) / len(granted) * 1e6, 2)
+        return costs
+
+    def _report(self, r):
+        c = r['config']
+        self.stdout.write(f"场景：{c['slots']} 个名额，每任务 {c['service_ms']} ms；重度用户 {c['heavy_jobs']} 个任务、"
+                          f"扫描用户 {c['scan_jobs']} 个任务同时提交，{c['uploaders']} 个用户各上传 {c['uploads']} 次")
+        for mode, label in (('fifo', '先来先服务'), ('fair', '公平调度')):
+            result = r[mode]
+            self.stdout.write(f"{label} (总耗时 {result['wall_seconds']}s) 排队时长:")
+            for user, lat in result['wait_ms'].items():
+                self.stdout.write(f"  {user:<10} p50 {lat['p50']} ms | p90 {lat['p90']} ms | p99 {lat['p99']} ms | "
+                                  f"max {lat['max']} ms")
+        self.stdout.write("每次 归还 + 发放 的耗时 (排队任务数: 微秒): "
+                          + "，".join(f"{n}: {us}" for n, us in r['dispatch_us'].items()))
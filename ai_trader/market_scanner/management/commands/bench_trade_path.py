@@ -0,0 +1,117 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+
+from market_scanner import broker_gateway, gtja_api
+from market_scanner.bench import temporary_database, percentiles, save_results
+from market_scanner.broker_sim import BrokerState, make_server
+
+
+class Command(BaseCommand):
+    help = "下单链路压测：经完整 Django 视图 (api/trade/execute/) 打到本地券商替身，统计延迟分位数与吞吐"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['real', 'sim'], default='real', help="real=实盘分支 (券商替身)，sim=模拟盘")
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--users', type=int, default=16)
+        parser.add_argument('--latency-ms', type=float, default=20)
+        parser.add_argument('--jitter-ms', type=float, default=10)
+        parser.add_argument('--reject-rate', type=float, default=0.0)
+        parser.add_argument('--timeout-rate', type=float, default=0.0)
+        parser.add_argument('--hang-seconds', type=float, default=3.0)
+        parser.add_argument('--output', help="结果 JSON 路径")
+
+    def handle(self, *args, **options):
+        state = BrokerState(
+            app_secrets={}, fill_delay=0.2, latency_ms=options['latency_ms'], jitter_ms=options['jitter_ms'],
+            reject_rate=options['reject_rate'], timeout_rate=options['timeout_rate'],
+            hang_seconds=options['hang_seconds'], seed=1,
+        )
+        server, _ = make_server(state=state)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = "http://%s:%s" % server.server_address[:2]
+
+        # 读超时略小于挂起时长，让注入的超时真实触发客户端超时
+        overrides = dict(GTJA_API_BASE_URL=base_url, GTJA_TIMEOUT=(1.0, max(options['hang_seconds'] - 0.5, 0.5)),
+                         GTJA_BACKOFF_BASE=0.05, GTJA_BATCH_ORDERS=True)
+        try:
+            with temporary_database(), override_settings(**overrides):
+                gtja_api.reset_clients()
+                broker_gateway.reset_gateway()
+                users = self._create_users(options, state)
+                results = self._run(options, users)
+        finally:
+            broker_gateway.reset_gateway()
+            gtja_api.reset_clients()
+            server.shutdown()
+
+        results['broker_calls'] = dict(state.calls)
+        self._report(results)
+        if options['output']:
+            save_results(options['output'], 'trade_path', results)
+            self.stdout.write(f"结果已写入 {options['output']}")
+
+    def _create_users(self, options, state):
+        users = []
+        for i in range(options['users']):
+            user = User.objects.create_user(username=f"bench{i}", password="bench12345")
+            if options['mode'] == 'real':
+                account = user.virtualaccount
+                account.is_simulation = False
+                account.broker_app_id = f"app{i}"
+                account.broker_app_secret = f"secret{i}"
+                account.broker_customer_id = f"C{i:06d}"
+                account.save()
+                state.app_secrets[account.broker_app_id] = account.broker_app_secret
+            users.append(user)
+        return users
+
+    def _run(self, options, users):
+        local = threading.local()
+
+        def one(i):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client()
+                client.force_login(users[i % len(users)])
+            body = json.dumps({'symbol': f"{600000 + i % 300:06d}", 'price': '10.00', 'quantity': 100})
+            started = time.perf_counter()
+            response = client.post('/api/trade/execute/', body, content_type='application/json')
+            elapsed = time.perf_counter() - started
+            ok = response.status_code == 200 and response.json().get('status') == 'success'
+            return elapsed, ok
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency'], initializer=lambda: None) as pool:
+            outcomes = list(pool.map(one, range(options['requests'])))
+        wall = time.perf_counter() - started
+        connections.close_all()
+
+        latencies = [t * 1000 for t, _ in outcomes]
+        return {
+            'mode': options['mode'],
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'success': sum(ok for _, ok in outcomes),
+            'errors': sum(not ok for _, ok in outcomes),
+            'wall_seconds': wall,
+            'throughput_rps': options['requests'] / wall,
+            'latency_ms': percentiles(latencies),
+        }
+
+    def _report(self, r):
+        lat = r['latency_ms']
+        self.stdout.write(
+            f"[{r['mode']}] {r['requests']} 笔 / 并发 {r['concurrency']}：成功 {r['success']}，失败 {r['errors']}，"
+            f"吞吐 {r['throughput_rps']:.1f} req/s\n"
+            f"延迟 p50 {lat['p50']:.1f} ms | p90 {lat['p90']:.1f} ms | p99 {lat['p99']:.1f} ms | max {lat['max']:.1f} ms\n"
+            f"券商替身调用: {r['broker_calls']}"
+        )
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from market_scanner.broker_sim import BrokerState, make_server
+
+
+class Command(BaseCommand):
+    help = "启动本地 GTJA 券商替身 (HTTP)，用于实盘分支联调与压测"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--app', action='append', default=[], metavar='APP_ID:SECRET',
+                            help="登记 app 并开启签名校验 (可多次传入)；不传则不校验签名")
+        parser.add_argument('--latency-ms', type=float, default=0)
+        parser.add_argument('--jitter-ms', type=float, default=0)
+        parser.add_argument('--reject-rate', type=float, default=0.0)
+        parser.add_argument('--timeout-rate', type=float, default=0.0)
+        parser.add_argument('--hang-seconds', type=float, default=15.0)
+        parser.add_argument('--fill-delay', type=float, default=0.5, help="委托从提交到全部成交的秒数")
+
+    def handle(self, *args, **options):
+        app_secrets = None
+        if options['app']:
+            try:
+                app_secrets = dict(item.split(':', 1) for item in options['app'])
+            except ValueError:
+                raise CommandError("--app 格式应为 APP_ID:SECRET")
+
+        state = BrokerState(
+            app_secrets=app_secrets, fill_delay=options['fill_delay'],
+            latency_ms=options['latency_ms'], jitter_ms=options['jitter_ms'],
+            reject_rate=options['reject_rate'], timeout_rate=options['timeout_rate'],
+            hang_seconds=options['hang_seconds'],
+        )
+        server, _ = make_server(options['host'], options['port'], state)
+        self.stdout.write(self.style.SUCCESS(
+            f"券商替身已启动: http://{options['host']}:{options['port']} "
+            f"(签名校验: {'开' if app_secrets else '关'})"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"请求统计: {dict(state.calls)}")
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from market_scanner.market_data import get_store
+
+
+class Command(BaseCommand):
+    help = "把 CSV K线 (timestamp,symbol,open,high,low,close,volume) 增量导入本地行情库"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="CSV 文件，可多个")
+        parser.add_argument('--timeframe', default='1d', help="K线周期，如 1d / 60m / 5m")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        stats = get_store().ingest_csv(options['paths'], options['timeframe'])
+        self.stdout.write(self.style.SUCCESS(
+            f"读取 {stats['rows']} 行 / {stats['symbols']} 个标的，追加 {stats['appended']} 根K线 "
+            f"({options['timeframe']})，耗时 {time.perf_counter() - started:.2f}s"
+        ))
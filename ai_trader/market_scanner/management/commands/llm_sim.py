@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from market_scanner.llm_sim import LLMState, make_server
+
+
+class Command(BaseCommand):
+    help = "启动本地大模型替身 (OpenAI 兼容接口)，用于分析链路联调与压测"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8766)
+        parser.add_argument('--latency-ms', type=float, default=800)
+        parser.add_argument('--jitter-ms', type=float, default=400)
+        parser.add_argument('--error-rate', type=float, default=0.0)
+        parser.add_argument('--malformed-rate', type=float, default=0.0, help="不规范应答的比例 (验证容错解析)")
+
+    def handle(self, *args, **options):
+        state = LLMState(latency_ms=options['latency_ms'], jitter_ms=options['jitter_ms'],
+                         error_rate=options['error_rate'], malformed_rate=options['malformed_rate'])
+        server, _ = make_server(options['host'], options['port'], state)
+        self.stdout.write(self.style.SUCCESS(
+            f"大模型替身已启动: base_url = http://{options['host']}:{options['port']}/v1 "
+            f"(延迟 {options['latency_ms']:.0f}+{options['jitter_ms']:.0f} ms)"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"请求统计: {dict(state.calls)}，同时在途峰值 {state.peak_in_flight}，"
+                              f"不规范应答 {dict(state.malformed)}")
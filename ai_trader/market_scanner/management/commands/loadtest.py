@@ -0,0 +1,388 @@
+import gc
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+import weakref
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from django.test import Client
+from django.test.utils import override_settings
+from PIL import Image
+
+from market_scanner import broker_gateway, gtja_api, llm_sim
+from market_scanner.bench import temporary_database, percentiles, save_results
+from market_scanner.broker_sim import BrokerState, start_in_thread as start_broker
+
+# 分析成功后页面上会出现该记录的交易票据链接 (并发时 response.context 会混入其他线程的渲染，不可靠)
+TICKET_LINK = re.compile(rb'/trade/ticket/(\d+)/')
+STEPS = ('login', 'upload', 'history', 'view', 'ticket', 'order', 'logout')
+PASSWORD = "load12345"
+# 每次会话买入 100 股 x 10 元，默认一百万资金跑一千来次会话就会因资金不足开始拒单，浸泡时给足资金
+STARTING_CASH = 10 ** 12
+
+
+def _rss_mb():
+    """当前进程常驻内存 (MB)；非 Linux 退化为峰值常驻内存"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _trim_heap():
+    """把 glibc 各线程 arena 里已释放但未归还的内存还给系统；多线程并发后这部分可达数十 MB，并非泄漏"""
+    try:
+        import ctypes
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def _open_fds():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+
+def _drop_signal_finalizers(client):
+    """
+    测试客户端每个请求都会重新 connect close_old_connections 与 client.store_exc_info，
+    而 Signal.connect 每次都先登记一个 weakref.finalize 再去重；挂在模块级函数与长期存活的 client 上的
+    这些 finalize 永远不会触发，浸泡时每个请求留下三个，看起来像应用在泄漏。
+    对应的接收器要么已断开、要么随进程常驻，finalize 只负责标记失效接收器，摘掉无害
+    """
+    for finalizer, info in list(weakref.finalize._registry.items()):
+        if getattr(info.func, '__name__', None) != '_remove_receiver':
+            continue
+        target = finalizer.peek()
+        if target and (target[0] is client or target[0] is close_old_connections):
+            finalizer.detach()
+
+
+def _slope_per_minute(samples, key):
+    """最小二乘斜率 (每分钟的增量)"""
+    points = [(s['t'], s[key]) for s in samples if s.get(key) is not None]
+    if len(points) < 3:
+        return None
+    n = len(points)
+    mean_t = sum(t for t, _ in points) / n
+    mean_v = sum(v for _, v in points) / n
+    var = sum((t - mean_t) ** 2 for t, _ in points)
+    if not var:
+        return None
+    return sum((t - mean_t) * (v - mean_v) for t, v in points) / var * 60
+
+
+class Command(BaseCommand):
+    help = ("全站负载 / 浸泡测试：临时数据库 + 本地大模型与券商替身，按并发用户脚本化执行 "
+            "登录 -> 上传分析 -> 看历史 -> 打开交易票据 -> 下单 -> 退出，统计各步骤延迟、吞吐，"
+            "并定期采样内存与文件句柄检测泄漏；结果存 JSON，可与基线对比")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="并发虚拟用户数")
+        parser.add_argument('--sessions', type=int, default=5, help="每个用户执行的会话次数 (给出 --duration 时忽略)")
+        parser.add_argument('--duration', type=float, help="浸泡模式：持续运行的秒数")
+        parser.add_argument('--think-ms', type=float, default=0, help="步骤之间的停顿")
+        parser.add_argument('--live-ratio', type=float, default=0.5, help="走实盘分支 (券商替身) 的用户比例")
+        parser.add_argument('--llm-latency-ms', type=float, default=200)
+        parser.add_argument('--broker-latency-ms', type=float, default=20)
+        parser.add_argument('--fast-hashing', action='store_true', help="登录改用 MD5 口令哈希，避免 PBKDF2 主导耗时")
+        parser.add_argument('--warmup-sessions', type=int, default=1,
+                            help="正式计时前每个用户先跑的会话数 (导入重型依赖、建线程池与连接)，不计入结果")
+        parser.add_argument('--sample-interval', type=float, default=2.0, help="资源采样间隔 (秒)")
+        parser.add_argument('--tracemalloc', action='store_true', help="记录 Python 内存分配增长最多的位置 (有额外开销)")
+        parser.add_argument('--fd-threshold', type=int, default=20, help="文件句柄增长超过此值判定为泄漏")
+        parser.add_argument('--rss-threshold', type=float, default=5.0, help="常驻内存增长超过 MB/分钟 判定为泄漏")
+        parser.add_argument('--output', help="结果 JSON 路径")
+        parser.add_argument('--compare', help="基线结果 JSON，输出对比并标出退化")
+        parser.add_argument('--regression-pct', type=float, default=20.0, help="延迟升高 / 吞吐下降超过此百分比视为退化")
+        parser.add_argument('--strict', action='store_true', help="有失败请求、泄漏或退化时以非零状态退出")
+
+    def handle(self, *args, **options):
+        llm_server, llm_state, llm_url = llm_sim.start_in_thread(
+            state=llm_sim.LLMState(latency_ms=options['llm_latency_ms'], jitter_ms=options['llm_latency_ms'] / 2,
+                                   seed=1))
+        broker_state = BrokerState(app_secrets={}, cash=STARTING_CASH, fill_delay=0.2,
+                                   latency_ms=options['broker_latency_ms'],
+                                   jitter_ms=options['broker_latency_ms'] / 2, seed=1)
+        broker_server, _, broker_url = start_broker(state=broker_state)
+        media = tempfile.mkdtemp(prefix='ai_trader_media_')
+        # DEBUG 关掉：开着时每条 SQL 都记进 connection.queries，测试客户端每个请求挂的模板信号接收器
+        # 也会被 Signal.connect 的参数检查缓存 (lru_cache) 连同整份模板上下文一起留住，看起来像内存泄漏
+        overrides = dict(DEBUG=False, GTJA_API_BASE_URL=broker_url, MEDIA_ROOT=media, BROKER_SUBMIT_TIMEOUT=30,
+                         GTJA_BATCH_ORDERS=True)
+        if options['fast_hashing']:
+            overrides['PASSWORD_HASHERS'] = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+        try:
+            with temporary_database(), override_settings(**overrides):
+                gtja_api.reset_clients()
+                broker_gateway.reset_gateway()
+                users = self._create_users(options, llm_url, broker_state)
+                results = self._run(options, users)
+                broker_gateway.reset_gateway()
+                gtja_api.reset_clients()
+        finally:
+            llm_server.shutdown()
+            broker_server.shutdown()
+            shutil.rmtree(media, ignore_errors=True)
+
+        results['stand_in_calls'] = {'llm': dict(llm_state.calls), 'broker': dict(broker_state.calls)}
+        problems = self._report(results, options)
+        if options['compare']:
+            problems += self._compare(results, options)
+        if options['output']:
+            save_results(options['output'], 'loadtest', results)
+            self.stdout.write(f"结果已写入 {options['output']}")
+        if options['strict'] and problems:
+            raise CommandError("; ".join(problems))
+
+    def _create_users(self, options, llm_url, broker_state):
+        users = []
+        live_count = int(round(options['users'] * options['live_ratio']))
+        for i in range(options['users']):
+            user = User.objects.create_user(username=f"load{i}", password=PASSWORD)
+            profile = user.userprofile
+            profile.api_key, profile.api_base_url, profile.selected_model = 'sk-sim', llm_url, llm_sim.MODELS[0]
+            profile.save()
+            account = user.virtualaccount
+            account.balance = account.total_assets = STARTING_CASH
+            if i < live_count:
+                account.is_simulation = False
+                account.broker_app_id, account.broker_app_secret = f"app{i}", f"secret{i}"
+                account.broker_customer_id = f"C{i:06d}"
+                broker_state.app_secrets[account.broker_app_id] = account.broker_app_secret
+            account.save()
+            users.append(user.username)
+        return users
+
+    # === 会话脚本 ===
+    def _session(self, client, username, n, record, think):
+        """执行一次完整会话，逐步调用 record(step, seconds, ok)"""
+        def step(name, call, check):
+            started = time.perf_counter()
+            try:
+                response = call()
+                ok = check(response)
+            except Exception:
+                response, ok = None, False
+            record(name, time.perf_counter() - started, ok)
+            if think:
+                time.sleep(think)
+            return response if ok else None
+
+        if not step('login', lambda: client.post('/api/login/', json.dumps({'username': username, 'password': PASSWORD}),
+                                                 content_type='application/json'), _json_ok):
+            return
+        buf = io.BytesIO()
+        Image.new('RGB', (96, 64), (n % 256, 60, 120)).save(buf, format='PNG')
+        upload = SimpleUploadedFile(f"chart_{username}_{n}.png", buf.getvalue(), content_type='image/png')
+        symbol = f"{600000 + n % 300:06d}"
+        response = step('upload', lambda: client.post('/', {'chart_image': upload, 'symbol': symbol}), _analysis_ok)
+        record_id = int(TICKET_LINK.search(response.content).group(1)) if response is not None else None
+
+        step('history', lambda: client.get('/api/history/'), _json_ok)
+        if record_id:
+            step('view', lambda: client.get('/', {'view_id': record_id}), lambda r: r.status_code == 200)
+            step('ticket', lambda: client.get(f'/trade/ticket/{record_id}/'), lambda r: r.status_code == 200)
+        body = json.dumps({'symbol': symbol, 'price': '10.00', 'quantity': 100, 'record_id': record_id})
+        step('order', lambda: client.post('/api/trade/execute/', body, content_type='application/json',
+                                          headers={'Idempotency-Key': uuid.uuid4().hex}), _json_ok)
+        step('logout', lambda: client.post('/api/logout/'), _json_ok)
+
+    def _run(self, options, users):
+        samples_by_step = defaultdict(list)
+        errors = defaultdict(int)
+        lock = threading.Lock()
+        deadline = None
+        think = options['think_ms'] / 1000
+
+        def record(step, seconds, ok):
+            with lock:
+                samples_by_step[step].append(seconds * 1000)
+                if not ok:
+                    errors[step] += 1
+
+        def virtual_user(username):
+            client = Client()
+            n = 0
+            try:
+                while (time.perf_counter() < deadline) if deadline else (n < options['sessions']):
+                    self._session(client, username, n, record, think)
+                    _drop_signal_finalizers(client)
+                    n += 1
+            finally:
+                connections.close_all()
+            return n
+
+        def warm_user(username):
+            client = Client()
+            try:
+                for n in range(options['warmup_sessions']):
+                    self._session(client, username, -1 - n, lambda *args: None, 0)
+                    _drop_signal_finalizers(client)
+            finally:
+                connections.close_all()
+
+        def sample():
+            with lock:
+                requests = sum(len(v) for v in samples_by_step.values())
+            return {'t': round(time.perf_counter() - started, 2), 'rss_mb': round(_rss_mb(), 1),
+                    'open_fds': _open_fds(), 'threads': threading.active_count(), 'requests': requests}
+
+        def idle_sample():
+            """空闲时的资源快照：运行中的采样含在途请求的套接字与连接，首尾直接相减噪声很大"""
+            gc.collect()
+            _trim_heap()
+            time.sleep(options['sample_interval'])
+            return sample()
+
+        resources, stop = [], threading.Event()
+        with ThreadPoolExecutor(len(users), thread_name_prefix='vuser') as pool:
+            # 预热：首批请求会导入 numpy / PIL / 大模型客户端、拉起网关与派发线程，这些一次性增长不算泄漏
+            list(pool.map(warm_user, users))
+            started = time.perf_counter()
+            idle_before = idle_sample()
+            if options['tracemalloc']:
+                tracemalloc.start(10)
+            baseline_snapshot = tracemalloc.take_snapshot() if options['tracemalloc'] else None
+
+            def sampler():
+                while True:
+                    resources.append(sample())
+                    if stop.wait(options['sample_interval']):
+                        return
+
+            sampler_thread = threading.Thread(target=sampler, daemon=True)
+            sampler_thread.start()
+            measured = time.perf_counter()
+            deadline = measured + options['duration'] if options['duration'] else None
+            sessions = sum(pool.map(virtual_user, users))
+            wall = time.perf_counter() - measured
+            stop.set()
+            sampler_thread.join()
+        idle_after = idle_sample()
+
+        total = sum(len(v) for v in samples_by_step.values())
+        results = {
+            'users': len(users), 'sessions': sessions, 'duration_seconds': round(wall, 2),
+            'requests': total, 'errors': sum(errors.values()),
+            'throughput_rps': round(total / wall, 2) if wall else 0,
+            'sessions_per_second': round(sessions / wall, 3) if wall else 0,
+            'steps': {
+                step: {'count': len(samples_by_step[step]), 'errors': errors[step],
+                       'latency_ms': {k: round(v, 1) for k, v in percentiles(samples_by_step[step]).items()}}
+                for step in STEPS if samples_by_step[step]
+            },
+            'resources': resources,
+            'idle': {'before': idle_before, 'after': idle_after},
+            'leaks': self._leaks(resources, idle_before, idle_after, options),
+        }
+        if baseline_snapshot is not None:
+            diff = tracemalloc.take_snapshot().compare_to(baseline_snapshot, 'lineno')
+            results['top_allocations'] = [
+                {'where': str(stat.traceback), 'size_kb': round(stat.size_diff / 1024, 1), 'count': stat.count_diff}
+                for stat in diff[:10]
+            ]
+            tracemalloc.stop()
+        return results
+
+    @staticmethod
+    def _leaks(resources, idle_before, idle_after, options):
+        """
+        文件句柄与常驻内存的增长都按预热后、正式计时前后两次空闲快照相减；
+        常驻内存另用运行期间采样的斜率判定 (只在跑满一分钟时可靠，且跳过前 1/5 的样本：
+        并发刚起时各线程 arena 扩张很快，之后才平稳)
+        """
+        if idle_before['open_fds'] is None or idle_after['open_fds'] is None:
+            fd_growth = None
+        else:
+            fd_growth = idle_after['open_fds'] - idle_before['open_fds']
+        steady = resources[len(resources) // 5:]
+        rss_slope = _slope_per_minute(steady, 'rss_mb')
+        span_minutes = (steady[-1]['t'] - steady[0]['t']) / 60 if steady else 0
+        return {
+            'fd_growth': fd_growth,
+            'rss_growth_mb': round(idle_after['rss_mb'] - idle_before['rss_mb'], 1),
+            'rss_mb_per_minute': round(rss_slope, 2) if rss_slope is not None else None,
+            'fd_leak': fd_growth is not None and fd_growth > options['fd_threshold'],
+            # 斜率在一分钟以内的样本上不可靠，短跑只报告不判定
+            'rss_leak': bool(rss_slope is not None and span_minutes >= 1 and rss_slope > options['rss_threshold']),
+        }
+
+    # === 报告与基线对比 ===
+    def _report(self, r, options):
+        problems = []
+        self.stdout.write(
+            f"{r['users']} 个并发用户，{r['sessions']} 次会话，{r['requests']} 个请求，耗时 {r['duration_seconds']}s，"
+            f"吞吐 {r['throughput_rps']} req/s ({r['sessions_per_second']} 会话/s)，失败 {r['errors']}")
+        for step, m in r['steps'].items():
+            lat = m['latency_ms']
+            self.stdout.write(f"  {step:<8} x{m['count']:<6} 失败 {m['errors']:<4} "
+                              f"p50 {lat['p50']} ms | p90 {lat['p90']} ms | p99 {lat['p99']} ms | max {lat['max']} ms")
+        if r['errors']:
+            problems.append(f"{r['errors']} 个请求失败")
+
+        leaks = r['leaks']
+        self.stdout.write(f"资源 (预热后空闲快照对比)：文件句柄增长 {leaks['fd_growth']}，"
+                          f"常驻内存增长 {leaks['rss_growth_mb']} MB ({leaks['rss_mb_per_minute']} MB/分钟)")
+        if leaks['fd_leak']:
+            problems.append(f"文件句柄增长 {leaks['fd_growth']}")
+        if leaks['rss_leak']:
+            problems.append(f"常驻内存每分钟增长 {leaks['rss_mb_per_minute']} MB")
+        for item in r.get('top_allocations', [])[:5]:
+            self.stdout.write(f"  +{item['size_kb']} KB ({item['count']:+d}) {item['where']}")
+        for problem in problems:
+            self.stdout.write(self.style.ERROR(problem))
+        return problems
+
+    def _compare(self, r, options):
+        with open(options['compare'], encoding='utf-8') as f:
+            baseline = json.load(f)
+        base = baseline['results']
+        limit = options['regression_pct'] / 100
+        problems = []
+        self.stdout.write(f"对比基线 {baseline.get('git_revision')} ({baseline.get('timestamp')}):")
+
+        def delta(new, old):
+            return (new - old) / old if old else 0.0
+
+        d = delta(r['throughput_rps'], base['throughput_rps'])
+        self.stdout.write(f"  吞吐 {base['throughput_rps']} -> {r['throughput_rps']} req/s ({d:+.0%})")
+        if d < -limit:
+            problems.append(f"吞吐下降 {-d:.0%}")
+        for step, m in r['steps'].items():
+            old = base.get('steps', {}).get(step)
+            if not old:
+                continue
+            for point in ('p50', 'p90'):
+                d = delta(m['latency_ms'][point], old['latency_ms'][point])
+                flag = d > limit
+                line = f"  {step:<8} {point} {old['latency_ms'][point]} -> {m['latency_ms'][point]} ms ({d:+.0%})"
+                self.stdout.write(self.style.ERROR(line) if flag else line)
+                if flag:
+                    problems.append(f"{step} {point} 升高 {d:.0%}")
+        return problems
+
+
+def _json_ok(response):
+    return response.status_code == 200 and response.json().get('status') == 'success'
+
+
+def _analysis_ok(response):
+    return response.status_code == 200 and TICKET_LINK.search(response.content) is not None
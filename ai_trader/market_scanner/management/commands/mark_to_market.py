@@ -0,0 +1,116 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from market_scanner.bench import temporary_database
+from market_scanner.mark_to_market import mark_all_accounts, lookup_prices, revalue
+from market_scanner.models import PaperOrder, Position, VirtualAccount
+
+
+class Command(BaseCommand):
+    help = "按本地行情快照对全部账户盯市，批量更新 VirtualAccount.total_assets"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prices', help="行情快照 CSV 路径，默认 settings.PRICE_SNAPSHOT_PATH (不存在时取本地K线库最新收盘价)")
+        parser.add_argument('--benchmark', type=int, metavar='N',
+                            help="在临时数据库里造 N 个账户，压测 读库 + 向量化估值 + 回写 全流程")
+        parser.add_argument('--positions-per-account', type=int, default=3)
+        parser.add_argument('--pending-per-account', type=float, default=0.5, help="平均每个账户的挂单限价买单数")
+        parser.add_argument('--symbols', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            return self._benchmark(options)
+
+        stats = mark_all_accounts(options['prices'])
+        self.stdout.write(self.style.SUCCESS(
+            f"已盯市 {stats['accounts']} 个账户 / {stats['positions']} 条持仓 "
+            f"(无报价 {stats['unpriced_positions']})，挂单冻结 {stats['reserved_cash']:.2f}，"
+            f"总权益 {stats['total_equity']:.2f}，浮动盈亏 {stats['total_unrealized_pnl']:.2f}，"
+            f"耗时 {stats['total_seconds'] * 1000:.1f} ms (读库 {stats['load_seconds'] * 1000:.1f} / "
+            f"估值 {stats['compute_seconds'] * 1000:.1f} / 回写 {stats['write_seconds'] * 1000:.1f})"
+        ))
+
+    def _benchmark(self, options):
+        n_accounts = options['benchmark']
+        n_pos = n_accounts * options['positions_per_account']
+        rng = np.random.default_rng(42)
+        symbols = np.array([f"{600000 + i:06d}" for i in range(options['symbols'])])
+        snap_prices = rng.uniform(2, 200, len(symbols))
+
+        fd, price_path = tempfile.mkstemp(prefix='ai_trader_prices_', suffix='.csv')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write("symbol,price\n")
+            f.writelines(f"{s},{p:.2f}\n" for s, p in zip(symbols, snap_prices))
+
+        try:
+            with temporary_database():
+                started = time.perf_counter()
+                self._seed(rng, n_accounts, n_pos, symbols, options['pending_per_account'])
+                self.stdout.write(f"造数 {time.perf_counter() - started:.1f} s")
+                runs = [mark_all_accounts(price_path) for _ in range(options['repeat'])]
+        finally:
+            os.remove(price_path)
+
+        # 同样规模下只跑内存里的估值核心，作为对照
+        balances = rng.uniform(0, 1_000_000, n_accounts)
+        pos_account_idx = rng.integers(0, n_accounts, n_pos)
+        pos_symbols = symbols[rng.integers(0, len(symbols), n_pos)]
+        pos_qty = rng.integers(1, 100, n_pos).astype(np.float64) * 100
+        pos_cost = rng.uniform(2, 200, n_pos)
+        kernel = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            price, priced = lookup_prices(pos_symbols, symbols, snap_prices)
+            revalue(balances, pos_account_idx, pos_qty, pos_cost, price, priced)
+            kernel.append(time.perf_counter() - started)
+
+        def median_ms(key):
+            return float(np.median([r[key] for r in runs])) * 1000
+
+        total = median_ms('total_seconds') / 1000
+        self.stdout.write(
+            f"{n_accounts} 个账户 / {runs[0]['positions']} 条持仓 / {len(symbols)} 个标的，"
+            f"挂单冻结 {runs[0]['reserved_cash']:.0f}："
+            f"全流程 median {total * 1000:.1f} ms (读库 {median_ms('load_seconds'):.1f} / "
+            f"估值 {median_ms('compute_seconds'):.1f} / 回写 {median_ms('write_seconds'):.1f})；"
+            f"仅估值核心 median {float(np.median(kernel)) * 1000:.1f} ms"
+        )
+        style = self.style.SUCCESS if total < 1.0 else self.style.ERROR
+        self.stdout.write(style("全流程达标 (< 1 s)" if total < 1.0 else "全流程未达标 (>= 1 s)"))
+
+    @staticmethod
+    def _seed(rng, n_accounts, n_pos, symbols, pending_per_account):
+        """批量造 用户 / 账户 / 持仓 / 挂单 (bulk_create 不触发建账户的信号，账户单独建)"""
+        batch = 5000
+        User.objects.bulk_create([User(username=f"mtm_{i}", password='!') for i in range(n_accounts)],
+                                 batch_size=batch)
+        user_ids = np.array(User.objects.filter(username__startswith='mtm_').order_by('id')
+                            .values_list('id', flat=True))
+        VirtualAccount.objects.bulk_create([
+            VirtualAccount(user_id=int(u), balance=round(float(b), 2))
+            for u, b in zip(user_ids, rng.uniform(0, 1_000_000, n_accounts))
+        ], batch_size=batch)
+
+        # 同一用户同一标的只有一条持仓
+        owners = user_ids[rng.integers(0, n_accounts, n_pos)]
+        picks = symbols[rng.integers(0, len(symbols), n_pos)]
+        _, unique = np.unique(np.char.add(owners.astype(str), picks), return_index=True)
+        Position.objects.bulk_create([
+            Position(user_id=int(owners[i]), symbol=picks[i], quantity=int(q) * 100, avg_cost=round(float(c), 4))
+            for i, q, c in zip(unique, rng.integers(1, 100, len(unique)), rng.uniform(2, 200, len(unique)))
+        ], batch_size=batch)
+
+        n_pending = int(n_accounts * pending_per_account)
+        PaperOrder.objects.bulk_create([
+            PaperOrder(user_id=int(u), symbol=s, direction='BUY', order_type='LIMIT', quantity=100,
+                       price=round(float(p), 2), status='PENDING', commission=0)
+            for u, s, p in zip(user_ids[rng.integers(0, n_accounts, n_pending)],
+                               symbols[rng.integers(0, len(symbols), n_pending)],
+                               rng.uniform(2, 200, n_pending))
+        ], batch_size=batch)
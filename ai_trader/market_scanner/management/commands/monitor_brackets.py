@@ -0,0 +1,66 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from market_scanner.bracket_monitor import BracketMonitor, Bracket
+from market_scanner.matching_engine import read_ticks
+
+
+class Command(BaseCommand):
+    help = "止损/止盈监控：回放行情文件，为触发的开仓单生成 PENDING 平仓卖单 (由撮合引擎成交)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ticks', help="行情 CSV (tick 或 K线格式)")
+        parser.add_argument('--benchmark', action='store_true', help="不读写数据库，用合成止损/止盈压测")
+        parser.add_argument('--brackets', type=int, default=1000000)
+        parser.add_argument('--symbols', type=int, default=5000)
+        parser.add_argument('--tick-count', type=int, default=1000000)
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            return self._benchmark(options)
+        if not options['ticks']:
+            raise CommandError("请通过 --ticks 指定行情文件")
+
+        monitor = BracketMonitor()
+        armed = monitor.load_armed()
+        exits = 0
+        for tick in read_ticks(options['ticks']):
+            hits = monitor.on_price(tick.symbol, tick.price)
+            if hits:
+                exits += len(monitor.create_exit_orders(hits))
+        self.stdout.write(self.style.SUCCESS(f"已布防 {armed} 笔，生成平仓单 {exits} 笔"))
+
+    def _benchmark(self, options):
+        rng = random.Random(7)
+        symbols = [f"{i:06d}" for i in range(options['symbols'])]
+        price = {s: rng.uniform(5, 100) for s in symbols}
+        monitor = BracketMonitor()
+
+        started = time.perf_counter()
+        for i in range(options['brackets']):
+            s = rng.choice(symbols)
+            p = price[s]
+            monitor.arm(Bracket(order_id=i, user_id=i % 10000, symbol=s, quantity=100,
+                                stop_loss=p * rng.uniform(0.80, 0.97), take_profit=p * rng.uniform(1.03, 1.30)))
+        arm_secs = time.perf_counter() - started
+
+        # 价格随机游走 (每步 ±0.5%)
+        walk = []
+        for _ in range(options['tick_count']):
+            s = rng.choice(symbols)
+            price[s] *= 1 + rng.uniform(-0.005, 0.005)
+            walk.append((s, price[s]))
+
+        triggered = 0
+        started = time.perf_counter()
+        for s, p in walk:
+            triggered += len(monitor.on_price(s, p))
+        tick_secs = time.perf_counter() - started
+
+        self.stdout.write(
+            f"布防 {options['brackets']:,} 笔: {arm_secs:.2f} s ({options['brackets'] / arm_secs:,.0f}/s)\n"
+            f"行情 {len(walk):,} 笔: {tick_secs:.2f} s ({len(walk) / tick_secs:,.0f} ticks/s，"
+            f"{tick_secs / len(walk) * 1e6:.2f} µs/tick)，触发 {triggered:,} 笔，剩余布防 {len(monitor.armed):,}"
+        )
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from market_scanner.broker_gateway import BrokerGateway
+
+
+class Command(BaseCommand):
+    help = "独立进程轮询所有在途实盘委托 (合并批量查询)，并批量回写 PaperOrder 状态"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="只轮询一轮")
+        parser.add_argument('--interval', type=float, help="轮询间隔 (秒)，默认 settings.BROKER_POLL_INTERVAL")
+
+    def handle(self, *args, **options):
+        gateway = BrokerGateway(poll_interval=options['interval'])
+        live = gateway.load_live()
+        self.stdout.write(f"在途实盘委托 {live} 笔")
+
+        while True:
+            updated = gateway.poll_once()
+            if updated:
+                self.stdout.write(f"更新委托状态 {updated} 笔，剩余在途 {gateway.live_count()} 笔")
+            if options['once'] or not gateway.live_count():
+                break
+            time.sleep(gateway.poll_interval)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from market_scanner.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = "清理过期的下单幂等记录 (建议加入定时任务)"
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f"已清理 {purge_expired()} 条过期幂等记录"))
@@ -0,0 +1,23 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from market_scanner.positions import rebuild_positions
+
+
+class Command(BaseCommand):
+    help = "按成交顺序回放成交明细，批量重建持仓簿 (Position)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames',
+                            help="只重建指定用户 (可多次传入)，默认全部账户")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['usernames']:
+            user_ids = list(User.objects.filter(username__in=options['usernames']).values_list('id', flat=True))
+            if not user_ids:
+                raise CommandError("未找到指定用户")
+
+        replayed, positions = rebuild_positions(user_ids=user_ids, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"已回放 {replayed} 笔成交，重建 {positions} 条持仓"))
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from market_scanner.bench import save_results
+from market_scanner.chart_renderer import render_many
+from market_scanner.market_data import BarStore, get_store
+
+
+class Command(BaseCommand):
+    help = "由本地K线批量渲染标准化K线图 (带缓存，进程池并行)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('symbols', nargs='*', help="标的代码；不填则渲染该周期下全部标的")
+        parser.add_argument('--watchlist', help="自选股文件，每行一个代码")
+        parser.add_argument('--timeframe', default='1d')
+        parser.add_argument('--workers', type=int)
+        parser.add_argument('--benchmark', type=int, metavar='N', help="合成 N 个标的到临时目录，测冷渲染与缓存命中耗时")
+        parser.add_argument('--output', help="压测结果 JSON 路径")
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            return self._benchmark(options)
+
+        symbols = list(options['symbols'])
+        if options['watchlist']:
+            with open(options['watchlist'], encoding='utf-8') as f:
+                symbols += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        symbols = symbols or get_store().symbols(options['timeframe'])
+
+        started = time.perf_counter()
+        results = render_many(symbols, options['timeframe'], workers=options['workers'])
+        elapsed = time.perf_counter() - started
+        for r in results:
+            if r.error:
+                self.stderr.write(f"{r.symbol}: {r.error}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(results)} 个标的：新渲染 {sum(1 for r in results if r.path and not r.cached)}，"
+            f"命中缓存 {sum(1 for r in results if r.cached)}，失败 {sum(1 for r in results if r.error)}，"
+            f"耗时 {elapsed:.2f}s"
+        ))
+
+    def _benchmark(self, options):
+        n = options['benchmark']
+        root = tempfile.mkdtemp(prefix='ai_trader_bars_')
+        cache_dir = tempfile.mkdtemp(prefix='ai_trader_charts_')
+        try:
+            rng = np.random.default_rng(3)
+            symbols = [f"{600000 + i:06d}" for i in range(n)]
+            ts = 1_600_000_000 + np.arange(300, dtype=np.int64) * 86400
+            series = {}
+            for symbol in symbols:
+                close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, len(ts))))
+                opens = close * (1 + rng.normal(0, 0.01, len(ts)))
+                series[symbol] = (ts, opens, np.maximum(opens, close) * 1.01, np.minimum(opens, close) * 0.99,
+                                  close, rng.integers(100_000, 10_000_000, len(ts)))
+            BarStore(root=root).append_many(series, '1d')
+
+            workers = options['workers'] or os.cpu_count()
+            with override_settings(MARKET_DATA_ROOT=root, CHART_CACHE_DIR=cache_dir):
+                started = time.perf_counter()
+                cold = render_many(symbols, '1d', workers=workers)
+                cold_seconds = time.perf_counter() - started
+                started = time.perf_counter()
+                warm = render_many(symbols, '1d', workers=workers)
+                warm_seconds = time.perf_counter() - started
+                sizes = [os.path.getsize(r.path) for r in cold if r.path]
+
+            errors = [r for r in cold if r.error]
+            results = {
+                'symbols': n, 'workers': workers, 'cpu_count': os.cpu_count(),
+                'cold_seconds': round(cold_seconds, 3),
+                'ms_per_chart_per_worker': round(cold_seconds * 1000 * min(workers, os.cpu_count()) / n, 2),
+                'warm_seconds': round(warm_seconds, 3),
+                'warm_cache_hits': sum(1 for r in warm if r.cached),
+                'errors': len(errors),
+                'avg_png_kb': round(sum(sizes) / max(len(sizes), 1) / 1024, 1),
+            }
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+        self.stdout.write(f"冷渲染 {n} 个标的 ({workers} 进程): {results['cold_seconds']}s，"
+                          f"单进程每张 {results['ms_per_chart_per_worker']} ms，平均 {results['avg_png_kb']} KB")
+        self.stdout.write(f"缓存命中: {results['warm_cache_hits']}/{n}，耗时 {results['warm_seconds']}s")
+        if errors:
+            self.stderr.write(f"渲染失败 {len(errors)} 个，例如 {errors[0].symbol}: {errors[0].error}")
+        if options['output']:
+            save_results(options['output'], 'chart_render', results)
+            self.stdout.write(f"结果已写入 {options['output']}")
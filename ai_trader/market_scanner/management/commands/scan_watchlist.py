@@ -0,0 +1,157 @@
+import random
+import shutil
+import tempfile
+import time
+import zlib
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from market_scanner.bench import temporary_database, save_results
+from market_scanner.market_data import BarStore, get_store
+from market_scanner.chart_renderer import default_style
+from market_scanner.indicators import StrategyPrescreen, basic_prescreen
+from market_scanner.scan_pipeline import ScanJob
+from market_scanner.strategy_engine import StrategyEngine
+
+
+def fake_analyzer(latency_ms, jitter_ms):
+    """压测用的大模型替身：固定+抖动延迟，按代码给出确定的结果"""
+    def analyze(path, item):
+        time.sleep((latency_ms + random.uniform(0, jitter_ms)) / 1000)
+        h = zlib.crc32(item.symbol.encode())
+        return {
+            'symbol': item.symbol, 'trend': ('Up', 'Down', 'Range')[h % 3], 'ma_structure': 'Bullish',
+            'volatility_status': 'Normal', 'risk_factors': [], 'signal': ('BUY', 'WAIT', 'SELL')[h % 3],
+            'score': 60 + h % 40, 'confidence': 50 + h % 50, 'support_levels': [], 'resistance_levels': [],
+            'reason': '压测替身',
+        }
+    return analyze
+
+
+class Command(BaseCommand):
+    help = "对自选股跑一次扫描流水线 (载入 -> 预筛 -> 渲染 -> 大模型分析 -> 策略判定 -> 批量落库)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', nargs='?', help="扫描结果归属的用户 (--benchmark 时不需要)")
+        parser.add_argument('symbols', nargs='*')
+        parser.add_argument('--watchlist', help="自选股文件，每行一个代码")
+        parser.add_argument('--all', action='store_true', help="扫描本地行情库中的全部标的")
+        parser.add_argument('--timeframe', default='1d')
+        parser.add_argument('--rpm', type=int, help="大模型每分钟调用上限，默认 SCAN_LLM_RPM")
+        parser.add_argument('--analyze-workers', type=int, help="大模型并发数")
+        parser.add_argument('--render-workers', type=int, help="渲染进程数")
+        parser.add_argument('--no-prescreen', action='store_true', help="只做基础预筛，不按策略关卡过滤")
+        parser.add_argument('--dry-run', action='store_true', help="只跑本地指标预筛，报告会被跳过的标的")
+        parser.add_argument('--benchmark', type=int, metavar='N',
+                            help="临时库 + 合成行情 + 大模型替身，扫描 N 个标的")
+        parser.add_argument('--llm-latency-ms', type=float, default=800)
+        parser.add_argument('--llm-jitter-ms', type=float, default=400)
+        parser.add_argument('--output', help="结果 JSON 路径")
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            report = self._benchmark(options)
+        else:
+            try:
+                user = User.objects.get(username=options['username'])
+            except User.DoesNotExist:
+                raise CommandError(f"用户不存在: {options['username']}")
+            symbols = list(options['symbols'])
+            if options['watchlist']:
+                with open(options['watchlist'], encoding='utf-8') as f:
+                    symbols += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+            if options['all']:
+                symbols += get_store().symbols(options['timeframe'])
+            if not symbols:
+                raise CommandError("没有要扫描的标的")
+            if options['dry_run']:
+                return self._dry_run(user, symbols, options['timeframe'], options['verbosity'])
+            report = self._job(user, symbols, options).run()
+
+        self._report(report)
+        if options['output']:
+            save_results(options['output'], 'scan', report)
+            self.stdout.write(f"结果已写入 {options['output']}")
+
+    def _job(self, user, symbols, options, analyzer=None):
+        workers = {}
+        if options['analyze_workers']:
+            workers['analyze'] = options['analyze_workers']
+        if options['render_workers']:
+            workers['render'] = options['render_workers']
+        prescreen = basic_prescreen if options['no_prescreen'] else None
+        return ScanJob(user, symbols, options['timeframe'], analyzer=analyzer, prescreen=prescreen,
+                       workers=workers, llm_rpm=options['rpm'], progress=self._progress)
+
+    def _dry_run(self, user, symbols, timeframe, verbosity):
+        """批量预筛 (整批一次向量化计算)，不渲染、不调用大模型"""
+        store = get_store()
+        style = default_style()
+        bars = {s: store.read(s, timeframe, last=style.bars + max(style.ma_periods)) for s in symbols}
+        missing = [s for s, b in bars.items() if b is None or not len(b)]
+        ready = [s for s in symbols if s not in missing]
+        prescreen = StrategyPrescreen(StrategyEngine(user).config, style.ma_periods)
+        reasons, snap = prescreen.screen([bars[s] for s in ready])
+        for i, (symbol, reason) in enumerate(zip(ready, reasons)):
+            if verbosity > 1 or reason:
+                self.stdout.write(f"  {symbol}: {reason or '通过'}  {snap.row(i)}")
+        skipped = sum(1 for r in reasons if r)
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(symbols)} 个标的：无本地行情 {len(missing)}，预筛跳过 {skipped} {dict(prescreen.rejected)}，"
+            f"需要调用大模型 {len(ready) - skipped}"
+        ))
+
+    def _progress(self, elapsed, stages, _last=[0.0]):
+        if elapsed - _last[0] < 2:
+            return
+        _last[0] = elapsed
+        self.stdout.write(f"  [{elapsed:5.1f}s] " + "  ".join(
+            f"{name}:{done}(q{depth})" for name, (done, depth) in stages.items()))
+
+    def _benchmark(self, options):
+        n = options['benchmark']
+        root = tempfile.mkdtemp(prefix='ai_trader_bars_')
+        media = tempfile.mkdtemp(prefix='ai_trader_media_')
+        try:
+            rng = np.random.default_rng(5)
+            ts = 1_600_000_000 + np.arange(250, dtype=np.int64) * 86400
+            series = {}
+            for i in range(n):
+                close = 10 * np.exp(np.cumsum(rng.normal(rng.normal(0, 0.004), 0.02, len(ts))))  # 各自带漂移
+                opens = close * (1 + rng.normal(0, 0.01, len(ts)))
+                volume = rng.integers(100_000, 10_000_000, len(ts)).astype(float)
+                if i % 20 == 0:
+                    volume[-1] = 0  # 约 5% 停牌，验证预筛
+                series[f"{600000 + i:06d}"] = (ts, opens, np.maximum(opens, close) * 1.01,
+                                               np.minimum(opens, close) * 0.99, close, volume)
+            BarStore(root=root).append_many(series, '1d')
+
+            overrides = dict(MARKET_DATA_ROOT=root, MEDIA_ROOT=media, CHART_CACHE_DIR=f"{media}/chart_cache")
+            with temporary_database(), override_settings(**overrides):
+                user = User.objects.create(username='scan_bench')
+                analyzer = fake_analyzer(options['llm_latency_ms'], options['llm_jitter_ms'])
+                report = self._job(user, list(series), options, analyzer=analyzer).run()
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+            shutil.rmtree(media, ignore_errors=True)
+
+        # 串行基线：每个标的依次等待一次大模型调用
+        report['serial_llm_seconds_estimate'] = round(
+            report['llm_calls'] * (options['llm_latency_ms'] + options['llm_jitter_ms'] / 2) / 1000, 1)
+        return report
+
+    def _report(self, r):
+        self.stdout.write(self.style.SUCCESS(
+            f"扫描 {r['symbols']} 个标的，耗时 {r['wall_seconds']}s：大模型调用 {r['llm_calls']} 次，"
+            f"写入 {r['records']} 条记录 {r['signals']}，过滤 {r['filtered']}，失败 {r['failed']}"
+            f"\n  预筛省下大模型调用 {r['llm_calls_avoided']} 次 {r['prescreen_rejected']}"
+        ))
+        for name, s in r['stages'].items():
+            self.stdout.write(f"  {name:<9} x{s['workers']:<2} 处理 {s['processed']:>5}  通过 {s['passed']:>5}  "
+                              f"过滤 {s['filtered']:>4}  错误 {s['errors']:>3}  {s['per_sec']:>8}/s  "
+                              f"利用率 {s['utilization']:.0%}  队列 均{s['queue_avg']}/峰{s['queue_max']}")
+        if 'serial_llm_seconds_estimate' in r:
+            self.stdout.write(f"  串行调用大模型预计耗时 {r['serial_llm_seconds_estimate']}s")
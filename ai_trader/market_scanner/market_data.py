@@ -0,0 +1,295 @@
+# market_scanner/market_data.py
+"""
+本地 OHLCV 行情库 (列式 + 内存映射)
+目录结构：{MARKET_DATA_ROOT}/{周期}/{代码}/{列}.bin，每列一个定长二进制文件，外加每个周期一个 index.json
+- 读取：按列 np.memmap，按时间二分定位后直接切片，不拷贝数据
+- 追加：只追加比已有最后一根更新的K线；先写列文件、后原子替换索引，
+  读取方只按索引里的行数映射，写到一半的数据不可见
+- 单写多读：同一周期的写入需串行 (ingest_bars 命令)，读取可在任意进程并发进行
+"""
+import csv
+import json
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+
+try:
+    import resource
+except ImportError:  # Windows：没有 RLIMIT_NOFILE，映射不占文件描述符
+    resource = None
+
+COLUMNS = (
+    ('ts', np.int64),        # K线起始时间 (UTC 秒)
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('close', np.float64),
+    ('volume', np.float64),
+)
+INDEX_FILE = 'index.json'
+# 未配置 MARKET_DATA_MAX_OPEN_FILES 时，映射缓存最多占用进程文件描述符上限 (RLIMIT_NOFILE 软限制) 的比例，
+# 其余留给数据库、套接字、日志等
+FD_BUDGET_RATIO = 0.25
+
+
+@dataclass
+class Bars:
+    """一段K线，各列均为映射内存上的切片 (只读、零拷贝)"""
+    symbol: str
+    timeframe: str
+    ts: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+
+    def __len__(self):
+        return len(self.ts)
+
+    def datetimes(self):
+        return self.ts.astype('datetime64[s]')
+
+
+def to_epoch(value):
+    """时间戳 (秒) 或 ISO 时间字符串 -> UTC 秒"""
+    if isinstance(value, datetime):
+        ts = value
+    else:
+        value = str(value).strip()
+        try:
+            return int(float(value))
+        except ValueError:
+            ts = datetime.fromisoformat(value)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=dt_timezone.utc)
+    return int(ts.timestamp())
+
+
+def _default_fd_budget():
+    configured = getattr(settings, 'MARKET_DATA_MAX_OPEN_FILES', None)
+    if configured is not None:
+        return configured
+    if resource is None:
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return None
+    return int(soft * FD_BUDGET_RATIO)
+
+
+class BarStore:
+    """
+    按 周期/代码 组织的列式K线库，映射过的列文件按 LRU 缓存复用
+    每个映射都持有一个文件描述符 (mmap 会 dup 一份)，缓存一个标的占 len(COLUMNS) 个，
+    因此缓存的标的数同时受 cache_size 与文件描述符预算限制
+    """
+
+    def __init__(self, root=None, cache_size=4096, max_open_files=None):
+        self.root = root or settings.MARKET_DATA_ROOT
+        fd_budget = max_open_files if max_open_files is not None else _default_fd_budget()
+        if fd_budget is not None:
+            cache_size = min(cache_size, fd_budget // len(COLUMNS))
+        self.cache_size = max(1, cache_size)
+        self._indexes = {}               # 周期 -> (index.json mtime, {代码: 元信息})
+        self._maps = OrderedDict()       # (周期, 代码) -> (行数, {列: memmap})，LRU
+        self._lock = threading.Lock()
+
+    # === 索引 ===
+    def _tf_dir(self, timeframe):
+        return os.path.join(self.root, timeframe)
+
+    def _index(self, timeframe):
+        """读取周期索引；文件被其它进程更新后 (mtime 变化) 自动重新加载"""
+        path = os.path.join(self._tf_dir(timeframe), INDEX_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        cached = self._indexes.get(timeframe)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, encoding='utf-8') as f:
+            index = json.load(f)
+        self._indexes[timeframe] = (mtime, index)
+        return index
+
+    def _write_index(self, timeframe, index):
+        path = os.path.join(self._tf_dir(timeframe), INDEX_FILE)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(index, separators=(',', ':')))  # dumps 走 C 编码器，dump 到文件是纯 Python 实现
+        os.replace(tmp, path)
+        # 刚写出的索引直接留作缓存，避免下一次追加重新解析
+        self._indexes[timeframe] = (os.stat(path).st_mtime_ns, index)
+
+    def timeframes(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(d for d in os.listdir(self.root) if os.path.isfile(os.path.join(self.root, d, INDEX_FILE)))
+
+    def symbols(self, timeframe='1d'):
+        return sorted(self._index(timeframe))
+
+    def info(self, symbol, timeframe='1d'):
+        """{'rows': 行数, 'first_ts': ..., 'last_ts': ...}，无数据返回 None"""
+        return self._index(timeframe).get(symbol)
+
+    # === 读取 ===
+    def _columns(self, symbol, timeframe, rows):
+        key = (timeframe, symbol)
+        with self._lock:
+            cached = self._maps.get(key)
+            if cached is not None and cached[0] == rows:
+                self._maps.move_to_end(key)
+                return cached[1]
+        base = os.path.join(self._tf_dir(timeframe), symbol)
+        # 转成普通 ndarray 视图 (仍由映射内存支撑)：np.memmap 子类切片的开销比读取本身还大
+        maps = {name: np.memmap(os.path.join(base, f'{name}.bin'), dtype=dtype, mode='r', shape=(rows,))
+                .view(np.ndarray) for name, dtype in COLUMNS}
+        with self._lock:
+            # 追加后行数变了：直接替换旧映射，不让它占着文件描述符等 LRU 淘汰
+            self._maps[key] = (rows, maps)
+            self._maps.move_to_end(key)
+            while len(self._maps) > self.cache_size:
+                self._maps.popitem(last=False)
+        return maps
+
+    def read(self, symbol, timeframe='1d', start=None, end=None, last=None):
+        """
+        读取 [start, end] 时间范围内的K线 (闭区间，任一端可省略)
+        :param last: 只取范围内最后 N 根
+        :return: Bars，无数据时返回 None
+        """
+        meta = self.info(symbol, timeframe)
+        if not meta or not meta['rows']:
+            return None
+        cols = self._columns(symbol, timeframe, meta['rows'])
+        ts = cols['ts']
+        lo = 0 if start is None else int(np.searchsorted(ts, to_epoch(start), side='left'))
+        hi = meta['rows'] if end is None else int(np.searchsorted(ts, to_epoch(end), side='right'))
+        if last is not None:
+            lo = max(lo, hi - last)
+        return Bars(symbol, timeframe, **{name: cols[name][lo:hi] for name, _ in COLUMNS})
+
+    def latest_close(self, symbol, timeframe='1d'):
+        bars = self.read(symbol, timeframe, last=1)
+        return float(bars.close[-1]) if bars is not None and len(bars) else None
+
+    def snapshot(self, timeframe='1d'):
+        """各标的最新收盘价，格式与 mark_to_market.load_price_snapshot 相同 (按代码排序)"""
+        symbols, prices = [], []
+        for symbol in self.symbols(timeframe):
+            price = self.latest_close(symbol, timeframe)
+            if price is not None:
+                symbols.append(symbol)
+                prices.append(price)
+        return np.array(symbols, dtype=str), np.array(prices, dtype=np.float64)
+
+    # === 写入 ===
+    def append(self, symbol, timeframe, ts, opens, highs, lows, closes, volumes):
+        """
+        追加一个标的的K线 (各参数为等长序列)，输入会按时间排序；
+        时间不晚于已有最后一根的K线被跳过，同批重复时间只保留最后一根
+        :return: 实际追加的行数
+        """
+        index = dict(self._index(timeframe))
+        return self._append(index, symbol, timeframe, ts, opens, highs, lows, closes, volumes, commit=True)
+
+    def append_many(self, series, timeframe='1d'):
+        """
+        批量追加多个标的，全部写完后只更新一次索引
+        :param series: {代码: (ts, opens, highs, lows, closes, volumes)}
+        :return: 追加的总行数
+        """
+        os.makedirs(self._tf_dir(timeframe), exist_ok=True)
+        index = dict(self._index(timeframe))
+        appended = 0
+        for symbol, columns in series.items():
+            appended += self._append(index, symbol, timeframe, *columns, commit=False)
+        if appended:
+            self._write_index(timeframe, index)
+        return appended
+
+    def _append(self, index, symbol, timeframe, ts, opens, highs, lows, closes, volumes, commit):
+        if not symbol or symbol in ('.', '..') or '/' in symbol or os.sep in symbol:
+            raise ValueError(f"非法标的代码: {symbol!r}")
+        data = {'ts': np.asarray(ts, dtype=np.int64)}
+        for name, values in (('open', opens), ('high', highs), ('low', lows), ('close', closes), ('volume', volumes)):
+            data[name] = np.asarray(values, dtype=np.float64)
+
+        # 排序并去重 (保留同一时间的最后一根)
+        order = np.argsort(data['ts'], kind='stable')
+        data = {k: v[order] for k, v in data.items()}
+        if len(data['ts']):
+            keep = np.append(data['ts'][1:] != data['ts'][:-1], True)
+            data = {k: v[keep] for k, v in data.items()}
+
+        meta = index.get(symbol) or {'rows': 0, 'first_ts': None, 'last_ts': None}
+        if meta['last_ts'] is not None:
+            fresh = data['ts'] > meta['last_ts']
+            data = {k: v[fresh] for k, v in data.items()}
+        added = len(data['ts'])
+        if not added:
+            return 0
+
+        base = os.path.join(self._tf_dir(timeframe), symbol)
+        os.makedirs(base, exist_ok=True)
+        for name, dtype in COLUMNS:
+            path = os.path.join(base, f'{name}.bin')
+            with open(path, 'ab') as f:
+                # 截掉上次写入中断留下的、索引之外的尾部
+                f.truncate(meta['rows'] * np.dtype(dtype).itemsize)
+                f.write(data[name].tobytes())
+
+        index[symbol] = {
+            'rows': meta['rows'] + added,
+            'first_ts': meta['first_ts'] if meta['first_ts'] is not None else int(data['ts'][0]),
+            'last_ts': int(data['ts'][-1]),
+        }
+        if commit:
+            self._write_index(timeframe, index)
+        return added
+
+    def ingest_csv(self, paths, timeframe='1d'):
+        """
+        导入 CSV K线 (timestamp,symbol,open,high,low,close,volume，可多标的混排)
+        全部标的写完后一次性更新索引
+        :return: {'rows': 读取行数, 'appended': 追加行数, 'symbols': 涉及标的数}
+        """
+        grouped = defaultdict(lambda: defaultdict(list))
+        read = 0
+        for path in paths:
+            with open(path, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    symbol = (row.get('symbol') or '').strip()
+                    if not symbol:
+                        continue
+                    bucket = grouped[symbol]
+                    bucket['ts'].append(to_epoch(row['timestamp']))
+                    for name in ('open', 'high', 'low', 'close'):
+                        bucket[name].append(float(row[name]))
+                    bucket['volume'].append(float(row.get('volume') or 0))
+                    read += 1
+
+        appended = self.append_many({
+            symbol: (cols['ts'], cols['open'], cols['high'], cols['low'], cols['close'], cols['volume'])
+            for symbol, cols in grouped.items()
+        }, timeframe)
+        return {'rows': read, 'appended': appended, 'symbols': len(grouped)}
+
+
+_store = None
+
+
+def get_store():
+    """进程级共享行情库 (复用已映射的列文件)"""
+    global _store
+    if _store is None or _store.root != settings.MARKET_DATA_ROOT:
+        _store = BarStore()
+    return _store
@@ -0,0 +1,316 @@
+# market_scanner/matching_engine.py
+import csv
+import heapq
+import itertools
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import PaperOrder, OrderFill, VirtualAccount
+from .positions import apply_fills
+from .bracket_monitor import Bracket
+from . import fragment_cache
+from .realtime import order_event, publish_batch_on_commit
+
+logger = logging.getLogger(__name__)
+
+CASH_QUANT = Decimal('0.01')
+PRICE_QUANT = Decimal('0.0001')
+
+
+@dataclass
+class Tick:
+    ts: datetime
+    symbol: str
+    price: float
+    volume: int
+
+
+@dataclass
+class BookOrder:
+    """簿内委托 (内存态)。limit 为 None 表示市价单"""
+    order_id: int
+    user_id: int
+    symbol: str
+    side: str
+    quantity: int
+    limit: float = None
+    filled: int = 0
+    notional: Decimal = Decimal('0')
+    commission: Decimal = Decimal('0')
+    canceled: bool = False
+    stop_loss: float = None
+    take_profit: float = None
+
+    @property
+    def remaining(self):
+        return self.quantity - self.filled
+
+
+@dataclass
+class Fill:
+    order: BookOrder
+    quantity: int
+    price: Decimal
+    commission: Decimal
+    ts: datetime
+
+
+class OrderBook:
+    """
+    单标的委托簿：买卖各一个堆，按 价格优先、时间优先 排序
+    买方堆键为 (-价格, 序号)，卖方堆键为 (价格, 序号)；市价单价格视为无穷优
+    撤单采用惰性删除，出堆时跳过
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.bids = []
+        self.asks = []
+
+    def add(self, order, seq):
+        if order.side == 'BUY':
+            key = float('-inf') if order.limit is None else -order.limit
+            heapq.heappush(self.bids, (key, seq, order))
+        else:
+            key = float('-inf') if order.limit is None else order.limit
+            heapq.heappush(self.asks, (key, seq, order))
+
+    def __len__(self):
+        return len(self.bids) + len(self.asks)
+
+    def match(self, tick, participation):
+        """
+        用一笔行情撮合：买单在 成交价 <= 限价 时成交，卖单在 成交价 >= 限价 时成交
+        每侧可成交量为 行情成交量 x 参与率，不足时按优先级部分成交
+        :return: [(BookOrder, 成交数量), ...]
+        """
+        matched = []
+        budget = int(tick.volume * participation)
+        for heap, crosses in ((self.bids, lambda o: o.limit is None or o.limit >= tick.price),
+                              (self.asks, lambda o: o.limit is None or o.limit <= tick.price)):
+            side_budget = budget
+            while heap and side_budget > 0:
+                order = heap[0][2]
+                if order.canceled or order.remaining <= 0:
+                    heapq.heappop(heap)
+                    continue
+                if not crosses(order):
+                    break
+                qty = min(order.remaining, side_budget)
+                matched.append((order, qty))
+                side_budget -= qty
+                order.filled += qty
+                if order.remaining == 0:
+                    heapq.heappop(heap)
+        return matched
+
+
+class MatchingEngine:
+    """
+    进程内模拟撮合引擎
+    - 按标的维护委托簿，回放本地 tick/K线 文件驱动撮合
+    - 成交按 费率 计佣 (每笔委托首笔成交收取最低佣金)
+    - 成交先在内存累积，按批写入 OrderFill / PaperOrder / 持仓 / 资金
+    - 挂接 BracketMonitor 时，买单完全成交后自动布防止损/止盈，触发的平仓单在同一笔行情上撮合
+    """
+
+    def __init__(self, participation=None, commission_rate=None, min_commission=None, batch_size=500,
+                 monitor=None):
+        self.monitor = monitor
+        self.books = {}
+        self.orders = {}
+        self.pending_fills = []
+        self.batch_size = batch_size
+        self.participation = participation if participation is not None else getattr(settings, 'PAPER_FILL_PARTICIPATION', 1.0)
+        self.commission_rate = Decimal(str(commission_rate if commission_rate is not None
+                                           else getattr(settings, 'PAPER_COMMISSION_RATE', '0.0003')))
+        self.min_commission = Decimal(str(min_commission if min_commission is not None
+                                          else getattr(settings, 'PAPER_MIN_COMMISSION', '5')))
+        self._seq = itertools.count()
+        self.stats = defaultdict(int)
+
+    # === 委托管理 ===
+    def add_order(self, order):
+        self.orders[order.order_id] = order
+        book = self.books.get(order.symbol)
+        if book is None:
+            book = self.books[order.symbol] = OrderBook(order.symbol)
+        book.add(order, next(self._seq))
+        self.stats['orders'] += 1
+
+    def cancel(self, order_id):
+        order = self.orders.pop(order_id, None)
+        if order:
+            order.canceled = True
+
+    def load_pending(self):
+        """从数据库装载所有未完结的委托"""
+        rows = PaperOrder.objects.filter(status__in=['PENDING', 'PARTIAL']).order_by('created_at', 'id')
+        for o in rows.iterator(chunk_size=2000):
+            self.add_order(BookOrder(
+                order_id=o.id, user_id=o.user_id, symbol=o.symbol, side=o.direction.upper(),
+                quantity=o.quantity, filled=o.filled_quantity,
+                limit=None if o.order_type == 'MARKET' else float(o.price),
+                notional=(o.avg_fill_price or Decimal('0')) * o.filled_quantity,
+                commission=o.commission,
+                stop_loss=float(o.stop_loss) if o.stop_loss else None,
+                take_profit=float(o.take_profit) if o.take_profit else None,
+            ))
+        return len(self.orders)
+
+    # === 撮合 ===
+    def on_tick(self, tick):
+        self.stats['ticks'] += 1
+        if self.monitor is not None:
+            self._trigger_brackets(tick)
+        book = self.books.get(tick.symbol)
+        if book is None or not len(book):
+            return []
+
+        fills = []
+        price = Decimal(str(tick.price)).quantize(PRICE_QUANT)
+        for order, qty in book.match(tick, self.participation):
+            notional = price * qty
+            commission = (notional * self.commission_rate).quantize(CASH_QUANT)
+            if order.commission == 0:
+                commission = max(commission, self.min_commission)
+            order.notional += notional
+            order.commission += commission
+            fill = Fill(order=order, quantity=qty, price=price, commission=commission, ts=tick.ts)
+            fills.append(fill)
+            if order.remaining == 0:
+                self.orders.pop(order.order_id, None)
+                if order.side == 'BUY' and self.monitor is not None:
+                    # 同批落库时买入成交排在平仓成交之前，因此可以立即布防
+                    self.monitor.arm(Bracket(order_id=order.order_id, user_id=order.user_id, symbol=order.symbol,
+                                             quantity=order.filled, stop_loss=order.stop_loss,
+                                             take_profit=order.take_profit))
+
+        self.stats['fills'] += len(fills)
+        self.pending_fills.extend(fills)
+        if len(self.pending_fills) >= self.batch_size:
+            self.flush()
+        return fills
+
+    def _trigger_brackets(self, tick):
+        hits = self.monitor.on_price(tick.symbol, tick.price)
+        if not hits:
+            return
+        for o in self.monitor.create_exit_orders(hits):
+            self.add_order(BookOrder(
+                order_id=o.id, user_id=o.user_id, symbol=o.symbol, side='SELL', quantity=o.quantity,
+                limit=None if o.order_type == 'MARKET' else float(o.price),
+            ))
+        self.stats['exits'] += len(hits)
+
+    def replay(self, path):
+        """回放本地行情文件直至结束，最后落库剩余成交"""
+        for tick in read_ticks(path):
+            self.on_tick(tick)
+        self.flush()
+        return dict(self.stats)
+
+    # === 批量落库 ===
+    def flush(self):
+        if not self.pending_fills:
+            return 0
+        fills, self.pending_fills = self.pending_fills, []
+
+        with transaction.atomic():
+            outcomes = apply_fills([
+                (f.order.user_id, f.order.symbol, f.order.side, f.quantity, f.price, f.commission)
+                for f in fills
+            ])
+
+            rejected = set()
+            cash = defaultdict(Decimal)
+            fill_rows = []
+            for f, error in zip(fills, outcomes):
+                if error is not None:
+                    logger.warning(f"委托 #{f.order.order_id} 成交入账失败: {error}")
+                    rejected.add(f.order.order_id)
+                    # 撮合时已计入委托的成交进度，入账失败的这笔要扣回
+                    f.order.filled -= f.quantity
+                    f.order.notional -= f.price * f.quantity
+                    f.order.commission -= f.commission
+                    continue
+                if f.order.side == 'BUY':
+                    # 下单时已按 委托价 x 数量 冻结资金，这里退还价差并扣佣金
+                    reserved = Decimal(str(f.order.limit)) if f.order.limit is not None else f.price
+                    cash[f.order.user_id] += (reserved - f.price) * f.quantity - f.commission
+                else:
+                    cash[f.order.user_id] += f.price * f.quantity - f.commission
+                fill_rows.append(OrderFill(order_id=f.order.order_id, quantity=f.quantity,
+                                           price=f.price, commission=f.commission, filled_at=f.ts))
+            OrderFill.objects.bulk_create(fill_rows, batch_size=self.batch_size)
+
+            touched = {f.order.order_id: f.order for f in fills}
+            updates = []
+            for order_id, o in touched.items():
+                if order_id in rejected:
+                    status = 'REJECTED'
+                    self.cancel(order_id)
+                    if o.side == 'BUY' and o.limit is not None:
+                        # 撤掉的限价买单退还未成交部分冻结的资金
+                        cash[o.user_id] += Decimal(str(o.limit)) * o.remaining
+                else:
+                    status = 'FILLED' if o.remaining == 0 else 'PARTIAL'
+                updates.append(PaperOrder(
+                    id=order_id, status=status, filled_quantity=o.filled,
+                    avg_fill_price=(o.notional / o.filled).quantize(PRICE_QUANT) if o.filled else None,
+                    commission=o.commission,
+                ))
+            PaperOrder.objects.bulk_update(updates, ['status', 'filled_quantity', 'avg_fill_price', 'commission'],
+                                           batch_size=self.batch_size)
+
+            for user_id, delta in cash.items():
+                VirtualAccount.objects.filter(user_id=user_id).update(balance=F('balance') + delta.quantize(CASH_QUANT))
+
+            publish_batch_on_commit(
+                [(touched[u.id].user_id, order_event(u.id, touched[u.id].symbol, touched[u.id].side, u.status,
+                                                     u.filled_quantity, u.avg_fill_price)) for u in updates],
+                cash.keys(),
+            )
+            fragment_cache.bump([o.user_id for o in touched.values()])
+
+        self.stats['flushes'] += 1
+        return len(fill_rows)
+
+
+def _parse_ts(value):
+    value = value.strip()
+    try:
+        return datetime.fromtimestamp(float(value), tz=dt_timezone.utc)
+    except ValueError:
+        ts = datetime.fromisoformat(value)
+        return ts if ts.tzinfo else ts.replace(tzinfo=dt_timezone.utc)
+
+
+def read_ticks(path):
+    """
+    读取可回放的行情文件 (按时间排序)，支持两种 CSV：
+    - tick：timestamp,symbol,price,volume
+    - K线：timestamp,symbol,open,high,low,close,volume
+      K线拆成四笔行情 O -> L -> H -> C (阳线) 或 O -> H -> L -> C (阴线)，成交量均分
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            ts = _parse_ts(row['timestamp'])
+            symbol = row['symbol'].strip()
+            volume = int(float(row.get('volume') or 0))
+            if row.get('price'):
+                yield Tick(ts, symbol, float(row['price']), volume)
+                continue
+
+            o, h, l, c = (float(row[k]) for k in ('open', 'high', 'low', 'close'))
+            path_prices = (o, l, h, c) if c >= o else (o, h, l, c)
+            share = volume // 4
+            for p in path_prices:
+                yield Tick(ts, symbol, p, share)
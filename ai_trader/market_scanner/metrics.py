@@ -0,0 +1,268 @@
+# market_scanner/metrics.py
+"""
+进程内指标 (计数器 / 直方图)，以 Prometheus 文本格式从 /metrics 暴露
+- 记录无锁：每个线程写自己的分片 (dict)，只有新线程首次记录时登记分片需要加锁；
+  异步视图都在事件循环线程里记录，同样落在一个分片上
+- 导出时合并所有分片；已退出线程的分片并入 _retired，避免每请求一线程的服务器上分片越积越多
+- 多进程：每个进程定期把自己的快照写到 METRICS_DIR/<pid>-<启动时间>.json (先写临时文件再改名)，
+  /metrics 合并目录下全部进程的快照。已退出进程的文件保留，计数器因此跨进程重启单调不减；
+  部署新版本时可清空该目录
+"""
+import atexit
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+LLM_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+BROKER_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUEUE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}       # 指标名 -> Counter / Histogram (按定义顺序导出)
+        self._local = threading.local()
+        self._shards = []       # [(线程, 分片)]
+        self._retired = {}      # 已退出线程的分片合并结果
+        self._lock = threading.Lock()
+        self._started = int(time.time())
+        self._flusher = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def shard(self):
+        """当前线程的分片：{(指标名, 标签值元组): 数值或直方图单元}"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            pass
+        shard = self._local.shard = {}
+        with self._lock:
+            self._retire_dead()
+            self._shards.append((threading.current_thread(), shard))
+        self._start_flusher()
+        return shard
+
+    def _retire_dead(self):
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                _merge(self._retired, shard)
+        self._shards = alive
+
+    def snapshot(self):
+        """合并本进程全部分片 (分片字典先整体复制，复制在 GIL 下是原子的)"""
+        with self._lock:
+            self._retire_dead()
+            merged = {key: (list(value) if isinstance(value, list) else value)
+                      for key, value in self._retired.items()}
+            for _, shard in self._shards:
+                _merge(merged, shard.copy())
+        return merged
+
+    # === 多进程汇总 ===
+    def _path(self):
+        directory = getattr(settings, 'METRICS_DIR', None)
+        return directory and os.path.join(directory, f"{os.getpid()}-{self._started}.json")
+
+    def flush(self):
+        """把本进程快照写入共享目录"""
+        path = self._path()
+        if not path:
+            return
+        rows = [[name, list(labels), value] for (name, labels), value in self.snapshot().items()]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(rows, f)
+        os.replace(tmp, path)
+
+    def _start_flusher(self):
+        if self._flusher is not None or not self._path():
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name='metrics-flusher')
+            self._flusher.start()
+        atexit.register(self._safe_flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(getattr(settings, 'METRICS_FLUSH_INTERVAL', 5))
+            self._safe_flush()
+
+    def _safe_flush(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"指标快照写入失败: {e}")
+
+    def collect(self):
+        """合并全部进程：其他进程读文件，本进程用实时快照"""
+        merged = self.snapshot()
+        own = self._path()
+        if own:
+            for path in glob.glob(os.path.join(os.path.dirname(own), '*.json')):
+                if path == own:
+                    continue
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        rows = json.load(f)
+                except (OSError, ValueError):
+                    continue  # 对方正在改名或文件损坏，本次跳过
+                _merge(merged, {(name, tuple(labels)): value for name, labels, value in rows})
+        return merged
+
+    def exposition(self):
+        """Prometheus 文本格式 (0.0.4)"""
+        samples = {}
+        for (name, labels), value in self.collect().items():
+            samples.setdefault(name, []).append((labels, value))
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(samples.get(name, [])):
+                lines.extend(metric.render(labels, value))
+        return "\n".join(lines) + "\n"
+
+
+def _merge(into, shard):
+    for key, value in shard.items():
+        current = into.get(key)
+        if current is None:
+            into[key] = list(value) if isinstance(value, list) else value
+        elif isinstance(current, list):
+            for i, v in enumerate(value):
+                current[i] += v
+        else:
+            into[key] = current + value
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.registry = registry or REGISTRY
+        self.registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        key = (self.name, tuple(str(labels.get(n, '')) for n in self.labelnames))
+        shard = self.registry.shard()
+        shard[key] = shard.get(key, 0) + amount
+
+    def render(self, labels, value):
+        return [f"{self.name}{_label_text(self.labelnames, labels)} {_number(value)}"]
+
+
+class Histogram:
+    """单元布局：各桶 (含 +Inf) 的非累计计数，最后一位是观测值之和"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LLM_BUCKETS, registry=None):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.registry = registry or REGISTRY
+        self.registry.register(self)
+
+    def observe(self, value, **labels):
+        key = (self.name, tuple(str(labels.get(n, '')) for n in self.labelnames))
+        shard = self.registry.shard()
+        cell = shard.get(key)
+        if cell is None:
+            cell = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """计时上下文；labels 可在块内修改 (例如补上 outcome)"""
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self, labels, cell):
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + ('+Inf',), cell[:-1]):
+            cumulative += count
+            le = bound if bound == '+Inf' else _number(float(bound))
+            lines.append(f"{self.name}_bucket{_label_text(self.labelnames, labels, [('le', le)])} {cumulative}")
+        lines.append(f"{self.name}_sum{_label_text(self.labelnames, labels)} {_number(float(cell[-1]))}")
+        lines.append(f"{self.name}_count{_label_text(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+REGISTRY = Registry()
+
+
+def provider_of(base_url):
+    """大模型服务商标签：base_url 的主机名"""
+    return (urlsplit(base_url).hostname if base_url else None) or 'default'
+
+
+# === 指标定义 ===
+llm_request_seconds = Histogram(
+    'ai_trader_llm_request_seconds', "大模型分析请求耗时 (秒)", ['model', 'provider', 'outcome'])
+llm_tokens = Counter(
+    'ai_trader_llm_tokens_total', "大模型 usage 中的 token 数", ['model', 'provider', 'kind'])
+llm_short_circuits = Counter(
+    'ai_trader_llm_short_circuits_total', "熔断打开期间被直接拒绝的大模型调用", ['provider', 'model'])
+llm_circuit_transitions = Counter(
+    'ai_trader_llm_circuit_transitions_total', "熔断器状态切换次数 (按切换后的状态)", ['provider', 'model', 'state'])
+analysis_total = Counter(
+    'ai_trader_analysis_total', "图表分析次数 (按实际使用的分析引擎)", ['backend'])
+analysis_fallback = Counter(
+    'ai_trader_analysis_fallback_total', "大模型不可用而改用本地指标分析的次数", ['reason'])
+analysis_queue_wait = Histogram(
+    'ai_trader_analysis_queue_wait_seconds', "分析任务排队等待执行名额的时长 (秒)", ['priority'],
+    buckets=QUEUE_BUCKETS)
+analysis_reuse = Counter(
+    'ai_trader_analysis_reuse_total',
+    "上传图表查重结果 (reused 复用近期相似图表的分析 / forced 有相似图表但用户要求重新分析 / miss 无相似图表)",
+    ['outcome'])
+analysis_parse = Counter(
+    'ai_trader_analysis_parse_total',
+    "大模型输出解析结果 (clean 直接可用 / repaired 经修复或纠正 / reasked 补问缺失字段后可用 / failed 不可用)",
+    ['outcome'])
+strategy_verdicts = Counter(
+    'ai_trader_strategy_verdicts_total', "策略引擎判定结果 (AI 原始信号 -> 最终信号)", ['raw', 'final'])
+broker_request_seconds = Histogram(
+    'ai_trader_broker_request_seconds', "券商接口请求耗时 (秒，含重试)", ['endpoint', 'outcome'],
+    buckets=BROKER_BUCKETS)
+broker_retries = Counter(
+    'ai_trader_broker_retries_total', "券商接口重试次数", ['endpoint'])
+orders_total = Counter(
+    'ai_trader_orders_total', "下单结果", ['mode', 'order_type', 'outcome'])
+cache_requests = Counter(
+    'ai_trader_cache_requests_total', "缓存命中统计", ['cache', 'result'])
@@ -0,0 +1,93 @@
+# Generated by Django 5.2 on 2026-10-19 09:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_filled_quantity(apps, schema_editor):
+    # 历史订单都是下单即按委托价成交
+    PaperOrder = apps.get_model("market_scanner", "PaperOrder")
+    PaperOrder.objects.filter(status="FILLED").update(
+        filled_quantity=F("quantity"), avg_fill_price=F("price")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("market_scanner", "0007_position"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="paperorder",
+            name="avg_fill_price",
+            field=models.DecimalField(
+                blank=True,
+                decimal_places=4,
+                max_digits=14,
+                null=True,
+                verbose_name="成交均价",
+            ),
+        ),
+        migrations.AddField(
+            model_name="paperorder",
+            name="filled_quantity",
+            field=models.IntegerField(default=0, verbose_name="已成交数量"),
+        ),
+        migrations.AddField(
+            model_name="paperorder",
+            name="order_type",
+            field=models.CharField(
+                choices=[("MARKET", "市价"), ("LIMIT", "限价")],
+                default="MARKET",
+                max_length=10,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="paperorder",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("PENDING", "待成交"),
+                    ("PARTIAL", "部分成交"),
+                    ("FILLED", "已成交"),
+                    ("CANCELED", "已撤单"),
+                    ("REJECTED", "已拒绝"),
+                ],
+                default="FILLED",
+                max_length=10,
+            ),
+        ),
+        migrations.CreateModel(
+            name="OrderFill",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("quantity", models.IntegerField()),
+                ("price", models.DecimalField(decimal_places=4, max_digits=14)),
+                (
+                    "commission",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                ("filled_at", models.DateTimeField(verbose_name="成交时间 (行情时间)")),
+                (
+                    "order",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="fills",
+                        to="market_scanner.paperorder",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(backfill_filled_quantity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-19 09:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("market_scanner", "0008_paperorder_matching"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="paperorder",
+            name="exit_reason",
+            field=models.CharField(blank=True, max_length=20, verbose_name="平仓原因"),
+        ),
+        migrations.AddField(
+            model_name="paperorder",
+            name="parent_order",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="exit_orders",
+                to="market_scanner.paperorder",
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2 on 2026-10-19 09:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("market_scanner", "0009_paperorder_exit_orders"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="paperorder",
+            name="broker_order_id",
+            field=models.CharField(
+                blank=True, db_index=True, max_length=64, verbose_name="券商合同号"
+            ),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2 on 2026-10-19 09:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("market_scanner", "0010_paperorder_broker_order_id"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IdempotencyKey",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=64)),
+                (
+                    "request_hash",
+                    models.CharField(max_length=64, verbose_name="请求体摘要"),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("IN_FLIGHT", "处理中"), ("DONE", "已完成")],
+                        default="IN_FLIGHT",
+                        max_length=10,
+                    ),
+                ),
+                ("response_status", models.IntegerField(blank=True, null=True)),
+                ("response_body", models.TextField(blank=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("expires_at", models.DateTimeField(db_index=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "key"), name="unique_idempotency_key_per_user"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("market_scanner", "0011_idempotencykey"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userprofile",
+            name="analyzer_backend",
+            field=models.CharField(
+                choices=[("llm", "大模型看图分析"), ("local", "本地指标分析")],
+                default="llm",
+                max_length=10,
+                verbose_name="分析引擎",
+            ),
+        ),
+    ]
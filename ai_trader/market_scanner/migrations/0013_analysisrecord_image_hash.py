@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-19 15:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("market_scanner", "0012_userprofile_analyzer_backend"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="analysisrecord",
+            name="image_hash",
+            field=models.CharField(
+                blank=True, default="", max_length=16, verbose_name="图像感知哈希"
+            ),
+        ),
+        migrations.AddField(
+            model_name="analysisrecord",
+            name="reused_from",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="reuses",
+                to="market_scanner.analysisrecord",
+                verbose_name="复用的分析记录",
+            ),
+        ),
+    ]
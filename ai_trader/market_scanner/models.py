@@ -1,9 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 import os
 
+from .realtime import publish_on_commit, publish_analysis_on_commit, order_event
+from . import fragment_cache
+
 
 # 1. 用户扩展配置表 (存储 API Key 和 Base URL)
 class UserProfile(models.Model):
@@ -16,6 +19,10 @@ class UserProfile(models.Model):
     api_base_url = models.CharField(max_length=200, default="https://dashscope.aliyuncs.com/compatible-mode/v1")
     selected_model = models.CharField(max_length=100, default="qwen-vl-max")
 
+    # 分析引擎：大模型看图，或由本地K线按确定规则计算 (毫秒级、无随机性)
+    ANALYZER_CHOICES = [('llm', '大模型看图分析'), ('local', '本地指标分析')]
+    analyzer_backend = models.CharField(max_length=10, choices=ANALYZER_CHOICES, default='llm', verbose_name="分析引擎")
+
     def __str__(self):
         return self.user.username
 
@@ -54,6 +61,11 @@ class AnalysisRecord(models.Model):
     final_signal = models.CharField(max_length=10, blank=True, verbose_name="策略最终信号")  # 过滤后的
     strategy_reason = models.CharField(max_length=200, blank=True, verbose_name="策略判定理由")  # 为什么被拒/通过
 
+    # === 相似图表复用 (chart_similarity) ===
+    image_hash = models.CharField(max_length=16, blank=True, default='', verbose_name="图像感知哈希")  # 64 位 dHash
+    reused_from = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='reuses',
+                                    verbose_name="复用的分析记录")  # 近似重复的上传直接复用这条记录的结果
+
     # 动态路径：按 username/date 存储
     def user_directory_path(instance, filename):
         username = instance.user.username if instance.user else 'guest'
@@ -119,10 +131,15 @@ class VirtualAccount(models.Model):
 class PaperOrder(models.Model):
     STATUS_CHOICES = [
         ('PENDING', '待成交'),
+        ('PARTIAL', '部分成交'),
         ('FILLED', '已成交'),
         ('CANCELED', '已撤单'),
         ('REJECTED', '已拒绝'),
     ]
+    ORDER_TYPE_CHOICES = [
+        ('MARKET', '市价'),
+        ('LIMIT', '限价'),
+    ]
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     analysis_record = models.ForeignKey(AnalysisRecord, on_delete=models.SET_NULL, null=True, blank=True)
@@ -131,11 +148,24 @@ class PaperOrder(models.Model):
     direction = models.CharField(max_length=10, default="BUY")  # BUY/SELL
     quantity = models.IntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)  # 成交均价/委托价
+    order_type = models.CharField(max_length=10, choices=ORDER_TYPE_CHOICES, default='MARKET')
+
+    # 撮合进度：限价单可能分多笔成交
+    filled_quantity = models.IntegerField(default=0, verbose_name="已成交数量")
+    avg_fill_price = models.DecimalField(max_digits=14, decimal_places=4, null=True, blank=True, verbose_name="成交均价")
 
     # 策略参数
     stop_loss = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     take_profit = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
 
+    # 止损/止盈触发后生成的平仓单指向原开仓单
+    parent_order = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='exit_orders')
+    exit_reason = models.CharField(max_length=20, blank=True, verbose_name="平仓原因")  # STOP_LOSS/TAKE_PROFIT
+
+    # 实盘委托在券商侧的合同号，用于批量查询委托状态
+    broker_order_id = models.CharField(max_length=64, blank=True, db_index=True, verbose_name="券商合同号")
+
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='FILLED')  # 模拟盘默认直接成交
     commission = models.DecimalField(max_digits=10, decimal_places=2, default=5.0)  # 模拟手续费
     created_at = models.DateTimeField(auto_now_add=True)
@@ -144,8 +174,93 @@ class PaperOrder(models.Model):
         return f"{self.symbol} {self.direction} @ {self.price}"
 
 
+# 撮合成交明细 (一笔委托可对应多笔成交)
+class OrderFill(models.Model):
+    order = models.ForeignKey(PaperOrder, on_delete=models.CASCADE, related_name='fills')
+    quantity = models.IntegerField()
+    price = models.DecimalField(max_digits=14, decimal_places=4)
+    commission = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    filled_at = models.DateTimeField(verbose_name="成交时间 (行情时间)")
+
+    def __str__(self):
+        return f"#{self.order_id} {self.quantity} @ {self.price}"
+
+
 # 信号：创建用户时自动发钱
 @receiver(post_save, sender=User)
 def create_virtual_account(sender, instance, created, **kwargs):
     if created:
-        VirtualAccount.objects.create(user=instance)
\ No newline at end of file
+        VirtualAccount.objects.create(user=instance)
+
+# === 持仓簿：每笔成交时在事务内增量维护，读取持仓无需回放全部订单 ===
+class Position(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='positions')
+    symbol = models.CharField(max_length=20)
+    quantity = models.IntegerField(default=0, verbose_name="持仓数量")
+    avg_cost = models.DecimalField(max_digits=14, decimal_places=4, default=0, verbose_name="持仓均价")
+    realized_pnl = models.DecimalField(max_digits=20, decimal_places=2, default=0, verbose_name="已实现盈亏")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'symbol'], name='unique_position_per_symbol'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} {self.symbol} x{self.quantity} @ {self.avg_cost}"
+
+
+# === 下单幂等键：同一用户同一键的重复请求直接回放首次响应 ===
+class IdempotencyKey(models.Model):
+    STATUS_CHOICES = [
+        ('IN_FLIGHT', '处理中'),
+        ('DONE', '已完成'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=64)
+    request_hash = models.CharField(max_length=64, verbose_name="请求体摘要")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='IN_FLIGHT')
+    response_status = models.IntegerField(null=True, blank=True)
+    response_body = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}:{self.key} ({self.status})"
+
+
+# === 实时推送：模型变更后通知在线用户 (批量落库路径由调用方自行推送) ===
+@receiver(post_save, sender=AnalysisRecord)
+def push_analysis_events(sender, instance, **kwargs):
+    publish_analysis_on_commit(instance)
+
+
+@receiver(post_save, sender=PaperOrder)
+def push_order_status(sender, instance, **kwargs):
+    publish_on_commit(instance.user_id, 'order.status', order_event(
+        instance.pk, instance.symbol, instance.direction, instance.status,
+        instance.filled_quantity, instance.avg_fill_price))
+
+
+@receiver(post_save, sender=VirtualAccount)
+def push_balance(sender, instance, **kwargs):
+    publish_on_commit(instance.user_id, 'account.balance', {
+        'balance': str(instance.balance), 'total_assets': str(instance.total_assets),
+    })
+
+
+# === 控制台片段缓存：记录 / 委托 / 资金变动后递增用户版本号 (批量落库路径由调用方自行递增) ===
+@receiver(post_save, sender=AnalysisRecord)
+@receiver(post_delete, sender=AnalysisRecord)
+@receiver(post_save, sender=PaperOrder)
+@receiver(post_delete, sender=PaperOrder)
+@receiver(post_save, sender=VirtualAccount)
+def bump_dashboard_version(sender, instance, **kwargs):
+    fragment_cache.bump([instance.user_id])
+
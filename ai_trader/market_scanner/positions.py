@@ -0,0 +1,155 @@
+# market_scanner/positions.py
+import itertools
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Position, PaperOrder, OrderFill
+
+PRICE_QUANT = Decimal('0.0001')
+CASH_QUANT = Decimal('0.01')
+
+
+class InsufficientPosition(Exception):
+    """卖出数量超过当前持仓"""
+
+
+def _apply(position, direction, quantity, price, commission):
+    """
+    把一笔成交记入持仓对象 (纯内存计算，不落库)
+    买入：手续费计入成本，摊薄均价；卖出：按均价结转已实现盈亏
+    """
+    price = Decimal(price)
+    commission = Decimal(commission or 0)
+
+    if direction.upper() == 'BUY':
+        new_qty = position.quantity + quantity
+        total_cost = position.avg_cost * position.quantity + price * quantity + commission
+        position.avg_cost = (total_cost / new_qty).quantize(PRICE_QUANT)
+        position.quantity = new_qty
+    else:
+        if quantity > position.quantity:
+            raise InsufficientPosition(f"{position.symbol} 可卖数量不足 (持仓 {position.quantity}，卖出 {quantity})")
+        pnl = (price - position.avg_cost) * quantity - commission
+        position.realized_pnl = (position.realized_pnl + pnl).quantize(CASH_QUANT)
+        position.quantity -= quantity
+        if position.quantity == 0:
+            position.avg_cost = Decimal('0')
+    return position
+
+
+def apply_fill(user, symbol, direction, quantity, price, commission=0):
+    """
+    成交入账：锁定该用户该标的的持仓行后增量更新
+    调用方若已开启事务 (如同时扣减资金)，这里会并入外层事务
+    """
+    with transaction.atomic():
+        position, _ = Position.objects.select_for_update().get_or_create(user=user, symbol=symbol)
+        _apply(position, direction, quantity, price, commission)
+        position.save()
+    return position
+
+
+def apply_fills(fills):
+    """
+    批量成交入账 (撮合引擎按批落库时使用)
+    一次锁定本批涉及的全部持仓行，在内存中按顺序回放后批量写回
+    :param fills: [(user_id, symbol, direction, quantity, price, commission), ...]
+    :return: 与 fills 对齐的列表，成功为 None，卖出超量为 InsufficientPosition 异常
+    """
+    keys = {(f[0], f[1]) for f in fills}
+    user_ids = {k[0] for k in keys}
+    symbols = {k[1] for k in keys}
+
+    with transaction.atomic():
+        existing = Position.objects.select_for_update().filter(user_id__in=user_ids, symbol__in=symbols)
+        books = {(p.user_id, p.symbol): p for p in existing}
+        known = set(books)
+
+        outcomes = []
+        for user_id, symbol, direction, quantity, price, commission in fills:
+            position = books.get((user_id, symbol))
+            if position is None:
+                position = books[(user_id, symbol)] = Position(user_id=user_id, symbol=symbol)
+            try:
+                _apply(position, direction, quantity, price, commission)
+                outcomes.append(None)
+            except InsufficientPosition as e:
+                outcomes.append(e)
+
+        touched = [books[k] for k in keys]
+        now = timezone.now()
+        for position in touched:
+            position.updated_at = now
+        Position.objects.bulk_update([p for p in touched if (p.user_id, p.symbol) in known],
+                                     ['quantity', 'avg_cost', 'realized_pnl', 'updated_at'])
+        Position.objects.bulk_create([p for p in touched if (p.user_id, p.symbol) not in known])
+    return outcomes
+
+
+def get_portfolio(user):
+    """当前持仓 (只读持仓表，与历史订单数量无关)"""
+    return Position.objects.filter(user=user, quantity__gt=0).order_by('symbol')
+
+
+def get_holding(user, symbol):
+    """查询单个标的的可用持仓数量"""
+    return (Position.objects.filter(user=user, symbol=symbol)
+            .values_list('quantity', flat=True).first()) or 0
+
+
+def get_sellable(user, symbol):
+    """
+    可卖数量：持仓减去未完结卖单 (挂单与止损/止盈平仓单) 尚未成交的部分
+    卖单挂出时不扣持仓，成交时才入账；不扣掉这部分的话同一笔持仓可以被多张卖单重复卖出
+    """
+    pending = (PaperOrder.objects
+               .filter(user=user, symbol=symbol, direction='SELL', status__in=['PENDING', 'PARTIAL'])
+               .aggregate(qty=Sum(F('quantity') - F('filled_quantity'))))['qty'] or 0
+    return get_holding(user, symbol) - pending
+
+
+def rebuild_positions(user_ids=None, batch_size=2000):
+    """
+    按成交顺序批量回放历史成交，重建持仓簿
+    用于给上线前已有的账户补齐持仓，或在怀疑持仓表漂移时校正
+    先回放没有成交明细的早期订单，再回放成交明细 (OrderFill)
+    :return: (回放成交数, 生成持仓数)
+    """
+    fills = OrderFill.objects.all()  # 只有成功入账的成交才会写明细
+    legacy = PaperOrder.objects.filter(status='FILLED', fills__isnull=True)
+    if user_ids is not None:
+        fills = fills.filter(order__user_id__in=user_ids)
+        legacy = legacy.filter(user_id__in=user_ids)
+
+    # 早期订单都早于成交明细表；成交明细按写入顺序 (id) 回放，
+    # 不按 filled_at 排，因为回放历史行情时 filled_at 是行情时间而非入账时间
+    legacy_rows = legacy.order_by('created_at', 'id').values_list(
+        'user_id', 'symbol', 'direction', 'quantity', 'price', 'commission')
+    fill_rows = fills.order_by('id').values_list(
+        'order__user_id', 'order__symbol', 'order__direction', 'quantity', 'price', 'commission')
+
+    books = {}
+    replayed = 0
+    events = itertools.chain(legacy_rows.iterator(chunk_size=batch_size), fill_rows.iterator(chunk_size=batch_size))
+    for user_id, symbol, direction, quantity, price, commission in events:
+        key = (user_id, symbol)
+        position = books.get(key)
+        if position is None:
+            position = books[key] = Position(user_id=user_id, symbol=symbol)
+        try:
+            _apply(position, direction or 'BUY', quantity, price, commission)
+        except InsufficientPosition:
+            continue
+        replayed += 1
+
+    with transaction.atomic():
+        stale = Position.objects.all()
+        if user_ids is not None:
+            stale = stale.filter(user_id__in=user_ids)
+        stale.delete()
+        Position.objects.bulk_create(books.values(), batch_size=batch_size)
+
+    return replayed, len(books)
@@ -0,0 +1,224 @@
+# market_scanner/profiling.py
+"""
+请求级性能剖析 (默认关闭，settings.PROFILING_ENABLED = True 开启)
+- span('llm') / @timed('strategy')：在业务代码里标出阶段，同名阶段累加耗时与次数
+- ProfilingMiddleware：为每个请求收集阶段耗时与 SQL 次数/耗时，写入 Server-Timing 响应头
+  (浏览器开发者工具 Network -> Timing 可直接查看)；慢请求记日志，并按比例抽样保存 cProfile 结果
+- 关闭时中间件不加载、不挂 SQL 钩子，span 只剩一次 ContextVar 读取
+- 当前请求经 ContextVar 传递，sync_to_async / asyncio.to_thread 里的阶段与 SQL 同样计入；
+  自行启动的后台线程 (如券商网关) 不属于任何请求，不计入
+"""
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_profile', default=None)
+_NULL_SPAN = nullcontext()
+# cProfile 同一线程只能有一个在运行 (异步视图共用事件循环线程)，同一时刻只剖析一个请求
+_cprofile_lock = threading.Lock()
+
+
+class RequestProfile:
+    """一个请求内的阶段耗时 (秒) 与 SQL 统计"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}         # 阶段名 -> [累计秒数, 次数]，按首次出现排序
+        self.queries = 0
+        self.query_time = 0.0
+        self._lock = threading.Lock()  # 同一请求的阶段可能在多个线程里结束
+
+    def add(self, name, seconds):
+        with self._lock:
+            entry = self.spans.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.queries += 1
+            self.query_time += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        """生成 Server-Timing 头的值"""
+        parts = []
+        for name, (seconds, count) in self.spans.items():
+            desc = f';desc="{count} calls"' if count > 1 else ''
+            parts.append(f"{name};dur={seconds * 1000:.1f}{desc}")
+        parts.append(f'db;dur={self.query_time * 1000:.1f};desc="{self.queries} queries"')
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+    def summary(self):
+        stages = " ".join(f"{name}={seconds * 1000:.0f}ms" + (f"x{count}" if count > 1 else "")
+                          for name, (seconds, count) in self.spans.items())
+        return f"{stages} db={self.query_time * 1000:.0f}ms/{self.queries}q".strip()
+
+
+class _Span:
+    __slots__ = ('profile', 'name', 'start')
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def current():
+    """当前请求的 RequestProfile (未开启剖析或不在请求内时为 None)"""
+    return _current.get()
+
+
+def span(name):
+    """
+    标记一个阶段：with span('llm'): ...
+    阶段名会出现在 Server-Timing 头里，只用字母、数字和 '-'
+    """
+    profile = _current.get()
+    return _NULL_SPAN if profile is None else _Span(profile, name)
+
+
+def timed(name):
+    """把整个函数 (同步或协程) 记为一个阶段"""
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with span(name):
+                    return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# === SQL 统计：给每个数据库连接挂一个 execute wrapper (只在开启剖析时安装) ===
+def _sql_wrapper(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(time.perf_counter() - start)
+
+
+def _install_wrapper(connection, **kwargs):
+    if _sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_sql_wrapper)
+
+
+def install_sql_hook():
+    """对此后新建的连接以及当前线程已建立的连接启用 SQL 统计"""
+    connection_created.connect(_install_wrapper, dispatch_uid='market_scanner.profiling')
+    for connection in connections.all(initialized_only=True):
+        _install_wrapper(connection)
+
+
+class ProfilingMiddleware:
+    """
+    请求剖析中间件 (同步/异步均可)，放在 MIDDLEWARE 最前面以覆盖其余中间件的耗时
+    抽样的 cProfile 只覆盖处理请求的那个线程：异步视图里 sync_to_async 中执行的部分不在其中，
+    而同一事件循环上并发的其他请求会混入结果
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_seconds = getattr(settings, 'PROFILING_SLOW_MS', 1000) / 1000
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+        self.dump_dir = getattr(settings, 'PROFILING_DUMP_DIR', None)
+        install_sql_hook()
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profile, token, profiler = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+            self._stop_profiler(profiler)
+        return self._finish(request, response, profile, profiler)
+
+    async def __acall__(self, request):
+        profile, token, profiler = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+            self._stop_profiler(profiler)
+        return self._finish(request, response, profile, profiler)
+
+    def _start(self):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        profiler = None
+        if self.dump_dir and self.sample_rate and random.random() < self.sample_rate \
+                and _cprofile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profile, token, profiler
+
+    @staticmethod
+    def _stop_profiler(profiler):
+        if profiler is not None:
+            profiler.disable()
+            _cprofile_lock.release()
+
+    def _finish(self, request, response, profile, profiler):
+        total = profile.elapsed()
+        response['Server-Timing'] = profile.server_timing(total)
+        if total >= self.slow_seconds:
+            dump = self._dump(request, profiler, total) if profiler is not None else None
+            logger.warning(f"慢请求 {request.method} {request.path} {total * 1000:.0f}ms: {profile.summary()}"
+                           + (f" (cProfile: {dump})" if dump else ""))
+        return response
+
+    def _dump(self, request, profiler, total):
+        """保存 cProfile 结果，可用 python -m pstats 或 snakeviz 查看"""
+        os.makedirs(self.dump_dir, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', request.path).strip('_') or 'root'
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.method}-{slug}-{total * 1000:.0f}ms.prof"
+        path = os.path.join(self.dump_dir, name)
+        try:
+            profiler.dump_stats(path)
+        except OSError as e:
+            logger.error(f"保存 cProfile 结果失败: {e}")
+            return None
+        return path
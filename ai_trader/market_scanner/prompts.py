@@ -0,0 +1,120 @@
+# market_scanner/prompts.py
+"""
+图表分析的提示词模板：每个版本只在这里保存一份，AIService 按 AI_PROMPT_VERSION 选用
+- 请求布局按服务商的前缀缓存设计：system (模板全文) -> user 固定指令 -> 图片放最后。
+  同一版本下图片之前的内容逐字节不变，OpenAI / Qwen / DeepSeek 等的自动前缀缓存可以命中，缓存部分按折扣计费
+- 模板是常量，不要往图片之前拼接代码、时间之类每次不同的内容，否则前缀缓存失效
+- 修改模板请新增版本号而不是原地改：分析结果记录 prompt_version，便于对比不同版本的输出
+- full-v1：原有的完整提示词 (去掉了源码缩进)；compact-v1：精简版，字段与枚举取值不变，去掉说明性文字
+  两者的 token 数与字段完整率用 bench_prompts 在本地替身上对比
+"""
+from dataclasses import dataclass
+
+from django.conf import settings
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    version: str
+    system: str
+    instruction: str      # 图片前的固定指令
+    reask: str            # 补问缺失字段，{fields} 为字段列表
+
+    def messages(self, image_url):
+        """一次分析的请求消息：不变的前缀在前，图片在最后"""
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": [
+                {"type": "text", "text": self.instruction},
+                {"type": "image_url", "image_url": {"url": image_url}},
+            ]},
+        ]
+
+    def reask_messages(self, messages, content, missing):
+        """补问：原请求 + 模型上次的输出 + 只要缺失字段的指令 (原请求整体是缓存前缀)"""
+        return messages + [
+            {"role": "assistant", "content": content or ""},
+            {"role": "user", "content": self.reask.format(fields=', '.join(missing))},
+        ]
+
+
+FULL_V1 = PromptTemplate(
+    version='full-v1',
+    system="""你是一个严谨、客观的股票交易算法辅助系统，仅提供技术结构分析，不进行投资建议或主观判断。
+
+【任务】
+基于输入的股票K线图像，对以下要素进行分析：
+- 价格趋势、形态与所处阶段
+- 均线系统结构（短、中、长周期）
+- 量价配合状态与波动率
+- 关键支撑与压力位
+- 潜在技术风险（如乖离、超涨、背离、破位）
+
+【分析范围限制】
+- 仅基于图像中的技术信息（K线、均线、成交量、MACD/KDJ等副图如果有）
+- 不使用、不推断任何基本面、消息面或情绪面信息
+- 不预测未来，只描述当前技术状态及其逻辑推论
+
+【输出要求】
+- 必须且只能输出符合 JSON 语法的字符串
+- 不得包含 ```json 或任何额外说明文本
+- 所有数值必须为图像可合理推导的近似值
+- 不使用“建议”“推荐”“应该”等主观词汇
+
+【JSON 结构定义】
+{
+    "symbol": "股票代码或 Unknown",
+    "trend": "Up/Down/Range",
+    "trend_stage": "Early/Middle/Accelerating/Exhaustion/Unknown",
+    "primary_pattern": "识别到的具体形态，如：Double Bottom, Flag, Box, Head and Shoulders, None",
+    "ma_structure": "Bullish/Bearish/Mixed/Tangled",
+    "price_ma_deviation": "Low/Medium/High",
+    "volume_state": "Expanding/Contracting/Neutral/Abnormal",
+    "volatility_status": "Low/Normal/High",
+    "support_levels": [0.0],
+    "resistance_levels": [0.0],
+    "risk_factors": [
+        "Overextended from long-term MA",
+        "Bearish Divergence",
+        "Volume decreasing on rally",
+        "Approaching major resistance"
+    ],
+    "signal": "BUY/SELL/WAIT",
+    "signal_applicable_to": "Holder/NonHolder/Both",
+    "score": 0-100,
+    "confidence": 0-100,
+    "key_levels": {
+        "short_term_hold": 0.0,
+        "trend_invalid": 0.0
+    },
+    "reason": "不超过50字的技术结构性总结，客观描述当前状态与核心矛盾"
+}""",
+    instruction="分析这张图表",
+    reask="上面的输出缺少或无法识别以下字段：{fields}。只输出包含这些字段的 JSON 对象，取值按【JSON 结构定义】。",
+)
+
+COMPACT_V1 = PromptTemplate(
+    version='compact-v1',
+    system="""股票K线图技术结构分析。只依据图中的K线、均线、成交量与副图指标，不涉及基本面与消息面，不给投资建议。
+只输出一个 JSON 对象，无代码块与其他文字；价位为图中可读出的近似值。
+{"symbol":"代码|Unknown","trend":"Up|Down|Range","trend_stage":"Early|Middle|Accelerating|Exhaustion|Unknown",\
+"primary_pattern":"形态名|None","ma_structure":"Bullish|Bearish|Mixed|Tangled","price_ma_deviation":"Low|Medium|High",\
+"volume_state":"Expanding|Contracting|Neutral|Abnormal","volatility_status":"Low|Normal|High",\
+"support_levels":[价位],"resistance_levels":[价位],"risk_factors":["技术风险"],"signal":"BUY|SELL|WAIT",\
+"signal_applicable_to":"Holder|NonHolder|Both","score":0-100,"confidence":0-100,\
+"key_levels":{"short_term_hold":价位,"trend_invalid":价位},"reason":"50字内客观总结"}""",
+    instruction="分析这张图表",
+    reask="缺少或无法识别字段：{fields}。只输出含这些字段的 JSON 对象，取值按系统提示中的定义。",
+)
+
+TEMPLATES = {t.version: t for t in (FULL_V1, COMPACT_V1)}
+DEFAULT_VERSION = FULL_V1.version
+
+
+def get(version=None):
+    """按版本取模板，默认 AI_PROMPT_VERSION；未知版本抛 KeyError (配置错误应尽早暴露)"""
+    version = version or getattr(settings, 'AI_PROMPT_VERSION', DEFAULT_VERSION)
+    try:
+        return TEMPLATES[version]
+    except KeyError:
+        raise KeyError(f"未知的提示词版本 {version}，可选: {', '.join(TEMPLATES)}") from None
@@ -0,0 +1,283 @@
+# market_scanner/realtime.py
+"""
+按用户推送的实时事件 (ASGI WebSocket，路径 /ws/events/)
+- 事件类型：analysis.completed / strategy.verdict / order.status / account.balance
+- 进程内发布订阅：任何线程都可以 publish，事件经 call_soon_threadsafe 投递到各连接所在的事件循环
+- 背压：每个连接一个有界队列，队满丢弃最旧事件；累计丢弃过多的慢客户端会被断开，由前端重连后整页刷新
+"""
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+WS_PATH = '/ws/events/'
+# 自定义关闭码：未登录 / 来源不合法 / 消费过慢
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_FORBIDDEN = 4403
+CLOSE_SLOW_CONSUMER = 4408
+
+
+class Subscriber:
+    """一个 WebSocket 连接的事件队列 (只在所属事件循环内读写)"""
+
+    def __init__(self, user_id, loop, max_queue, max_drops):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.max_drops = max_drops
+        self.dropped = 0
+        self.slow = asyncio.Event()
+
+    def offer(self, message):
+        """投递一条已序列化的事件；队满时丢弃最旧一条，丢弃过多则标记为慢客户端"""
+        if self.slow.is_set():
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            if self.dropped >= self.max_drops:
+                self.slow.set()
+                return
+        self.queue.put_nowait(message)
+
+
+def _deliver(subs, message):
+    for sub in subs:
+        sub.offer(message)
+
+
+class Hub:
+    """进程内事件分发：user_id -> {Subscriber}"""
+
+    def __init__(self, max_queue=None, max_drops=None):
+        self.max_queue = max_queue or getattr(settings, 'REALTIME_QUEUE_SIZE', 256)
+        self.max_drops = max_drops or getattr(settings, 'REALTIME_MAX_DROPS', 64)
+        self._subs = defaultdict(set)
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self.stats = defaultdict(int)
+
+    def subscribe(self, user_id):
+        sub = Subscriber(user_id, asyncio.get_running_loop(), self.max_queue, self.max_drops)
+        with self._lock:
+            self._subs[user_id].add(sub)
+            self.stats['connections'] += 1
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subs.get(sub.user_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.user_id]
+            self.stats['dropped'] += sub.dropped
+            if sub.slow.is_set():
+                self.stats['slow_disconnects'] += 1
+
+    def has_subscribers(self, user_id):
+        return user_id in self._subs
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subs.values())
+
+    def publish(self, user_id, event, data):
+        """
+        向某用户的所有连接推送事件，可在任意线程调用
+        没有在线连接时直接返回，不做序列化
+        """
+        with self._lock:
+            subs = tuple(self._subs.get(user_id, ()))
+        if not subs:
+            return 0
+        message = json.dumps({'id': next(self._seq), 'event': event, 'ts': time.time(), 'data': data},
+                             ensure_ascii=False, default=str)
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        # 同一事件循环上的连接合并成一次跨线程唤醒
+        by_loop = defaultdict(list)
+        for sub in subs:
+            by_loop[sub.loop].append(sub)
+        for loop, group in by_loop.items():
+            if loop is current:
+                _deliver(group, message)
+            else:
+                try:
+                    loop.call_soon_threadsafe(_deliver, group, message)
+                except RuntimeError:  # 事件循环已关闭
+                    pass
+        self.stats['published'] += 1
+        return len(subs)
+
+
+hub = Hub()
+
+
+def publish_on_commit(user_id, event, data):
+    """在当前事务提交后推送 (无事务时立即推送)；用户不在线时不注册回调"""
+    if user_id is None or not hub.has_subscribers(user_id):
+        return
+    transaction.on_commit(lambda: hub.publish(user_id, event, data))
+
+
+def publish_analysis_on_commit(record):
+    """分析记录落库后推送 分析完成 / 策略判定 (post_save 与批量写入路径共用)"""
+    if not record.ai_result:
+        return
+    publish_on_commit(record.user_id, 'analysis.completed', {
+        'record_id': record.pk, 'signal': record.raw_signal or record.ai_result.get('signal'),
+    })
+    if record.final_signal:
+        publish_on_commit(record.user_id, 'strategy.verdict', {
+            'record_id': record.pk, 'final_signal': record.final_signal, 'reason': record.strategy_reason,
+        })
+
+
+# === 事件构造 (供信号与批量落库路径共用) ===
+def order_event(order_id, symbol, direction, status, filled_quantity, avg_fill_price):
+    return {
+        'order_id': order_id, 'symbol': symbol, 'direction': direction, 'status': status,
+        'filled_quantity': filled_quantity,
+        'avg_fill_price': str(avg_fill_price) if avg_fill_price is not None else None,
+    }
+
+
+def publish_batch_on_commit(orders, balance_user_ids=()):
+    """
+    批量落库 (bulk_update / F 表达式) 不触发 post_save，由调用方在同一事务内登记，提交后推送
+    :param orders: [(user_id, order_event(...))]
+    :param balance_user_ids: 资金发生变化的用户，提交后查询最新资金推送
+    """
+    orders = [(u, e) for u, e in orders if hub.has_subscribers(u)]
+    users = [u for u in set(balance_user_ids) if hub.has_subscribers(u)]
+    if not orders and not users:
+        return
+
+    def push():
+        for user_id, event in orders:
+            hub.publish(user_id, 'order.status', event)
+        publish_balances(users)
+
+    transaction.on_commit(push)
+
+
+def publish_balances(user_ids):
+    """查询并推送最新资金 (只查询在线用户)"""
+    from .models import VirtualAccount
+
+    online = [u for u in set(user_ids) if hub.has_subscribers(u)]
+    if not online:
+        return
+    for user_id, balance, total in VirtualAccount.objects.filter(user_id__in=online).values_list(
+            'user_id', 'balance', 'total_assets'):
+        hub.publish(user_id, 'account.balance', {'balance': str(balance), 'total_assets': str(total)})
+
+
+# === ASGI WebSocket 端点 ===
+def _header(scope, name):
+    for key, value in scope.get('headers', ()):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def _origin_allowed(scope):
+    """拒绝跨站发起的 WebSocket (浏览器会自动带 Cookie)，来源必须与 Host 一致"""
+    origin = _header(scope, b'origin')
+    if origin is None:
+        return True
+    return urlsplit(origin).netloc == _header(scope, b'host')
+
+
+def _load_user_id(session_key):
+    """按会话 Cookie 取已登录用户 id (含会话哈希校验)，未登录返回 None"""
+    from django.contrib.auth import get_user
+
+    try:
+        store = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+        user = get_user(SimpleNamespace(session=store))
+        return user.pk if user.is_authenticated and user.is_active else None
+    finally:
+        close_old_connections()
+
+
+async def _authenticate(scope):
+    cookie = SimpleCookie()
+    cookie.load(_header(scope, b'cookie') or '')
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None
+    return await sync_to_async(_load_user_id, thread_sensitive=False)(morsel.value)
+
+
+async def _pump(sub, send):
+    """把队列中的事件写入连接；慢客户端标记后结束。队列非空时直接取，不为每条事件创建等待任务"""
+    slow = asyncio.ensure_future(sub.slow.wait())
+    try:
+        while not sub.slow.is_set():
+            if sub.queue.empty():
+                get = asyncio.ensure_future(sub.queue.get())
+                done, _ = await asyncio.wait({get, slow}, return_when=asyncio.FIRST_COMPLETED)
+                if get not in done:
+                    get.cancel()
+                    return
+                message = get.result()
+            else:
+                message = sub.queue.get_nowait()
+            await send({'type': 'websocket.send', 'text': message})
+    finally:
+        slow.cancel()
+
+
+async def _drain(receive):
+    """读取客户端消息直至断开；客户端只会发 ping"""
+    while True:
+        message = await receive()
+        if message['type'] == 'websocket.disconnect':
+            return
+
+
+async def websocket_application(scope, receive, send):
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    if scope.get('path') != WS_PATH:
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    if not _origin_allowed(scope):
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+    user_id = await _authenticate(scope)
+    if user_id is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+        return
+
+    await send({'type': 'websocket.accept'})
+    sub = hub.subscribe(user_id)
+    pump = asyncio.ensure_future(_pump(sub, send))
+    drain = asyncio.ensure_future(_drain(receive))
+    try:
+        done, _ = await asyncio.wait({pump, drain}, return_when=asyncio.FIRST_COMPLETED)
+        if pump in done and sub.slow.is_set():
+            logger.info(f"用户 {user_id} 的实时连接消费过慢 (丢弃 {sub.dropped} 条)，已断开")
+            await send({'type': 'websocket.close', 'code': CLOSE_SLOW_CONSUMER})
+    finally:
+        pump.cancel()
+        drain.cancel()
+        hub.unsubscribe(sub)
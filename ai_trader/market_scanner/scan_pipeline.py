@@ -0,0 +1,347 @@
+# market_scanner/scan_pipeline.py
+"""
+自选股扫描流水线：载入K线 -> 预筛 -> 渲染K线图 -> 大模型分析 -> 策略判定 -> 批量落库
+- 每个阶段是一组线程，阶段之间用有界队列连接，下游变慢时上游自然阻塞 (背压)
+- 预筛放在渲染之前：被筛掉的标的连图都不用画；默认按用户策略关卡做本地指标预筛 (indicators.StrategyPrescreen)
+- 渲染在进程池里进行 (CPU 密集)，渲染阶段的线程数即进程池的在途任务数
+- 大模型调用受令牌桶限速 (SCAN_LLM_RPM) 与并发上限约束，并作为批量任务经 analysis_scheduler 与其他用户公平分享执行名额
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, transaction
+
+from .chart_renderer import chart_cache_dir, default_style, render_symbol
+from .indicators import StrategyPrescreen
+from .market_data import BarStore
+from .models import AnalysisRecord
+from . import analysis_scheduler, fragment_cache
+from .realtime import publish_analysis_on_commit
+from .strategy_engine import StrategyEngine
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+@dataclass
+class ScanItem:
+    symbol: str
+    bars: object = None
+    chart_path: str = None
+    indicators: dict = None
+    analysis: dict = None
+    final_signal: str = None
+    reason: str = None
+
+
+class TokenBucket:
+    """令牌桶：rate 个/秒，最多累积 capacity 个；acquire 阻塞直到拿到令牌"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+@dataclass
+class StageStats:
+    workers: int
+    processed: int = 0
+    passed: int = 0
+    filtered: int = 0
+    errors: int = 0
+    busy_seconds: float = 0.0
+    depth_samples: list = field(default_factory=list)
+
+    def summary(self, wall_seconds):
+        depths = self.depth_samples or [0]
+        return {
+            'workers': self.workers,
+            'processed': self.processed,
+            'passed': self.passed,
+            'filtered': self.filtered,
+            'errors': self.errors,
+            'per_sec': round(self.processed / wall_seconds, 2) if wall_seconds else 0.0,
+            'utilization': round(self.busy_seconds / (wall_seconds * self.workers), 3) if wall_seconds else 0.0,
+            'queue_max': max(depths),
+            'queue_avg': round(sum(depths) / len(depths), 1),
+        }
+
+
+class Stage:
+    """
+    流水线的一个阶段
+    fn(item) 返回 item 继续向下游传递；返回 None 表示被过滤；抛异常计为错误
+    """
+
+    def __init__(self, name, fn, workers, queue_size, on_error):
+        self.name = name
+        self.fn = fn
+        self.on_error = on_error
+        self.inbox = queue.Queue(maxsize=queue_size)
+        self.stats = StageStats(workers=workers)
+        self.next = None
+        self._alive = workers
+        self._lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work, name=f"scan-{name}-{i}", daemon=True)
+                        for i in range(workers)]
+
+    def _work(self):
+        stats = self.stats
+        try:
+            while True:
+                item = self.inbox.get()
+                if item is _DONE:
+                    break
+                started = time.perf_counter()
+                try:
+                    out = self.fn(item)
+                except Exception as e:
+                    out = None
+                    with self._lock:
+                        stats.errors += 1
+                    self.on_error(item, e)
+                else:
+                    with self._lock:
+                        if out is None:
+                            stats.filtered += 1
+                        else:
+                            stats.passed += 1
+                finally:
+                    with self._lock:
+                        stats.processed += 1
+                        stats.busy_seconds += time.perf_counter() - started
+                if out is not None and self.next is not None:
+                    self.next.inbox.put(out)
+        finally:
+            close_old_connections()
+            with self._lock:
+                self._alive -= 1
+                last = self._alive == 0
+            # 本阶段最后一个线程退出时通知下游
+            if last and self.next is not None:
+                self.next.close()
+
+    def start(self):
+        for t in self.threads:
+            t.start()
+
+    def close(self):
+        for _ in self.threads:
+            self.inbox.put(_DONE)
+
+
+class ScanJob:
+    """
+    对一个用户的自选股跑一次扫描
+    :param analyzer: 可选，callable(chart_path, item) -> 分析 JSON；默认使用该用户配置的 AIService
+    :param prescreen: 可选，callable(item) -> 拒绝理由 / None；默认对照该用户 StrategyConfig 的本地指标预筛
+    :param scheduler: 可选，analysis_scheduler.FairScheduler；默认分析器走大模型时使用进程内共享实例
+    """
+
+    def __init__(self, user, symbols, timeframe='1d', analyzer=None, prescreen=None, workers=None,
+                 queue_size=None, llm_rpm=None, batch_size=None, render_pool=None, progress=None, scheduler=None):
+        self.user = user
+        self.symbols = list(dict.fromkeys(symbols))
+        self.timeframe = timeframe
+        self.style = default_style()
+        self.store = BarStore()
+        self.root, self.cache_dir = settings.MARKET_DATA_ROOT, chart_cache_dir()
+        self.engine = StrategyEngine(user)
+        self.prescreen_fn = prescreen or StrategyPrescreen(self.engine.config, self.style.ma_periods)
+        self.progress = progress
+        self.batch_size = batch_size or getattr(settings, 'SCAN_PERSIST_BATCH', 50)
+        self.queue_size = queue_size or getattr(settings, 'SCAN_QUEUE_SIZE', 64)
+        self.workers = {**getattr(settings, 'SCAN_STAGE_WORKERS', {}), **(workers or {})}
+        self.bucket = TokenBucket((llm_rpm or getattr(settings, 'SCAN_LLM_RPM', 300)) / 60.0)
+        self.render_pool = render_pool
+        self.scheduler = scheduler
+        self.filtered = []        # [(symbol, 阶段, 理由)]
+        self.failed = []          # [(symbol, 阶段, 错误)]
+        self.records = []
+        self._pending = []
+        if analyzer is None:
+            from .services import AIService
+            service = AIService(user=user)
+            analyzer = lambda path, item: service.analyze_chart_image(path, symbol=item.symbol)  # noqa: E731
+            if not service.uses_llm:
+                self.bucket = None  # 本地引擎不占用大模型调用额度
+            elif self.scheduler is None:
+                self.scheduler = analysis_scheduler.get()
+        self.analyzer = analyzer
+
+    # === 各阶段 ===
+    def _load(self, item):
+        bars = self.store.read(item.symbol, self.timeframe, last=self.style.bars + max(self.style.ma_periods))
+        if bars is None or not len(bars):
+            self.filtered.append((item.symbol, 'load', '无本地行情'))
+            return None
+        item.bars = bars
+        return item
+
+    def _prescreen(self, item):
+        reason = self.prescreen_fn(item)
+        if reason:
+            self.filtered.append((item.symbol, 'prescreen', reason))
+            return None
+        return item
+
+    def _render(self, item):
+        args = (self.root, self.cache_dir, item.symbol, self.timeframe, self.style)
+        result = self.render_pool.submit(render_symbol, *args).result() if self.render_pool \
+            else render_symbol(*args, store=self.store)
+        if result.error:
+            raise RuntimeError(result.error)
+        item.chart_path = result.path
+        item.bars = None  # 之后的阶段不再需要K线，尽早释放
+        return item
+
+    def _analyze(self, item):
+        if self.bucket:
+            self.bucket.acquire()
+        if self.scheduler is None:
+            result = self.analyzer(item.chart_path, item)
+        else:
+            with self.scheduler.slot(analysis_scheduler.user_key(self.user), analysis_scheduler.BATCH):
+                result = self.analyzer(item.chart_path, item)
+        if not result or result.get('error'):
+            raise RuntimeError((result or {}).get('error', '分析结果为空'))
+        result['symbol'] = item.symbol
+        item.analysis = result
+        return item
+
+    def _evaluate(self, item):
+        item.final_signal, item.reason = self.engine.evaluate(item.analysis)
+        item.analysis['strategy_reason'] = item.reason
+        if item.indicators:
+            item.analysis['indicators'] = item.indicators
+        return item
+
+    # === 批量落库 (单线程阶段) ===
+    def _collect(self, item):
+        self._pending.append(item)
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        return item
+
+    def _flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            self._persist(batch)
+        except Exception as e:
+            logger.error(f"[扫描/persist] 批量写入 {len(batch)} 条失败: {e}")
+            self.failed.extend((item.symbol, 'persist', str(e)) for item in batch)
+
+    def _persist(self, batch):
+        rows = []
+        for item in batch:
+            record = AnalysisRecord(user=self.user, ai_result=item.analysis,
+                                    raw_signal=item.analysis.get('signal', 'N/A'), final_signal=item.final_signal,
+                                    strategy_reason=(item.reason or '')[:200])
+            # 渲染缓存会被清理/复用，记录里存一份自己的图
+            with open(item.chart_path, 'rb') as f:
+                record.chart_image.save(f"{item.symbol}_{os.path.basename(item.chart_path)}", File(f), save=False)
+            rows.append(record)
+        with transaction.atomic():
+            created = AnalysisRecord.objects.bulk_create(rows)
+            for record in created:
+                publish_analysis_on_commit(record)
+            fragment_cache.bump([self.user.id])
+        self.records.extend(created)
+
+    # === 运行 ===
+    def run(self):
+        w = self.workers
+        cpu = os.cpu_count() or 1
+        specs = [
+            ('load', self._load, w.get('load', 2)),
+            ('prescreen', self._prescreen, w.get('prescreen', 1)),
+            ('render', self._render, w.get('render', cpu)),
+            ('analyze', self._analyze, w.get('analyze', 8)),
+            ('evaluate', self._evaluate, w.get('evaluate', 1)),
+            ('persist', self._collect, 1),
+        ]
+        stages = [Stage(name, fn, workers, self.queue_size, self._recorder(name)) for name, fn, workers in specs]
+        for upstream, downstream in zip(stages, stages[1:]):
+            upstream.next = downstream
+
+        own_pool = None
+        if self.render_pool is None and stages[2].stats.workers > 1:
+            # 多线程进程里 fork 不安全 (可能继承被持有的锁)，用 spawn 启动渲染进程
+            self.render_pool = own_pool = ProcessPoolExecutor(max_workers=min(stages[2].stats.workers, cpu),
+                                                              mp_context=multiprocessing.get_context('spawn'))
+
+        started = time.perf_counter()
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample, args=(stages, stop, started), daemon=True)
+        try:
+            for stage in stages:
+                stage.start()
+            sampler.start()
+            for symbol in self.symbols:
+                stages[0].inbox.put(ScanItem(symbol))  # 队满时阻塞：输入侧同样受背压约束
+            stages[0].close()
+            for stage in stages:
+                for t in stage.threads:
+                    t.join()
+            self._flush()
+        finally:
+            stop.set()
+            if own_pool is not None:
+                own_pool.shutdown()
+                self.render_pool = None
+        wall = time.perf_counter() - started
+
+        return {
+            'symbols': len(self.symbols),
+            'wall_seconds': round(wall, 3),
+            'records': len(self.records),
+            'llm_calls': stages[3].stats.processed,
+            'signals': dict(Counter(r.final_signal for r in self.records)),
+            'filtered': len(self.filtered),
+            'llm_calls_avoided': stages[1].stats.filtered,
+            'prescreen_rejected': dict(getattr(self.prescreen_fn, 'rejected', {})),
+            'failed': len(self.failed),
+            'stages': {s.name: s.stats.summary(wall) for s in stages},
+        }
+
+    def _recorder(self, name):
+        def on_error(item, error):
+            logger.warning(f"[扫描/{name}] {item.symbol}: {error}")
+            self.failed.append((item.symbol, name, str(error)))
+        return on_error
+
+    def _sample(self, stages, stop, started, interval=0.2):
+        """定期采样各阶段队列深度，并回调进度"""
+        while not stop.wait(interval):
+            for stage in stages:
+                stage.stats.depth_samples.append(stage.inbox.qsize())
+            if self.progress:
+                self.progress(time.perf_counter() - started, {s.name: (s.stats.processed, s.inbox.qsize())
+                                                              for s in stages})
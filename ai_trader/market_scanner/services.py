@@ -1,21 +1,76 @@
+import asyncio
 import base64
 import json
+import logging
 import os
-import random
-from openai import OpenAI
+import threading
+import time
+from dataclasses import dataclass
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core.files.base import ContentFile
 
+from . import analysis_schema, chart_similarity, circuit_breaker, loop_clients, metrics, prompts
+from .profiling import span, timed
+
+logger = logging.getLogger(__name__)
+
+# (api_key, base_url) -> OpenAI：每次请求都新建客户端要重新加载 CA 证书 (约 30ms)，进程内共享同一个
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _client_options():
+    # SDK 默认超时 10 分钟、失败重试 2 次；重试与换服务商交给熔断器和回退链
+    return {'timeout': getattr(settings, 'AI_REQUEST_TIMEOUT', 60), 'max_retries': getattr(settings, 'AI_MAX_RETRIES', 0)}
+
+
+def get_openai(api_key, base_url):
+    """获取进程内共享的同步 OpenAI 客户端 (底层连接池线程安全)"""
+    # openai SDK 导入约 0.7 秒 (大量 pydantic 类型)，第一次真正调用模型时才加载
+    from openai import OpenAI
+
+    with _clients_lock:
+        client = _clients.get((api_key, base_url))
+        if client is None:
+            client = _clients[(api_key, base_url)] = OpenAI(api_key=api_key, base_url=base_url, **_client_options())
+        return client
+
+
+async def get_async_openai(api_key, base_url):
+    """获取当前事件循环中共享的 AsyncOpenAI 客户端 (同一循环内的请求共享连接池，循环结束时关闭)"""
+    from openai import AsyncOpenAI
+
+    return await loop_clients.get_or_create(
+        ('openai', api_key, base_url),
+        lambda: AsyncOpenAI(api_key=api_key, base_url=base_url, **_client_options()))
+
+
+@dataclass(frozen=True)
+class Provider:
+    """回退链上的一项：某个服务商的某个模型"""
+    api_key: str
+    base_url: str
+    model: str
+
+
+def _content_of(response):
+    choices = getattr(response, 'choices', None)
+    return choices[0].message.content if choices else None
+
 
 class AIService:
     def __init__(self, user=None):
         self.user = user
         self.client = None
         self.model = "qwen-vl-max"  # 默认
+        self.backend = 'llm'  # 'llm' 看图分析 / 'local' 本地指标分析
+        self.prompt = prompts.get()  # 提示词模板 (AI_PROMPT_VERSION)
 
         # 1. 优先读取用户的配置
         if self.user and hasattr(self.user, 'userprofile'):
             profile = self.user.userprofile
+            self.backend = profile.analyzer_backend
             if profile.api_key:
                 self.api_key = profile.api_key
                 self.base_url = profile.api_base_url
@@ -28,12 +83,14 @@ class AIService:
             self.base_url = getattr(settings, 'AI_BASE_URL', None)
 
         if self.api_key:
-            self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+            self.client = get_openai(self.api_key, self.base_url)
 
+    @timed('b64')
     def _encode_image(self, image_path):
         with open(image_path, "rb") as image_file:
             return base64.b64encode(image_file.read()).decode('utf-8')
 
+    @timed('json-write')
     def _save_json_file(self, result_dict, record_instance):
         """将结果保存到本地 JSON 文件并关联到记录"""
         # 保存前再次确保数据完整性
@@ -55,131 +112,255 @@ class AIService:
         if 'confidence' not in data:
             data['confidence'] = 0  # 默认置信度
 
-    def analyze_and_save(self, image_full_path, record_instance):
-        """分析并保存文件"""
-        result = self.analyze_chart_image(image_full_path)
+    @property
+    def uses_llm(self):
+        """本次分析是否真的会调用大模型 (决定是否需要限速)"""
+        return self.backend != 'local' and self.client is not None
+
+    def analyze_and_save(self, image_full_path, record_instance, symbol=None, compare_with=None):
+        """分析并保存文件；compare_with 为相似图表的历史记录时附上与它的差异"""
+        result = self.analyze_chart_image(image_full_path, symbol=symbol)
+        if compare_with is not None:
+            chart_similarity.annotate_changes(result, compare_with)
         # 保存 JSON 实体文件
         self._save_json_file(result, record_instance)
         return result
 
-    def analyze_chart_image(self, image_full_path):
+    def analyze_chart_image(self, image_full_path, symbol=None):
+        """
+        :param symbol: 可选，股票代码；本地引擎与兜底分析依赖它读取本地行情
+        按回退链依次尝试各服务商 (熔断打开的直接跳过)，全部不可用时改用本地指标分析
+        """
+        if self.backend == 'local':
+            return self._analyze_local(symbol)
         if not self.client:
-            print("⚠️ 无有效 API Key，使用模拟数据")
-            return self._get_mock_data()
-
-        base64_img = self._encode_image(image_full_path)
-
-        # 使用你最新的 Prompt
-        system_prompt = """
-        你是一个严谨、客观的股票交易算法辅助系统，仅提供技术结构分析，不进行投资建议或主观判断。
-
-        【任务】
-        基于输入的股票K线图像，对以下要素进行分析：
-        - 价格趋势、形态与所处阶段
-        - 均线系统结构（短、中、长周期）
-        - 量价配合状态与波动率
-        - 关键支撑与压力位
-        - 潜在技术风险（如乖离、超涨、背离、破位）
-
-        【分析范围限制】
-        - 仅基于图像中的技术信息（K线、均线、成交量、MACD/KDJ等副图如果有）
-        - 不使用、不推断任何基本面、消息面或情绪面信息
-        - 不预测未来，只描述当前技术状态及其逻辑推论
-
-        【输出要求】
-        - 必须且只能输出符合 JSON 语法的字符串
-        - 不得包含 ```json 或任何额外说明文本
-        - 所有数值必须为图像可合理推导的近似值
-        - 不使用“建议”“推荐”“应该”等主观词汇
-
-        【JSON 结构定义】
-        {
-            "symbol": "股票代码或 Unknown",
-            "trend": "Up/Down/Range",
-            "trend_stage": "Early/Middle/Accelerating/Exhaustion/Unknown",
-            "primary_pattern": "识别到的具体形态，如：Double Bottom, Flag, Box, Head and Shoulders, None",
-            "ma_structure": "Bullish/Bearish/Mixed/Tangled",
-            "price_ma_deviation": "Low/Medium/High",
-            "volume_state": "Expanding/Contracting/Neutral/Abnormal",
-            "volatility_status": "Low/Normal/High",
-            "support_levels": [0.0],
-            "resistance_levels": [0.0],
-            "risk_factors": [
-                "Overextended from long-term MA",
-                "Bearish Divergence",
-                "Volume decreasing on rally",
-                "Approaching major resistance"
-            ],
-            "signal": "BUY/SELL/WAIT",
-            "signal_applicable_to": "Holder/NonHolder/Both",
-            "score": 0-100,
-            "confidence": 0-100,
-            "key_levels": {
-                "short_term_hold": 0.0,
-                "trend_invalid": 0.0
-            },
-            "reason": "不超过50字的技术结构性总结，客观描述当前状态与核心矛盾"
-        }
+            logger.warning("无有效 API Key，改用本地指标分析")
+            metrics.analysis_fallback.inc(reason='no_api_key')
+            return self._analyze_local(symbol)
+
+        messages = self._build_messages(self._encode_image(image_full_path), image_full_path)
+        last_error = None
+        for provider in self.providers():
+            breaker = circuit_breaker.get(provider.base_url, provider.model)
+            if not breaker.allow():
+                continue
+            client = get_openai(provider.api_key, provider.base_url)
+            start = time.perf_counter()
+            try:
+                logger.info(f"调用模型: {provider.model} | URL: {provider.base_url}")
+                with span('llm'):
+                    response = client.chat.completions.create(
+                        model=provider.model,
+                        messages=messages,
+                        response_format={"type": "json_object"}
+                    )
+            except Exception as e:
+                last_error = self._call_failed(breaker, provider, e, start)
+                continue
+            self._call_succeeded(breaker, provider, response, start)
+
+            content = _content_of(response)
+            result, missing, repaired = analysis_schema.interpret(content)
+            outcome = 'repaired' if repaired else 'clean'
+            if missing:
+                outcome, missing = 'reasked', self._reask(client, provider, messages, content, result, missing)
+            return self._parse_response(result, missing, outcome, symbol, provider)
+        return self._providers_exhausted(last_error, symbol)
+
+    async def aanalyze_and_save(self, image_full_path, record_instance, symbol=None, compare_with=None):
+        """analyze_and_save 的协程版本 (ASGI 视图使用)"""
+        result = await self.aanalyze_chart_image(image_full_path, symbol=symbol)
+        if compare_with is not None:
+            chart_similarity.annotate_changes(result, compare_with)
+        await sync_to_async(self._save_json_file)(result, record_instance)
+        return result
+
+    def reuse_and_save(self, prior, distance, record_instance):
+        """复用相似图表的历史分析 (不调用模型)，同样保存 JSON 文件"""
+        result = chart_similarity.reused_result(prior, distance)
+        self._save_json_file(result, record_instance)
+        metrics.analysis_total.inc(backend='reused')
+        return result
+
+    async def aanalyze_chart_image(self, image_full_path, symbol=None):
+        """
+        analyze_chart_image 的协程版本：等待模型应答期间不占用线程，一个进程可同时挂起大量分析
+        本地引擎与兜底分析是毫秒级的内存计算，直接在事件循环中执行
         """
+        if self.backend == 'local':
+            return self._analyze_local(symbol)
+        if not self.api_key:
+            logger.warning("无有效 API Key，改用本地指标分析")
+            metrics.analysis_fallback.inc(reason='no_api_key')
+            return self._analyze_local(symbol)
+
+        base64_img = await asyncio.to_thread(self._encode_image, image_full_path)
+        messages = self._build_messages(base64_img, image_full_path)
+        last_error = None
+        for provider in self.providers():
+            breaker = circuit_breaker.get(provider.base_url, provider.model)
+            if not breaker.allow():
+                continue
+            client = await get_async_openai(provider.api_key, provider.base_url)
+            start = time.perf_counter()
+            try:
+                logger.info(f"调用模型: {provider.model} | URL: {provider.base_url}")
+                with span('llm'):
+                    response = await client.chat.completions.create(
+                        model=provider.model,
+                        messages=messages,
+                        response_format={"type": "json_object"}
+                    )
+            except Exception as e:
+                last_error = self._call_failed(breaker, provider, e, start)
+                continue
+            self._call_succeeded(breaker, provider, response, start)
+
+            content = _content_of(response)
+            result, missing, repaired = analysis_schema.interpret(content)
+            outcome = 'repaired' if repaired else 'clean'
+            if missing:
+                outcome, missing = 'reasked', await self._areask(client, provider, messages, content, result, missing)
+            return self._parse_response(result, missing, outcome, symbol, provider)
+        return self._providers_exhausted(last_error, symbol)
+
+    # === 回退链与熔断 ===
+    @property
+    def primary(self):
+        return Provider(self.api_key, self.base_url, self.model)
+
+    def providers(self):
+        """回退链：用户 (或全局) 配置的主模型在前，其后依次是 settings.AI_FALLBACK_CHAIN 中的各项 (去重)"""
+        primary = self.primary
+        chain = [primary]
+        for entry in getattr(settings, 'AI_FALLBACK_CHAIN', ()):
+            base_url = entry.get('base_url', primary.base_url)
+            # 同一服务商的其他模型沿用主配置的 Key；换服务商必须给出自己的 Key
+            api_key = entry.get('api_key') or (primary.api_key if base_url == primary.base_url else None)
+            provider = Provider(api_key, base_url, entry.get('model', primary.model))
+            if api_key and provider not in chain:
+                chain.append(provider)
+        return chain
+
+    def _call_failed(self, breaker, provider, error, start):
+        seconds = time.perf_counter() - start
+        breaker.record(not circuit_breaker.is_provider_fault(error), seconds, error)
+        self._observe_llm(seconds, provider=provider)
+        logger.error(f"API 错误 ({provider.model} @ {provider.base_url}): {error}")
+        return error
+
+    def _call_succeeded(self, breaker, provider, response, start):
+        seconds = time.perf_counter() - start
+        breaker.record(True, seconds)
+        self._observe_llm(seconds, response, provider)
+
+    def _providers_exhausted(self, error, symbol):
+        """回退链上的服务商全部失败或熔断：改用本地指标分析，并在结果里注明原因 (不再静默)"""
+        if error is None:
+            reason, note = 'circuit_open', "大模型服务熔断中"
+        elif "400" in str(error) or "image" in str(error):
+            reason, note = 'api_rejected', "大模型拒绝了该图片"
+        else:
+            reason, note = 'providers_failed', "大模型服务不可用"
+        metrics.analysis_fallback.inc(reason=reason)
+        logger.warning(f"{note}，改用本地指标分析")
+        result = self._analyze_local(symbol)
+        result['fallback'] = f"{note}，已改用本地指标分析"
+        return result
+
+    def _build_messages(self, base64_img, image_full_path):
+        # 服务端渲染的K线图为 PNG，用户上传的截图多为 JPEG
+        mime = "image/png" if image_full_path.lower().endswith(".png") else "image/jpeg"
+        return self.prompt.messages(f"data:{mime};base64,{base64_img}")
 
+    # === 补问：修复后仍缺关键字段时，只让模型补这几个字段 (比整次重新分析少得多的输出 token) ===
+    def _reask_messages(self, messages, content, missing):
+        return self.prompt.reask_messages(messages, content, missing)
+
+    def _reask(self, client, provider, messages, content, result, missing):
+        """补问缺失字段并合并进 result，返回仍缺失的字段 (补问失败按全部缺失处理)"""
+        response, start = None, time.perf_counter()
+        try:
+            with span('llm-reask'):
+                response = client.chat.completions.create(
+                    model=provider.model,
+                    messages=self._reask_messages(messages, content, missing),
+                    response_format={"type": "json_object"}
+                )
+        except Exception as e:
+            logger.warning(f"补问缺失字段失败: {e}")
+            return missing
+        finally:
+            self._observe_llm(time.perf_counter() - start, response, provider)
+        return analysis_schema.merge(result, missing, _content_of(response))
+
+    async def _areask(self, client, provider, messages, content, result, missing):
+        """_reask 的协程版本"""
+        response, start = None, time.perf_counter()
         try:
-            print(f"🚀 调用模型: {self.model} | URL: {self.base_url}")
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": [
-                        {"type": "text", "text": "分析这张图表"},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}},
-                    ]},
-                ],
-                response_format={"type": "json_object"}
-            )
-
-            # 解析结果
-            result = json.loads(response.choices[0].message.content)
-
-            # 【关键修复】在返回给 Views 之前，先注入默认的策略字段
-            # 这样即使 Views 没有进行策略计算，前端也不会因为缺字段而报错
-            self._ensure_safe_data(result)
+            with span('llm-reask'):
+                response = await client.chat.completions.create(
+                    model=provider.model,
+                    messages=self._reask_messages(messages, content, missing),
+                    response_format={"type": "json_object"}
+                )
+        except Exception as e:
+            logger.warning(f"补问缺失字段失败: {e}")
+            return missing
+        finally:
+            self._observe_llm(time.perf_counter() - start, response, provider)
+        return analysis_schema.merge(result, missing, _content_of(response))
 
+    def _parse_response(self, result, missing, outcome, symbol, provider):
+        """
+        :param result: analysis_schema.interpret 校验后的结果；missing 为补问后仍缺的字段
+        :param outcome: clean / repaired / reasked
+        关键字段始终拿不到时改用本地指标分析，不把残缺结果交给策略引擎
+        """
+        if missing:
+            metrics.analysis_parse.inc(outcome='failed')
+            metrics.analysis_fallback.inc(reason='unparseable')
+            logger.warning(f"模型输出缺少字段 {missing}，改用本地指标分析")
+            result = self._analyze_local(symbol)
+            result['fallback'] = "模型输出缺少关键字段，已改用本地指标分析"
             return result
+        metrics.analysis_parse.inc(outcome=outcome)
+        if symbol and result.get('symbol') in (None, '', 'Unknown'):
+            result['symbol'] = symbol
 
-        except Exception as e:
-            print(f"❌ API 错误: {e}")
-            if "400" in str(e) or "image" in str(e):
-                return self._get_mock_data()
-            return {"error": str(e), "signal": "ERROR", "reason": "API连接失败"}
+        # 【关键修复】在返回给 Views 之前，先注入默认的策略字段
+        # 这样即使 Views 没有进行策略计算，前端也不会因为缺字段而报错
+        self._ensure_safe_data(result)
+        result['model'] = provider.model
+        result['prompt_version'] = self.prompt.version
+        if provider != self.primary:
+            result['fallback'] = f"{self.model} 不可用，已改由 {provider.model} 分析"
+        metrics.analysis_total.inc(backend='llm')
+
+        return result
+
+    def _observe_llm(self, seconds, response=None, provider=None):
+        """记录一次大模型调用的耗时与 token 用量 (response 为 None 表示调用失败；cached 为命中服务商前缀缓存的部分)"""
+        provider = provider or self.primary
+        labels = {'model': provider.model, 'provider': metrics.provider_of(provider.base_url)}
+        metrics.llm_request_seconds.observe(seconds, outcome='ok' if response is not None else 'error', **labels)
+        usage = getattr(response, 'usage', None)
+        if usage:
+            metrics.llm_tokens.inc(usage.prompt_tokens or 0, kind='prompt', **labels)
+            metrics.llm_tokens.inc(usage.completion_tokens or 0, kind='completion', **labels)
+            cached = getattr(getattr(usage, 'prompt_tokens_details', None), 'cached_tokens', None)
+            if cached:
+                metrics.llm_tokens.inc(cached, kind='cached', **labels)
 
-    def _get_mock_data(self):
+    @timed('local-analyzer')
+    def _analyze_local(self, symbol):
         """
-        【兜底方案】Mock 数据现在完全匹配最新的 Prompt 结构
+        【兜底方案】由本地K线确定性地计算分析结果 (结构与大模型输出一致)
+        没有代码或本地无行情时返回观望、置信度 0 的结果，不再生成随机数据
         """
-        trend = random.choice(["Upward 📈", "Downward 📉", "Sideways ➡️"])
-        signal = "BUY" if "Up" in trend else ("SELL" if "Down" in trend else "HOLD")
-        score = random.randint(80, 95) if signal == "BUY" else random.randint(40, 60)
-
-        data = {
-            "symbol": "MOCK-TEST",
-            "trend": trend,
-            "trend_stage": "Early",
-            "primary_pattern": "Double Bottom",  # 新增
-            "ma_structure": "Bullish",
-            "price_ma_deviation": "Low",
-            "volume_state": "Expanding",  # 新增
-            "volatility_status": "Normal",  # 新增
-            "support_levels": [10.5, 10.2],
-            "resistance_levels": [12.0, 12.5],
-            "risk_factors": [],
-            "key_levels": {"short_term_hold": 10.0, "trend_invalid": 9.5},
-            "score": score,
-            "confidence": 92,  # 新增
-            "signal": signal,
-            "reason": "【模拟模式】API 调用异常（Key无效或额度超限），仅展示演示数据。",
-
-            # 策略字段
-            "final_signal": signal,
-            "raw_signal": signal,
-            "strategy_reason": "模拟数据默认通过策略"
-        }
-        return data
\ No newline at end of file
+        from . import local_analyzer  # 依赖 numpy，用到时才导入
+
+        result = local_analyzer.analyze_symbol(symbol)
+        metrics.analysis_total.inc(backend='local')
+        self._ensure_safe_data(result)
+        return result
\ No newline at end of file
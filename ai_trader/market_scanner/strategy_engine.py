@@ -1,4 +1,7 @@
 # market_scanner/strategy_engine.py
+from . import metrics
+from .profiling import timed
+
 
 class StrategyEngine:
     def __init__(self, user):
@@ -9,11 +12,17 @@ class StrategyEngine:
             from .models import StrategyConfig
             self.config = StrategyConfig()
 
+    @timed('strategy')
     def evaluate(self, ai_json):
         """
         输入: AI 分析的原始 JSON
         输出: (Final_Signal, Reason_String)
         """
+        final_signal, reason = self._evaluate(ai_json)
+        metrics.strategy_verdicts.inc(raw=str(ai_json.get('signal', 'WAIT')).upper(), final=final_signal)
+        return final_signal, reason
+
+    def _evaluate(self, ai_json):
         # 1. 提取 AI 数据 (增加 confidence 和 volatility 读取)
         ai_score = ai_json.get('score', 0)
         ai_signal = ai_json.get('signal', 'WAIT').upper()
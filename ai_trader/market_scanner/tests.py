@@ -1,3 +1,83 @@
-from django.test import TestCase
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
 
-# Create your tests here.
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from .market_data import BarStore
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 启动耗时预算 (毫秒)：django.setup() + 加载 URLconf 时全部模块导入耗时之和 (-X importtime 的 self 列)
+# 可用环境变量 IMPORT_BUDGET_MS 覆盖 (例如较慢的 CI 机器)
+IMPORT_BUDGET_MS = float(os.environ.get('IMPORT_BUDGET_MS', 800))
+# 只在真正用到时才加载的重型依赖，不应出现在启动阶段
+LAZY_MODULES = ('openai', 'requests', 'httpx', 'numpy')
+
+STARTUP_SCRIPT = (
+    "import sys, django; django.setup(); "
+    "from django.urls import get_resolver; get_resolver().url_patterns; "
+    "print(','.join(m for m in %r if m in sys.modules))" % (LAZY_MODULES,)
+)
+
+
+class StartupImportTimeTests(SimpleTestCase):
+    """在新解释器里测 Web 进程 / 管理命令的启动导入耗时 (自动扩容冷启动与短命 manage.py 任务都付这笔钱)"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p),
+                   DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'ai_trader.settings'))
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT], cwd=settings.BASE_DIR,
+                              env=env, capture_output=True, text=True, timeout=120)
+        if proc.returncode != 0:
+            raise AssertionError(proc.stderr[-2000:])
+        cls.loaded = [m for m in proc.stdout.strip().split(',') if m]
+        cls.imports = []  # (自身耗时微秒, 累计耗时微秒, 模块名)
+        for line in proc.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative_us, name = (part.strip() for part in line[len('import time:'):].split('|'))
+            cls.imports.append((int(self_us), int(cumulative_us), name))
+
+    def test_heavy_sdks_are_not_imported_at_startup(self):
+        self.assertEqual(self.loaded, [], "这些依赖应在首次使用时再导入")
+
+    def test_startup_import_time_within_budget(self):
+        total_ms = sum(self_us for self_us, _, _ in self.imports) / 1000
+        slowest = sorted(self.imports, key=lambda row: row[1], reverse=True)[:10]
+        detail = "\n".join(f"  {cumulative / 1000:8.1f} ms  {name.strip()}" for _, cumulative, name in slowest)
+        self.assertLessEqual(total_ms, IMPORT_BUDGET_MS,
+                             f"启动导入耗时 {total_ms:.0f} ms 超出预算 {IMPORT_BUDGET_MS:.0f} ms，累计耗时最多的模块:\n{detail}")
+
+
+@unittest.skipIf(resource is None, "需要 RLIMIT_NOFILE")
+class BarStoreFileDescriptorTests(SimpleTestCase):
+    """每个映射占一个文件描述符：读取的标的数远超描述符上限时，映射缓存不能把进程的描述符耗尽 (EMFILE)"""
+
+    SYMBOLS = 400
+    NOFILE = 256
+
+    def test_reading_more_symbols_than_the_budget(self):
+        with tempfile.TemporaryDirectory() as root:
+            BarStore(root=root).append_many(
+                {f"{600000 + i:06d}": ([1, 2], [i, i], [i, i], [i, i], [i, i + 0.5], [1, 1]) for i in range(self.SYMBOLS)})
+
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(self.NOFILE, soft), hard))
+            try:
+                store = BarStore(root=root)
+                closes = [store.latest_close(symbol) for symbol in store.symbols()]
+            finally:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+        self.assertEqual(closes, [i + 0.5 for i in range(self.SYMBOLS)])
+        self.assertLess(store.cache_size, self.SYMBOLS)
+        self.assertLessEqual(len(store._maps), store.cache_size)
@@ -1,44 +1,72 @@
+import asyncio
 import json
+import logging
 import re
+from contextlib import nullcontext
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
-from openai import OpenAI  # 用于测试连接获取模型
+from django.views.decorators.http import condition
 
-from .models import AnalysisRecord, UserProfile
+from .models import AnalysisRecord, UserProfile, Position
 from .forms import ImageUploadForm
 from .services import AIService
 from .strategy_engine import StrategyEngine
-from .gtja_api import GTJAClient
-def dashboard(request):
-    """主界面视图：支持上传分析 和 历史回看"""
+from .broker_gateway import get_gateway as get_broker_gateway
+from .profiling import span
+from . import analysis_scheduler, chart_similarity, circuit_breaker, fragment_cache, metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _image_hash(uploaded):
+    """上传图片的感知哈希；无法解码时返回空串 (不参与查重)"""
+    try:
+        return chart_similarity.dhash(uploaded)
+    except Exception as e:
+        logger.warning("计算图像哈希失败: %s", e)
+        return ''
+
+
+def _read_field_file(field_file):
+    """读取 FileField 的全部内容 (文件 I/O，供 async 视图经 sync_to_async 调用)"""
+    # 【修正点】使用 'rb' (二进制) 模式打开，然后手动 decode('utf-8')
+    field_file.open('rb')
+    try:
+        return field_file.read()
+    finally:
+        field_file.close()  # 记得关闭文件句柄
+
+
+async def dashboard(request):
+    """主界面视图：支持上传分析 和 历史回看 (async：等待模型应答时不占用工作线程)"""
     result_data = None
     latest_record = None
     form = ImageUploadForm()
     history = []
 
     # 1. 基础权限检查
-    if request.user.is_authenticated:
-        # 获取该用户的所有历史记录
-        history = AnalysisRecord.objects.filter(user=request.user).order_by('-created_at')[:20]  # 显示最近20条
+    user = await request.auser()
+    if user.is_authenticated:
+        # 获取该用户的所有历史记录 (惰性查询，渲染模板时才执行)
+        history = _history(user, 20)  # 显示最近20条
 
         # === 核心修改 A: 处理历史记录回看 (GET 请求带 view_id) ===
         view_id = request.GET.get('view_id')
         if view_id:
             try:
                 # 获取指定的记录 (必须是当前用户的，防止越权查看)
-                record_obj = AnalysisRecord.objects.get(pk=view_id, user=request.user)
+                record_obj = await AnalysisRecord.objects.aget(pk=view_id, user=user)
 
                 # 读取关联的 JSON 文件
                 if record_obj.json_file:
                     try:
-                        # 【修正点】使用 'rb' (二进制) 模式打开，然后手动 decode('utf-8')
-                        record_obj.json_file.open('rb')
-                        file_content = record_obj.json_file.read()
-                        record_obj.json_file.close()  # 记得关闭文件句柄
+                        file_content = await sync_to_async(_read_field_file)(record_obj.json_file)
 
                         # 将二进制数据解码为字符串，再解析 JSON
                         result_data = json.loads(file_content.decode('utf-8'))
@@ -62,17 +90,39 @@ def dashboard(request):
             form = ImageUploadForm(request.POST, request.FILES)
             if form.is_valid():
                 record = form.save(commit=False)
-                record.user = request.user
-                record.save()
-
-                ai_service = AIService(user=request.user)
+                record.user = user
+                symbol = form.cleaned_data.get('symbol') or None
+                with span('image-hash'):
+                    record.image_hash = await sync_to_async(_image_hash)(form.cleaned_data['chart_image'])
+                with span('file-save'):
+                    await record.asave()
+
+                ai_service = await sync_to_async(AIService)(user=user)
+                # 大模型分析排队领取执行名额：页面上传优先于扫描等批量任务，同时受每用户并发上限约束
+                slot = analysis_scheduler.get().aslot(
+                    analysis_scheduler.user_key(user), analysis_scheduler.INTERACTIVE,
+                    timeout=getattr(settings, 'ANALYSIS_QUEUE_TIMEOUT', None)) if ai_service.uses_llm else nullcontext()
 
                 try:
+                    # 0. 窗口期内有相似图表 (同一张图晚些的截图) 的分析时直接复用，除非用户要求重新分析
+                    prior, distance = None, None
+                    if ai_service.uses_llm:
+                        prior, distance = await sync_to_async(chart_similarity.find_reusable)(
+                            user, record.image_hash, symbol, exclude_id=record.pk)
+                    force = form.cleaned_data.get('force_refresh')
+                    metrics.analysis_reuse.inc(outcome='miss' if prior is None else 'forced' if force else 'reused')
+
                     # 1. AI 分析
-                    analysis_result = ai_service.analyze_and_save(record.chart_image.path, record)
+                    if prior is not None and not force:
+                        analysis_result = await sync_to_async(ai_service.reuse_and_save)(prior, distance, record)
+                        record.reused_from = prior
+                    else:
+                        async with slot:
+                            analysis_result = await ai_service.aanalyze_and_save(
+                                record.chart_image.path, record, symbol=symbol, compare_with=prior)
 
                     # 2. === 策略引擎介入 ===
-                    engine = StrategyEngine(request.user)
+                    engine = await sync_to_async(StrategyEngine)(user)
                     final_sig, reason = engine.evaluate(analysis_result)
 
                     # 3. 保存结果
@@ -80,7 +130,7 @@ def dashboard(request):
                     record.raw_signal = analysis_result.get('signal', 'N/A')  # AI 原始
                     record.final_signal = final_sig  # 策略最终
                     record.strategy_reason = reason  # 判定理由
-                    record.save()
+                    await record.asave()
 
                     # 把策略结果也塞进 result_data 传给前端显示
                     result_data = analysis_result
@@ -92,13 +142,65 @@ def dashboard(request):
                     # 错误处理
                     result_data = {"error": str(e), "signal": "ERROR", "reason": "分析过程出错"}
 
-    return render(request, 'scanner/dashboard.html', {
-        'form': form,
-        'result': result_data,
-        'record': latest_record,
-        'history': history,
-        'user': request.user
-    })
+    # 模板里会访问 user.userprofile 等关联对象，渲染放到线程里执行
+    with span('render'):
+        return await sync_to_async(_render_dashboard)(request, {
+            'form': form,
+            'result': result_data,
+            'record': latest_record,
+            'history': history,
+            'user': user
+        })
+
+
+def _history(user, limit):
+    return AnalysisRecord.objects.filter(user=user).order_by('-created_at')[:limit]
+
+
+def _account_summary(user):
+    """账户概览 (模板里的片段缓存未命中时才会调用并查库)"""
+    account = VirtualAccount.objects.filter(user=user).first()
+    return {
+        'is_simulation': account.is_simulation if account else True,
+        'balance': account.balance if account else 0,
+        'total_assets': account.total_assets if account else 0,
+        'positions': Position.objects.filter(user=user).exclude(quantity=0).count(),
+        'pending_orders': PaperOrder.objects.filter(user=user, status__in=('PENDING', 'PARTIAL')).count(),
+    }
+
+
+def _render_dashboard(request, context):
+    """渲染控制台 (在线程中执行)：账户概览与历史列表走按用户版本号失效的片段缓存"""
+    user = context['user']
+    context['fragment_ttl'] = getattr(settings, 'DASHBOARD_FRAGMENT_TTL', 600)
+    if user.is_authenticated:
+        context['fragment_version'] = fragment_cache.version(user.id)
+        context['account_summary'] = lambda: _account_summary(user)
+    return render(request, 'scanner/dashboard.html', context)
+
+
+def _history_limit(request):
+    try:
+        return max(1, min(int(request.GET.get('limit', 20)), 100))
+    except ValueError:
+        return 20
+
+
+def _history_etag(request):
+    if not request.user.is_authenticated:
+        return None
+    return f'"{request.user.id}-{fragment_cache.version(request.user.id)}-{_history_limit(request)}"'
+
+
+@login_required
+@condition(etag_func=_history_etag)
+def api_history(request):
+    """历史记录列表 (JSON)；带 If-None-Match 且数据未变时直接返回 304，不查询记录"""
+    rows = _history(request.user, _history_limit(request)).values(
+        'id', 'created_at', 'raw_signal', 'final_signal', 'strategy_reason')
+    return JsonResponse({'status': 'success', 'records': [
+        {**row, 'created_at': row['created_at'].isoformat()} for row in rows
+    ]})
 
 # === 用户认证 API (AJAX) ===
 @csrf_exempt
@@ -167,7 +269,7 @@ def api_logout(request):
 
 @login_required
 @csrf_exempt
-def fetch_external_models(request):
+async def fetch_external_models(request):
     """筛选视觉模型"""
     if request.method == 'POST':
         data = json.loads(request.body)
@@ -177,8 +279,10 @@ def fetch_external_models(request):
         VISION_KEYWORDS = ['vl', 'vision', 'gpt-4o', 'omni', 'gemini', 'claude-3', 'llava']
 
         try:
-            client = OpenAI(api_key=api_key, base_url=base_url)
-            models_list = client.models.list()
+            from openai import AsyncOpenAI  # 用于测试连接获取模型 (SDK 较重，用到时才导入)
+
+            async with AsyncOpenAI(api_key=api_key, base_url=base_url) as client:
+                models_list = await client.models.list()
             vision_models = []
             all_models = []
 
@@ -209,6 +313,8 @@ def save_settings(request):
         profile.api_key = data.get('api_key')
         profile.api_base_url = data.get('base_url')
         profile.selected_model = data.get('model')
+        if data.get('analyzer_backend') in dict(UserProfile.ANALYZER_CHOICES):
+            profile.analyzer_backend = data['analyzer_backend']
         profile.save()
         return JsonResponse({'status': 'success'})
 
@@ -243,8 +349,12 @@ def delete_record(request, pk):
     return redirect('dashboard')
 
 
-from .models import VirtualAccount, PaperOrder
+from .models import VirtualAccount, PaperOrder, OrderFill
+from .positions import apply_fill, get_sellable
+from .idempotency import idempotent
+from django.db import transaction
 from decimal import Decimal
+from datetime import datetime, timezone as dt_timezone
 
 
 @login_required
@@ -256,8 +366,7 @@ def trade_ticket_view(request, record_id):
     ai_data = {}
     if record.json_file:
         try:
-            record.json_file.open('rb')
-            ai_data = json.loads(record.json_file.read().decode('utf-8'))
+            ai_data = json.loads(_read_field_file(record.json_file).decode('utf-8'))
         except:
             ai_data = record.ai_result or {}
     else:
@@ -269,7 +378,15 @@ def trade_ticket_view(request, record_id):
     # 提取 AI 推荐值
     symbol = ai_data.get('symbol', 'UNKNOWN')
 
-    # 智能提取价格：模拟当前价（实际应从行情API获取，这里暂时假设可以手动填）
+    # 价格：优先取本地行情库的最新收盘价，没有该标的数据时由用户手动填写
+    from .market_data import get_store as get_market_data  # 行情库依赖 numpy，用到时才导入
+
+    last_price, last_bar_time = None, None
+    bars = get_market_data().read(symbol, last=1)
+    if bars is not None and len(bars):
+        last_price = round(float(bars.close[-1]), 2)
+        last_bar_time = datetime.fromtimestamp(int(bars.ts[-1]), tz=dt_timezone.utc)
+
     # 智能提取止损：取 key_levels.trend_invalid 或 support_levels[0]
     stop_loss_rec = 0
     key_levels = ai_data.get('key_levels', {})
@@ -292,6 +409,8 @@ def trade_ticket_view(request, record_id):
         'symbol': symbol,
         'rec_sl': stop_loss_rec,
         'rec_tp': take_profit_rec,
+        'last_price': last_price,
+        'last_bar_time': last_bar_time,
         'final_signal': getattr(record, 'final_signal', 'WAIT')
     }
     return render(request, 'scanner/trade_ticket.html', context)
@@ -299,70 +418,181 @@ def trade_ticket_view(request, record_id):
 
 @login_required
 @csrf_exempt
-def execute_paper_order(request):
-    """执行订单 (支持 模拟盘 和 实盘)"""
+@idempotent
+async def execute_paper_order(request):
+    """执行订单 (支持 模拟盘 和 实盘)；async：等待券商应答时不占用工作线程"""
     if request.method == 'POST':
         data = json.loads(request.body)
-        user = request.user
-        account = user.virtualaccount  # 获取账户
+        user = await request.auser()
+        account = await VirtualAccount.objects.aget(user=user)  # 获取账户
 
         symbol = data.get('symbol')
         price = Decimal(data.get('price'))
         qty = int(data.get('quantity'))
-        direction = "BUY"  # 默认买入
+        direction = (data.get('direction') or "BUY").upper()  # 默认买入
+        stop_loss = Decimal(str(data['stop_loss'])) if data.get('stop_loss') else None
+        take_profit = Decimal(str(data['take_profit'])) if data.get('take_profit') else None
+        if direction not in ("BUY", "SELL"):
+            metrics.orders_total.inc(mode='sim' if account.is_simulation else 'live', order_type='-', outcome='invalid')
+            return JsonResponse({'status': 'error', 'message': f'不支持的委托方向: {direction}'})
 
         # === 分支逻辑 ===
         if not account.is_simulation:
             # >>>>> 进入实盘模式 <<<<<
             if not (account.broker_app_id and account.broker_app_secret):
+                metrics.orders_total.inc(mode='live', order_type='LIMIT', outcome='not_configured')
                 return JsonResponse({'status': 'error', 'message': '实盘交易失败：未配置 GTJA API 密钥'})
 
             try:
-                # 初始化客户端
-                client = GTJAClient(
-                    app_id=account.broker_app_id,
-                    app_secret=account.broker_app_secret,
-                    customer_id=account.broker_customer_id
-                )
-
-                # 发送真实请求
-                result = client.place_order(symbol, price, qty, direction)
-
-                if "error" in result:
-                    return JsonResponse({'status': 'error', 'message': f"券商拒单: {result.get('message')}"})
-
-                # 记录实盘订单 (建议新建一个 RealOrder 模型，或者在 PaperOrder 加个标记)
-                PaperOrder.objects.create(
+                # 经网关批量下单 (同一时间窗内的委托合并为一次请求)，成交状态由网关轮询回写
+                gateway = await sync_to_async(get_broker_gateway)()  # 首次调用会查库恢复在途委托
+                # 先落库 PENDING 委托再提交：等待超时后券商仍可能下单成功，网关收到应答时回填合同号并跟踪
+                order = await PaperOrder.objects.acreate(
                     user=user,
                     symbol=symbol,
+                    direction=direction,
+                    order_type="LIMIT",
                     quantity=qty,
                     price=price,
-                    status='FILLED',  # 需根据 API 返回状态更新
+                    stop_loss=stop_loss,
+                    take_profit=take_profit,
+                    status='PENDING',  # 由网关批量查询后更新
                     commission=0,  # 实盘佣金需查交割单
                     analysis_record_id=data.get('record_id')
                 )
-
-                return JsonResponse({'status': 'success', 'message': f'实盘委托成功！合同号: {result.get("order_id")}'})
-
+                future = gateway.submit(account, symbol, price, qty, direction, paper_order=order)
+                # 挂起等待网关回填结果；shield 防止超时取消掉网关仍会回填的 Future
+                with span('broker-wait'):
+                    result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)),
+                                                    timeout=getattr(settings, 'BROKER_SUBMIT_TIMEOUT', 30))
+            except asyncio.TimeoutError:
+                metrics.orders_total.inc(mode='live', order_type='LIMIT', outcome='timeout')
+                return JsonResponse({'status': 'pending', 'order_id': order.id,
+                                     'message': f'券商应答超时，委托 #{order.id} 已登记，收到应答后自动回填合同号并跟踪'})
             except Exception as e:
+                metrics.orders_total.inc(mode='live', order_type='LIMIT', outcome='error')
                 return JsonResponse({'status': 'error', 'message': f'实盘接口异常: {str(e)}'})
 
+            if result.get("status") == "error":
+                metrics.orders_total.inc(mode='live', order_type='LIMIT', outcome='rejected')
+                return JsonResponse({'status': 'error', 'message': f"券商拒单: {result.get('message')}"})
+            if result.get("status") == "unknown":
+                # 请求可能已到达券商但没有应答 (下单不重试)：委托保持 PENDING、没有合同号，留待对账
+                metrics.orders_total.inc(mode='live', order_type='LIMIT', outcome='unknown')
+                return JsonResponse({'status': 'error', 'message': f"委托结果未知 ({result.get('message')})，"
+                                     f"已记为待核对委托 #{order.id}，请先在券商端确认，不要直接重下"})
+
+            metrics.orders_total.inc(mode='live', order_type='LIMIT', outcome='submitted')
+            return JsonResponse({'status': 'success', 'message': f'实盘委托成功！合同号: {result.get("order_id")}'})
+
         else:
-            # >>>>> 保持原有的模拟盘逻辑 <<<<<
-            total_cost = price * qty
+            with span('sim-fill'):
+                return await sync_to_async(_execute_simulated)(user, account, data, symbol, price, qty, direction,
+                                                               stop_loss, take_profit)
+
+
+def _execute_simulated(user, account, data, symbol, price, qty, direction, stop_loss, take_profit):
+    """模拟盘下单 (同步：事务与行锁在线程中执行)"""
+    # >>>>> 模拟盘：资金、订单、持仓在同一事务内更新 <<<<<
+    # 市价单按输入价立即成交；限价单挂入撮合引擎 (PENDING)，买单先冻结 委托价 x 数量，卖单占用可卖数量
+    order_type = (data.get('order_type') or "MARKET").upper()
+    total_cost = price * qty
+    with transaction.atomic():
+        account = VirtualAccount.objects.select_for_update().get(pk=account.pk)
+
+        if direction == "BUY":
             if account.balance < total_cost:
+                metrics.orders_total.inc(mode='sim', order_type=order_type, outcome='rejected')
                 return JsonResponse({'status': 'error', 'message': f'模拟资金不足！可用: {account.balance}'})
-
             account.balance -= total_cost
-            account.save()
-
-            PaperOrder.objects.create(
+        else:
+            # 可卖数量扣除未成交的卖单 (账户行锁让同一用户的下单串行，检查与挂单之间不会被插入)
+            sellable = get_sellable(user, symbol)
+            if sellable < qty:
+                metrics.orders_total.inc(mode='sim', order_type=order_type, outcome='rejected')
+                return JsonResponse({'status': 'error', 'message': f'可卖持仓不足！当前可卖: {sellable}'})
+            if order_type == "MARKET":
+                account.balance += total_cost
+        account.save()
+
+        if order_type == "LIMIT":
+            order = PaperOrder.objects.create(
                 user=user,
                 analysis_record_id=data.get('record_id'),
                 symbol=symbol,
+                direction=direction,
+                order_type="LIMIT",
                 quantity=qty,
                 price=price,
-                status='FILLED'
+                stop_loss=stop_loss,
+                take_profit=take_profit,
+                status='PENDING',
+                commission=0  # 由撮合引擎按成交计佣
             )
+            metrics.orders_total.inc(mode='sim', order_type=order_type, outcome='pending')
+            return JsonResponse({'status': 'success', 'order_id': order.id, 'order_status': order.status,
+                                 'new_balance': str(account.balance)})
+
+        order = PaperOrder.objects.create(
+            user=user,
+            analysis_record_id=data.get('record_id'),
+            symbol=symbol,
+            direction=direction,
+            quantity=qty,
+            price=price,
+            stop_loss=stop_loss,
+            take_profit=take_profit,
+            filled_quantity=qty,
+            avg_fill_price=price,
+            status='FILLED'
+        )
+        OrderFill.objects.create(order=order, quantity=qty, price=price,
+                                 commission=order.commission, filled_at=order.created_at)
+        apply_fill(user, symbol, direction, qty, price, order.commission)
+
+    metrics.orders_total.inc(mode='sim', order_type=order_type, outcome='filled')
+    return JsonResponse({'status': 'success', 'new_balance': str(account.balance)})
+
+
+# === 运维接口 (Prometheus 抓取、熔断器状态、分析调度) ===
+def _ops_allowed(request):
+    """配置了 METRICS_TOKEN 时需带 Authorization: Bearer <token>，否则只允许本机访问"""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        return request.headers.get('Authorization') == f"Bearer {token}"
+    return request.META.get('REMOTE_ADDR') in ('127.0.0.1', '::1')
+
+
+def metrics_view(request):
+    """Prometheus 文本格式的指标 (合并本机全部工作进程)"""
+    if not _ops_allowed(request):
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.REGISTRY.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 
-            return JsonResponse({'status': 'success', 'new_balance': str(account.balance)})
\ No newline at end of file
+@csrf_exempt
+def ops_breakers(request):
+    """
+    GET: 本进程各大模型服务商熔断器的状态、时间窗内错误率 / 慢调用率与回退链配置
+    POST {"base_url": ..., "model": ...}: 手动复位匹配的熔断器 (都不给则全部复位)
+    多进程部署时每个进程各有一份，这里只反映处理本请求的进程
+    """
+    if not _ops_allowed(request):
+        return HttpResponse(status=403)
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': '请求体不是合法的 JSON'}, status=400)
+        count = circuit_breaker.reset(data.get('base_url'), data.get('model'))
+        return JsonResponse({'status': 'success', 'reset': count})
+    chain = [{'base_url': e.get('base_url'), 'model': e.get('model')}
+             for e in getattr(settings, 'AI_FALLBACK_CHAIN', ())]
+    return JsonResponse({'status': 'success', 'breakers': circuit_breaker.snapshot(), 'fallback_chain': chain})
+
+
+def ops_scheduler(request):
+    """本进程分析调度的名额占用、排队数，以及按 用户 / 优先级 的排队时长分位数 (秒)"""
+    if not _ops_allowed(request):
+        return HttpResponse(status=403)
+    return JsonResponse({'status': 'success', 'scheduler': analysis_scheduler.get().snapshot()})
\ No newline at end of file